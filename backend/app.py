@@ -1,29 +1,113 @@
-from flask import Flask, request, jsonify, session, send_from_directory
-from mongodb_interface import MongoDBInterface
-from gcp.gcpchatbotintegrated import ChatSessionManager
+from flask import Blueprint, Flask, Response, current_app, request, jsonify, session, send_from_directory, stream_with_context
+from observability import setup_logging, new_trace, span, observe_stage, metrics_payload, REQUESTS
+from password_hashing import HashingOverloaded
+from google_token_verifier import CertificatesUnavailable
 import os
+import json
+import uuid
+import time
+import logging
+import threading
+from typing import Optional, Tuple
 
-# Initialize Flask app
-app = Flask(__name__, 
-    static_folder='../frontend-new/build/static',
-    template_folder='../frontend-new/build')
+setup_logging()
+logger = logging.getLogger(__name__)
 
 
-# Initialize interfaces
-mongo_interface = MongoDBInterface()
-session_manager = ChatSessionManager()
+class Services:
+    """The app's heavy clients, each built on first use.
+
+    Importing the app and booting a worker stays cheap: the Mongo interface
+    and the chatbot (Vertex AI, models, classifier, corpus registry) are only
+    imported and constructed when a request first needs them, or by
+    warm_up() off the request path.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._mongo_interface = None
+        self._session_registry = None
+
+    @property
+    def mongo_interface(self):
+        if self._mongo_interface is None:
+            with self._lock:
+                if self._mongo_interface is None:
+                    from mongodb_interface import MongoDBInterface
+                    self._mongo_interface = MongoDBInterface()
+        return self._mongo_interface
+
+    @property
+    def session_registry(self):
+        if self._session_registry is None:
+            with self._lock:
+                if self._session_registry is None:
+                    from gcp.gcpchatbotintegrated import RAGChatbot
+                    from gcp.session_registry import SessionRegistry
+                    self._session_registry = SessionRegistry(
+                        RAGChatbot(),
+                        history_loader=self.mongo_interface.read_chat_messages,
+                        max_sessions=int(os.getenv("MAX_CHAT_SESSIONS", "256")),
+                        ttl=float(os.getenv("CHAT_SESSION_TTL", "1800")),
+                    )
+        return self._session_registry
+
+    def warm_up(self):
+        """Build every client now instead of on the first request.
+
+        Only configuration and read-only state is built; connections, pools
+        and background threads are still created per process on first use,
+        so this is safe to run in the gunicorn master before forking.
+        """
+        started = time.perf_counter()
+        try:
+            self.session_registry.chatbot.warm_up()
+        except Exception as e:
+            logger.error("Warm-up failed, clients will be built on first use: %s", e)
+            return
+        logger.info("Services warmed up in %.2fs", time.perf_counter() - started)
+
+    def warm_up_in_background(self) -> threading.Thread:
+        thread = threading.Thread(target=self.warm_up, name="warm-up", daemon=True)
+        thread.start()
+        return thread
+
+
+services = Services()
+api = Blueprint('api', __name__)
 
 # Serve React App
-@app.route('/', defaults={'path': ''})
-@app.route('/<path:path>')
+@api.route('/', defaults={'path': ''})
+@api.route('/<path:path>')
 def serve(path):
-    if path != "" and os.path.exists(app.static_folder + '/' + path):
-        return send_from_directory(app.static_folder, path)
+    if path != "" and os.path.exists(current_app.static_folder + '/' + path):
+        return send_from_directory(current_app.static_folder, path)
     else:
-        return send_from_directory(app.template_folder, 'index.html')
+        return send_from_directory(current_app.template_folder, 'index.html')
+
+@api.before_app_request
+def start_trace():
+    # Reuse the caller's request id so logs can be joined across services
+    new_trace(request.headers.get('X-Request-ID'))
+
+@api.route('/metrics')
+def metrics():
+    body, content_type = metrics_payload()
+    return Response(body, mimetype=content_type)
+
+@api.app_errorhandler(HashingOverloaded)
+def password_hashing_overloaded(error):
+    # Too many logins in flight; ask the client to retry instead of queueing
+    return jsonify({"message": "Server busy, please try again shortly"}), 503, {"Retry-After": "1"}
+
+@api.app_errorhandler(CertificatesUnavailable)
+def google_certificates_unavailable(error):
+    # Google's certificate endpoint is unreachable; the token itself may be fine
+    logger.warning("Google login unavailable: %s", error)
+    return jsonify({"message": "Google login is temporarily unavailable, please try again shortly"}), 503, {"Retry-After": "5"}
 
 # API Routes
-@app.route('/api/register', methods=['POST'])
+@api.route('/api/register', methods=['POST'])
 def register_user():
     data = request.get_json()
     email = data.get('email')
@@ -32,12 +116,12 @@ def register_user():
     if not email or not password:
         return jsonify({"message": "Email and password are required"}), 400
 
-    if mongo_interface.create_user(email, password):
+    if services.mongo_interface.create_user(email, password):
         return jsonify({"message": "User created successfully"}), 200
     else:
         return jsonify({"message": "Email already exists or invalid email"}), 400
 
-@app.route('/api/login', methods=['POST'])
+@api.route('/api/login', methods=['POST'])
 def login_user():
     data = request.get_json()
     email = data.get('email')
@@ -46,12 +130,13 @@ def login_user():
     if not email or not password:
         return jsonify({"message": "Email and password are required"}), 400
 
-    if mongo_interface.verify_user(email, password):
+    if services.mongo_interface.verify_user(email, password):
+        session['user'] = email
         return jsonify({"message": "Login successful"}), 200
     else:
         return jsonify({"message": "Invalid email or password"}), 401
 
-@app.route('/api/google-login', methods=['POST'])
+@api.route('/api/google-login', methods=['POST'])
 def google_login():
     data = request.get_json()
     token = data.get('token')
@@ -59,40 +144,165 @@ def google_login():
     if not token:
         return jsonify({"message": "Token is required"}), 400
 
-    if mongo_interface.google_login(token):
-        return jsonify({"message": "Google login successful"}), 200
+    email = services.mongo_interface.google_login(token)
+    if email:
+        session['user'] = email
+        return jsonify({"message": "Google login successful", "email": email}), 200
     else:
         return jsonify({"message": "Invalid token"}), 401
 
-@app.route('/api/logout', methods=['POST'])
+@api.route('/api/logout', methods=['POST'])
 def logout_user():
     session.pop('user', None)
     return jsonify({"message": "Logout successful"}), 200
 
-@app.route('/api/check_session', methods=['GET'])
+@api.route('/api/check_session', methods=['GET'])
 def check_session():
     if 'user' in session:
         return jsonify({"logged_in": True, "user": session['user']}), 200
     else:
         return jsonify({"logged_in": False}), 200
 
-@app.route('/api/chat', methods=['POST'])
-def handle_submission():
-    data = request.get_json()
+class ChatRequestError(Exception):
+    """A chat request rejected before it reaches the model"""
+
+    def __init__(self, status: int, payload: dict):
+        super().__init__(payload)
+        self.status = status
+        self.payload = payload
 
-    if not data or 'submittedText' not in data:
-        return jsonify({"error": "Invalid data"}), 400
 
+def parse_chat_request(data: Optional[dict], user: Optional[str], streaming: bool = False) -> Tuple[str, str]:
+    """(submitted_text, chat_id) for a chat message; shared by the Flask and ASGI chat routes.
+
+    ``user`` is the session user: it always comes from the session, so a
+    client can only read and write its own chats.
+    """
+    if not data or 'submittedText' not in data:
+        raise ChatRequestError(400, {"error": "Invalid data"})
+    if not user:
+        raise ChatRequestError(401, {"message": "Login required"})
     submitted_text = data['submittedText']
-    print(f"Received text: {submitted_text}")
-
-    bot_response = session_manager.send_message(submitted_text)
-    print(bot_response)
-    return jsonify({
-        "message": "Submission successful", 
-        "receivedText": submitted_text, 
-        "bot_response": bot_response
-    }), 200
+    chat_id = data.get('chatId') or uuid.uuid4().hex
+    logger.info("Received text for chat %s%s", chat_id, " (streaming)" if streaming else "")
+    logger.debug("Submitted text: %s", submitted_text)
+    return submitted_text, chat_id
+
+def persist_turns(user: str, chat_id: str, submitted_text: str, bot_response: str):
+    # Persist both turns so the conversation can be rebuilt after eviction
+    services.mongo_interface.add_message_to_chat(user, chat_id, submitted_text)
+    services.mongo_interface.add_message_to_chat(user, chat_id, bot_response)
+
+def chat_response(chat_id: str, submitted_text: str, bot_response: str) -> dict:
+    return {
+        "message": "Submission successful",
+        "receivedText": submitted_text,
+        "bot_response": bot_response,
+        "chatId": chat_id
+    }
+
+def chat_failed(chat_id: str) -> dict:
+    # Neither turn is persisted, so the client can resend the message
+    return {"error": "The model could not answer, please try again", "chatId": chat_id}
+
+def stream_done(chat_id: str, submitted_text: str, bot_response: str, state) -> dict:
+    return {
+        "chatId": chat_id,
+        "receivedText": submitted_text,
+        "bot_response": bot_response,
+        "citations": state.citations,
+        "stance": state.stance,
+        "subject": state.subject
+    }
+
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@api.app_errorhandler(ChatRequestError)
+def chat_request_error(error):
+    return jsonify(error.payload), error.status
+
+@api.route('/api/chat', methods=['POST'])
+def handle_submission():
+    user = session.get('user')
+    submitted_text, chat_id = parse_chat_request(request.get_json(silent=True), user)
+
+    try:
+        with span("request", logger):
+            bot_response = services.session_registry.send_message(user, chat_id, submitted_text)
+    except Exception as e:
+        logger.error("Error getting response for chat %s: %s", chat_id, e)
+        REQUESTS.labels("chat", "error").inc()
+        return jsonify(chat_failed(chat_id)), 503
+    logger.debug("Bot response: %s", bot_response)
+    persist_turns(user, chat_id, submitted_text, bot_response)
+    REQUESTS.labels("chat", "ok").inc()
+
+    return jsonify(chat_response(chat_id, submitted_text, bot_response)), 200
+
+@api.route('/api/chats', methods=['GET'])
+def list_chats():
+    user = session.get('user')
+    if not user:
+        return jsonify({"message": "Login required"}), 401
+    return jsonify({"chats": services.mongo_interface.list_chats(user)}), 200
+
+@api.route('/api/chats/<chat_id>/messages', methods=['GET'])
+def get_chat_messages(chat_id):
+    user = session.get('user')
+    if not user:
+        return jsonify({"message": "Login required"}), 401
+    after = request.args.get('after', type=int)
+    limit = max(1, min(request.args.get('limit', 50, type=int), 200))
+    return jsonify(services.mongo_interface.get_chat_page(user, chat_id, after=after, limit=limit)), 200
+
+@api.route('/api/chat/stream', methods=['POST'])
+def handle_streaming_submission():
+    user = session.get('user')
+    submitted_text, chat_id = parse_chat_request(request.get_json(silent=True), user, streaming=True)
+
+    def events():
+        started = time.perf_counter()
+        state = services.session_registry.get_state(user, chat_id)
+        response_text = []
+        try:
+            for text in services.session_registry.stream_message(user, chat_id, submitted_text):
+                response_text.append(text)
+                yield sse_event("chunk", {"text": text})
+        except Exception as e:
+            logger.error("Error streaming response: %s", e)
+            REQUESTS.labels("chat_stream", "error").inc()
+            yield sse_event("error", {"error": str(e), "chatId": chat_id})
+            return
+
+        bot_response = "".join(response_text)
+        persist_turns(user, chat_id, submitted_text, bot_response)
+        observe_stage("request", time.perf_counter() - started)
+        REQUESTS.labels("chat_stream", "ok").inc()
+
+        yield sse_event("done", stream_done(chat_id, submitted_text, bot_response, state))
+
+    return Response(
+        stream_with_context(events()),
+        mimetype='text/event-stream',
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+def create_app() -> Flask:
+    app = Flask(__name__,
+        static_folder='../frontend-new/build/static',
+        template_folder='../frontend-new/build')
+    # Signs the session cookie that carries the logged-in user; must be the same across workers
+    secret_key = os.getenv("SECRET_KEY")
+    if not secret_key:
+        logger.warning("SECRET_KEY is not set; sessions will not survive a restart or span workers")
+        secret_key = os.urandom(32)
+    app.secret_key = secret_key
+    app.config.update(SESSION_COOKIE_HTTPONLY=True, SESSION_COOKIE_SAMESITE="Lax")
+    app.register_blueprint(api)
+    return app
+
+app = create_app()
 
 if __name__ == '__main__':
     app.run(debug=True, port=5000)
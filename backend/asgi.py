@@ -0,0 +1,248 @@
+"""ASGI entry point: chat routes are served by async handlers, every other
+route (including auth) is the unchanged Flask app behind an ASGI adapter.
+
+Run with: gunicorn asgi:application -k uvicorn.workers.UvicornWorker
+"""
+import io
+import os
+import sys
+import json
+import time
+import asyncio
+import logging
+from typing import Callable, List, Optional
+from werkzeug.wrappers import Request
+from app import (create_app, services, sse_event, parse_chat_request, persist_turns, chat_response,
+                 chat_failed, stream_done, ChatRequestError)
+from observability import new_trace, span, observe_stage, REQUESTS
+
+logger = logging.getLogger(__name__)
+
+
+async def read_body(receive) -> bytes:
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            return body
+
+
+def wsgi_environ(scope, body: bytes) -> dict:
+    server = scope.get("server") or ("localhost", 80)
+    client = scope.get("client") or ("", 0)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf-8").decode("latin-1"),
+        "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "REMOTE_ADDR": client[0],
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        # The whole body is already read, so it can be consumed without a Content-Length
+        "wsgi.input_terminated": True,
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    for name, value in scope.get("headers") or []:
+        name = name.decode("latin-1").upper().replace("-", "_")
+        key = name if name in ("CONTENT_TYPE", "CONTENT_LENGTH") else f"HTTP_{name}"
+        value = value.decode("latin-1")
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+class ThreadedWsgiToAsgi:
+    """Serves a WSGI app over ASGI with each request on the default thread pool.
+
+    asgiref's WsgiToAsgi runs every request on one shared thread, which
+    serializes the Flask routes and fails with "would deadlock" for
+    concurrent requests on kept-alive connections; the Flask app is
+    thread-safe, so each request runs on its own pool thread. The request
+    body is read before the app runs; the response is sent as the app
+    yields it, so streamed responses still stream.
+    """
+
+    def __init__(self, wsgi_application):
+        self.wsgi_application = wsgi_application
+
+    async def __call__(self, scope, receive, send):
+        environ = wsgi_environ(scope, await read_body(receive))
+        loop = asyncio.get_running_loop()
+
+        def send_from_thread(message: dict):
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        await asyncio.to_thread(self.run, environ, send_from_thread)
+
+    def run(self, environ: dict, send: Callable[[dict], None]):
+        pending: List[dict] = []
+
+        def start_response(status: str, headers, exc_info=None):
+            if exc_info and not pending:
+                raise exc_info[1].with_traceback(exc_info[2])
+            pending[:] = [{
+                "type": "http.response.start",
+                "status": int(status.split(" ", 1)[0]),
+                "headers": [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in headers],
+            }]
+
+        result = self.wsgi_application(environ, start_response)
+        try:
+            started = False
+            for chunk in result:
+                if not started:
+                    send(pending[0])
+                    started = True
+                if chunk:
+                    send({"type": "http.response.body", "body": chunk, "more_body": True})
+            if not started:
+                send(pending[0])
+            send({"type": "http.response.body", "body": b""})
+        finally:
+            if hasattr(result, "close"):
+                result.close()
+
+
+flask_app = create_app()
+flask_application = ThreadedWsgiToAsgi(flask_app)
+
+
+def session_user(scope) -> Optional[str]:
+    """The logged-in user from the Flask session cookie, as the Flask routes see it"""
+    headers = dict(scope.get("headers") or [])
+    request = Request({"HTTP_COOKIE": headers.get(b"cookie", b"").decode("latin-1")})
+    flask_session = flask_app.session_interface.open_session(flask_app, request)
+    return flask_session.get("user") if flask_session is not None else None
+
+
+async def read_json(receive) -> Optional[dict]:
+    try:
+        return json.loads(await read_body(receive) or b"null")
+    except ValueError:
+        return None
+
+
+async def send_json(send, status: int, payload: dict):
+    body = json.dumps(payload).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+async def get_session_registry():
+    # The first call builds the chatbot, which blocks for a while; keep that off the event loop
+    return await asyncio.to_thread(lambda: services.session_registry)
+
+
+async def handle_chat(scope, receive, send):
+    user = session_user(scope)
+    try:
+        submitted_text, chat_id = parse_chat_request(await read_json(receive), user)
+    except ChatRequestError as e:
+        await send_json(send, e.status, e.payload)
+        return
+
+    try:
+        with span("request", logger):
+            session_registry = await get_session_registry()
+            bot_response = await session_registry.send_message_async(user, chat_id, submitted_text)
+    except Exception as e:
+        logger.error("Error getting response for chat %s: %s", chat_id, e)
+        REQUESTS.labels("chat", "error").inc()
+        await send_json(send, 503, chat_failed(chat_id))
+        return
+    await asyncio.to_thread(persist_turns, user, chat_id, submitted_text, bot_response)
+    REQUESTS.labels("chat", "ok").inc()
+
+    await send_json(send, 200, chat_response(chat_id, submitted_text, bot_response))
+
+
+async def handle_chat_stream(scope, receive, send):
+    user = session_user(scope)
+    try:
+        submitted_text, chat_id = parse_chat_request(await read_json(receive), user, streaming=True)
+    except ChatRequestError as e:
+        await send_json(send, e.status, e.payload)
+        return
+    started = time.perf_counter()
+
+    await send({
+        "type": "http.response.start",
+        "status": 200,
+        "headers": [
+            (b"content-type", b"text/event-stream"),
+            (b"cache-control", b"no-cache"),
+            (b"x-accel-buffering", b"no"),
+        ],
+    })
+
+    async def send_event(event: str, payload: dict, more_body: bool = True):
+        await send({
+            "type": "http.response.body",
+            "body": sse_event(event, payload).encode("utf-8"),
+            "more_body": more_body,
+        })
+
+    session_registry = await get_session_registry()
+    state = await session_registry.get_state_async(user, chat_id)
+    response_text = []
+    try:
+        async for text in session_registry.stream_message_async(user, chat_id, submitted_text):
+            response_text.append(text)
+            await send_event("chunk", {"text": text})
+    except Exception as e:
+        logger.error("Error streaming response: %s", e)
+        REQUESTS.labels("chat_stream", "error").inc()
+        await send_event("error", {"error": str(e), "chatId": chat_id}, more_body=False)
+        return
+
+    bot_response = "".join(response_text)
+    await asyncio.to_thread(persist_turns, user, chat_id, submitted_text, bot_response)
+    observe_stage("request", time.perf_counter() - started)
+    REQUESTS.labels("chat_stream", "ok").inc()
+
+    await send_event("done", stream_done(chat_id, submitted_text, bot_response, state), more_body=False)
+
+
+CHAT_ROUTES = {
+    "/api/chat": handle_chat,
+    "/api/chat/stream": handle_chat_stream,
+}
+
+
+async def handle_lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            # Report ready right away; the clients are built in the background (or on first use)
+            if os.getenv("WARM_UP_ON_START", "1") == "1":
+                services.warm_up_in_background()
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def application(scope, receive, send):
+    if scope["type"] == "lifespan":
+        await handle_lifespan(receive, send)
+        return
+
+    handler = CHAT_ROUTES.get(scope.get("path"))
+    if scope["type"] == "http" and handler and scope["method"] == "POST":
+        headers = dict(scope.get("headers") or [])
+        request_id = headers.get(b"x-request-id")
+        new_trace(request_id.decode("latin-1") if request_id else None)
+        await handler(scope, receive, send)
+    else:
+        await flask_application(scope, receive, send)
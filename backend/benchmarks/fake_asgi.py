@@ -0,0 +1,14 @@
+"""The ASGI app on the fake backend, so a real gunicorn can be run and loaded offline.
+
+Each worker has its own in-memory database (see benchmarks/fake_backend.py),
+so drive load tests against a single worker.
+
+From backend/:
+    gunicorn benchmarks.fake_asgi:application -k uvicorn.workers.UvicornWorker -w 1
+    python -m benchmarks.load_test --url http://127.0.0.1:8000
+"""
+from benchmarks import fake_backend
+
+fake_backend.install()
+
+from asgi import application
@@ -0,0 +1,204 @@
+"""Offline stand-ins for Vertex AI, the RAG corpora and MongoDB, for benchmarks.
+
+install() patches the app's dependencies in place, so importing ``app``
+afterwards builds the real Flask app, session registry and storage code on
+top of a fake Gemini model, a fake corpus registry and an in-memory
+mongomock database. Nothing touches the network.
+
+The database lives in the process that called install(), so forked gunicorn
+workers each get their own copy: a user registered through one worker does
+not exist in another, and cross-worker behaviour is not exercised.
+
+The fake model streams ``tokens`` words per response, ``chunk_tokens`` per
+chunk, after ``first_token_ms`` plus ``retrieval_ms`` for models with a
+retrieval tool, and ``token_ms`` per word. Every response from a
+retrieval-backed model is grounded in a few documents of its corpus.
+"""
+import os
+import re
+import json
+import time
+import asyncio
+import hashlib
+from typing import List, Optional
+from unittest import mock
+import mongomock
+import vertexai
+from google.auth.credentials import AnonymousCredentials
+from vertexai.preview.generative_models import Content, Part
+
+SUBJECT_KEYWORDS = {
+    "abortion": ["abortion", "pro-life", "pro-choice"],
+    "gun_laws": ["gun", "firearm", "second amendment"],
+    "immigration": ["immigra", "border", "refugee"],
+    "artificial_intelligence_regulation": ["artificial intelligence", " ai ", "algorithm"],
+    "universal_basic_income": ["basic income", "ubi"],
+    "universal_healthcare": ["healthcare", "health care", "single-payer"],
+    "gene_editing": ["gene", "crispr", "genetic"],
+}
+
+WORDS = ("evidence suggests that policy outcomes depend on implementation and the studies I reviewed "
+         "show measurable effects on costs access and public safety across several countries").split()
+
+
+class FakeConfig:
+    def __init__(self, first_token_ms: float = 300, token_ms: float = 5, tokens: int = 200,
+                 chunk_tokens: int = 8, retrieval_ms: float = 150, stance_ms: float = 250, documents: int = 3):
+        self.first_token_ms = first_token_ms
+        self.token_ms = token_ms
+        self.tokens = tokens
+        self.chunk_tokens = chunk_tokens
+        self.retrieval_ms = retrieval_ms
+        self.stance_ms = stance_ms
+        self.documents = documents
+
+
+class _Obj:
+    def __init__(self, **fields):
+        self.__dict__.update(fields)
+
+
+def fake_response(text: str, citations: Optional[List[dict]] = None, usage: Optional[tuple] = None):
+    """Shaped like a GenerationResponse: .text, grounding metadata and usage metadata"""
+    chunks = [_Obj(retrieved_context=_Obj(uri=c["uri"], title=c["title"])) for c in citations or []]
+    candidate = _Obj(grounding_metadata=_Obj(grounding_chunks=chunks))
+    usage_metadata = _Obj(prompt_token_count=usage[0], candidates_token_count=usage[1]) if usage else None
+    return _Obj(text=text, candidates=[candidate], usage_metadata=usage_metadata)
+
+
+def corpus_documents(corpus_name: str, count: int) -> List[dict]:
+    """Deterministic document list for a fake corpus"""
+    key = corpus_name.rsplit("/", 1)[-1]
+    return [{"uri": f"gs://benchmark/{key}/paper_{i}.pdf", "title": f"{key.replace('-', ' ')} paper {i}"}
+            for i in range(count)]
+
+
+def detect_subject(text: str) -> str:
+    lowered = f" {text.lower()} "
+    for subject, keywords in SUBJECT_KEYWORDS.items():
+        if any(keyword in lowered for keyword in keywords):
+            return subject
+    subjects = list(SUBJECT_KEYWORDS)
+    return subjects[int(hashlib.md5(text.encode()).hexdigest(), 16) % len(subjects)]
+
+
+class FakeChatSession:
+    def __init__(self, model: "FakeGenerativeModel", history: Optional[List[Content]] = None):
+        self.model = model
+        self.history = list(history or [])
+
+    def _reply(self, prompt: str):
+        """(delay before the first chunk, chunk texts, citations, usage)"""
+        config = self.model.config
+        if "Schema:" in prompt and "stance" in prompt:
+            # Stance analysis: echo the detected subject, always "for" so the bot argues against
+            analyzed = re.search(r"Analyze this text: '(.*)'", prompt, re.S)
+            subject = detect_subject(analyzed.group(1) if analyzed else prompt)
+            text = json.dumps({"stance": "for", "subject": subject})
+            return config.stance_ms / 1000, [text], [], (len(prompt.split()), 12)
+
+        words = [WORDS[i % len(WORDS)] for i in range(config.tokens)]
+        texts = [" ".join(words[i:i + config.chunk_tokens]) + " " for i in range(0, len(words), config.chunk_tokens)]
+        delay = config.first_token_ms / 1000
+        citations = []
+        if self.model.corpus_name:
+            delay += config.retrieval_ms / 1000
+            citations = corpus_documents(self.model.corpus_name, config.documents)
+        history_words = sum(len(p.text.split()) for c in self.history for p in c.parts)
+        return delay, texts, citations, (history_words + len(prompt.split()), config.tokens)
+
+    def _chunks(self, prompt: str):
+        """[(seconds to wait, chunk)], with citations and usage on the last chunk, and the full text"""
+        delay, texts, citations, usage = self._reply(prompt)
+        per_chunk = self.model.config.token_ms / 1000 * self.model.config.chunk_tokens
+        last = len(texts) - 1
+        chunks = [(delay if i == 0 else per_chunk,
+                   fake_response(text, citations if i == last else None, usage if i == last else None))
+                  for i, text in enumerate(texts)]
+        return chunks, "".join(texts)
+
+    def _whole(self, prompt: str):
+        """(total seconds to wait, a single non-streamed response)"""
+        delay, texts, citations, usage = self._reply(prompt)
+        per_chunk = self.model.config.token_ms / 1000 * self.model.config.chunk_tokens
+        return delay + per_chunk * (len(texts) - 1), fake_response("".join(texts), citations, usage)
+
+    def _record(self, prompt: str, text: str):
+        self.history.append(Content(role="user", parts=[Part.from_text(prompt)]))
+        self.history.append(Content(role="model", parts=[Part.from_text(text)]))
+
+    def send_message(self, prompt: str, stream: bool = False):
+        if not stream:
+            wait, response = self._whole(prompt)
+            time.sleep(wait)
+            self._record(prompt, response.text)
+            return response
+
+        chunks, text = self._chunks(prompt)
+
+        def generate():
+            for wait, chunk in chunks:
+                time.sleep(wait)
+                yield chunk
+            self._record(prompt, text)
+        return generate()
+
+    async def send_message_async(self, prompt: str, stream: bool = False):
+        if not stream:
+            wait, response = self._whole(prompt)
+            await asyncio.sleep(wait)
+            self._record(prompt, response.text)
+            return response
+
+        chunks, text = self._chunks(prompt)
+
+        async def generate():
+            for wait, chunk in chunks:
+                await asyncio.sleep(wait)
+                yield chunk
+            self._record(prompt, text)
+        return generate()
+
+
+class FakeGenerativeModel:
+    config = FakeConfig()
+
+    def __init__(self, model_name: str, tools=None, safety_settings=None, **kwargs):
+        self.model_name = model_name
+        self.corpus_name = None
+        for tool in tools or []:
+            # The corpus named in the retrieval tool is all the fake needs
+            corpora = tool._raw_tool.retrieval.vertex_rag_store.rag_corpora
+            if corpora:
+                self.corpus_name = corpora[0]
+
+    def start_chat(self, history: Optional[List[Content]] = None, **kwargs) -> FakeChatSession:
+        return FakeChatSession(self, history)
+
+
+def fake_get_corpus(self, subject: str, stance: str) -> str:
+    """CorpusRegistry.get_corpus without GCS or the RAG API: every corpus already exists"""
+    return f"projects/benchmark/locations/us-central1/ragCorpora/{subject}-{stance}"
+
+
+def install(config: Optional[FakeConfig] = None) -> List[mock._patch]:
+    """Patch Vertex AI, the corpus registry and MongoDB; call before importing ``app``.
+
+    Returns the started patchers so callers can stop them.
+    """
+    FakeGenerativeModel.config = config or FakeConfig()
+    os.environ.setdefault("MONGODB_CONNECTION_STRING", "mongodb://benchmark.invalid")
+    os.environ.setdefault("MONGODB_DB_NAME", "benchmark")
+    vertexai.init(project="benchmark", location="us-central1", credentials=AnonymousCredentials())
+
+    database = mongomock.MongoClient()
+    patchers = [
+        mock.patch("vertexai.init", lambda *args, **kwargs: None),
+        mock.patch("gcp.model_factory.GenerativeModel", FakeGenerativeModel),
+        mock.patch("gcp.corpus_registry.CorpusRegistry.get_corpus", fake_get_corpus),
+        # One in-memory server per process, shared by every client the app creates
+        mock.patch("mongo_client.pymongo.MongoClient", lambda *args, **kwargs: database),
+    ]
+    for patcher in patchers:
+        patcher.start()
+    return patchers
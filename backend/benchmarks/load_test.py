@@ -0,0 +1,283 @@
+"""Load test for the API against the offline fake backend (see benchmarks/fake_backend.py).
+
+Starts the app in-process (the Flask app under a threaded WSGI server, or
+asgi.application under uvicorn), then drives one scenario from
+``--concurrency`` client threads and reports throughput plus p50/p95/p99
+latency and time to first token. Chat scenarios run conversations of
+``--turns`` messages, so openings (stance detection, corpus setup) and
+follow-ups are both covered. Pass ``--url`` to load an already running
+server instead; the fake backend then only applies if that server was
+started with it.
+
+From backend/:
+    python -m benchmarks.load_test --scenario chat-stream --concurrency 16 --requests 400
+    python -m benchmarks.load_test --scenario login --server asgi
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import logging
+import argparse
+import threading
+import http.client
+from urllib.parse import urlsplit
+from typing import List, Optional
+from benchmarks import fake_backend
+
+SCENARIOS = ("chat", "chat-stream", "login", "register")
+
+OPENINGS = [
+    "Gun control saves lives and we need stricter firearm laws.",
+    "Immigration strengthens the economy and borders should stay open to refugees.",
+    "Universal healthcare is a human right and single-payer would lower costs.",
+    "A universal basic income would end poverty.",
+    "Gene editing with CRISPR should be allowed to cure disease.",
+    "Artificial intelligence needs strict regulation before it harms people.",
+    "Abortion is healthcare and should be legal everywhere.",
+    "I think the government should stay out of people's lives.",
+]
+
+FOLLOW_UPS = [
+    "What evidence supports that?",
+    "That ignores the costs involved.",
+    "How does this work in other countries?",
+    "Isn't that just an opinion?",
+]
+
+PASSWORD = "benchmark-password"
+
+
+class Result:
+    def __init__(self, latency: float, ttft: float, ok: bool, opening: bool):
+        self.latency = latency
+        self.ttft = ttft
+        self.ok = ok
+        self.opening = opening
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Nearest-rank percentile; NaN for no values"""
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(q / 100 * len(ordered) + 0.5)) - 1))]
+
+
+class Client:
+    """One keep-alive connection per client thread, carrying the session cookie set at login"""
+
+    def __init__(self, base_url: str, timeout: float = 120):
+        parts = urlsplit(base_url)
+        self.host, self.port = parts.hostname, parts.port or 80
+        self.timeout = timeout
+        self.connection: Optional[http.client.HTTPConnection] = None
+        self.cookie: Optional[str] = None
+
+    def _connection(self) -> http.client.HTTPConnection:
+        if self.connection is None:
+            self.connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        return self.connection
+
+    def post(self, path: str, payload: dict, stream: bool = False):
+        """Send one request and return (status, seconds to first body chunk or event, total seconds).
+
+        The status is 0 when no response came back (connection refused, reset or
+        timed out), so the caller counts an error instead of the thread dying.
+        """
+        body = json.dumps(payload)
+        headers = {"Content-Type": "application/json", "X-Request-ID": uuid.uuid4().hex[:16]}
+        if self.cookie:
+            headers["Cookie"] = self.cookie
+        start = time.perf_counter()
+        try:
+            try:
+                response = self._request(path, body, headers)
+            except (ConnectionError, http.client.HTTPException):
+                # The server closed the kept-alive connection; retry once on a new one
+                self.close()
+                response = self._request(path, body, headers)
+
+            first = None
+            if stream:
+                while True:
+                    line = response.readline()
+                    if not line:
+                        break
+                    if first is None and line.startswith(b"event: chunk"):
+                        first = time.perf_counter() - start
+            else:
+                response.read()
+        except (OSError, http.client.HTTPException):
+            # socket.timeout is an OSError too
+            self.close()
+            total = time.perf_counter() - start
+            return 0, total, total
+        total = time.perf_counter() - start
+        set_cookie = response.getheader("Set-Cookie")
+        if set_cookie:
+            self.cookie = set_cookie.split(";", 1)[0]
+        if response.will_close:
+            self.close()
+        return response.status, first if first is not None else total, total
+
+    def _request(self, path: str, body: str, headers: dict) -> http.client.HTTPResponse:
+        connection = self._connection()
+        connection.request("POST", path, body=body, headers=headers)
+        return connection.getresponse()
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+
+def register_users(base_url: str, users: List[str]):
+    client = Client(base_url)
+    for user in users:
+        client.post("/api/register", {"email": user, "password": PASSWORD})
+    client.close()
+
+
+def run_worker(worker: int, base_url: str, scenario: str, turns: int, requests: int, results: List[Result]):
+    client = Client(base_url)
+    user = f"user{worker}@benchmark.test"
+    done = 0
+    conversation = 0
+    if scenario in ("chat", "chat-stream"):
+        # Chats belong to the session user
+        client.post("/api/login", {"email": user, "password": PASSWORD})
+    while done < requests:
+        if scenario in ("chat", "chat-stream"):
+            stream = scenario == "chat-stream"
+            chat_id = uuid.uuid4().hex
+            for turn in range(min(turns, requests - done)):
+                opening = turn == 0
+                text = (OPENINGS[(worker + conversation) % len(OPENINGS)] if opening
+                        else FOLLOW_UPS[(turn - 1) % len(FOLLOW_UPS)])
+                path = "/api/chat/stream" if stream else "/api/chat"
+                status, ttft, latency = client.post(
+                    path, {"submittedText": text, "chatId": chat_id}, stream=stream
+                )
+                results.append(Result(latency, ttft, status == 200, opening))
+                done += 1
+            conversation += 1
+        else:
+            email = f"new{worker}-{done}-{uuid.uuid4().hex[:6]}@benchmark.test" if scenario == "register" else user
+            path = "/api/register" if scenario == "register" else "/api/login"
+            status, ttft, latency = client.post(path, {"email": email, "password": PASSWORD})
+            results.append(Result(latency, ttft, status == 200, False))
+            done += 1
+    client.close()
+
+
+def serve_in_process(server: str) -> str:
+    """Start the app on a free local port in a background thread and return its base URL"""
+    if server == "asgi":
+        import socket
+        import uvicorn
+        from asgi import application
+        sock = socket.socket()
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+        config = uvicorn.Config(application, log_level="warning", lifespan="off", backlog=1024)
+        uvicorn_server = uvicorn.Server(config)
+        threading.Thread(target=uvicorn_server.run, kwargs={"sockets": [sock]}, daemon=True).start()
+        while not uvicorn_server.started:
+            time.sleep(0.01)
+    else:
+        from werkzeug.serving import make_server, WSGIRequestHandler
+        from app import app
+        # HTTP/1.1 so client connections are kept alive, as behind a real server
+        WSGIRequestHandler.protocol_version = "HTTP/1.1"
+        wsgi_server = make_server("127.0.0.1", 0, app, threaded=True)
+        port = wsgi_server.server_port
+        threading.Thread(target=wsgi_server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{port}"
+
+
+def summarize(label: str, results: List[Result], elapsed: float) -> dict:
+    latencies = [r.latency * 1000 for r in results]
+    ttfts = [r.ttft * 1000 for r in results]
+    return {
+        "label": label,
+        "requests": len(results),
+        "errors": sum(not r.ok for r in results),
+        "throughput": len(results) / elapsed if elapsed else 0.0,
+        "latency_ms": {f"p{q}": percentile(latencies, q) for q in (50, 95, 99)},
+        "ttft_ms": {f"p{q}": percentile(ttfts, q) for q in (50, 95, 99)},
+    }
+
+
+def print_summary(summary: dict):
+    latency, ttft = summary["latency_ms"], summary["ttft_ms"]
+    print(f"{summary['label']:<10} {summary['requests']:6d} req {summary['errors']:4d} err "
+          f"{summary['throughput']:8.1f} req/s | latency ms p50 {latency['p50']:8.1f} p95 {latency['p95']:8.1f} "
+          f"p99 {latency['p99']:8.1f} | ttft ms p50 {ttft['p50']:8.1f} p95 {ttft['p95']:8.1f} p99 {ttft['p99']:8.1f}")
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--scenario", choices=SCENARIOS, default="chat-stream")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=200, help="total requests across all clients")
+    parser.add_argument("--turns", type=int, default=3, help="messages per conversation in chat scenarios")
+    parser.add_argument("--server", choices=("wsgi", "asgi"), default="wsgi")
+    parser.add_argument("--url", help="load a running server instead of starting one")
+    parser.add_argument("--first-token-ms", type=float, default=300)
+    parser.add_argument("--token-ms", type=float, default=5)
+    parser.add_argument("--tokens", type=int, default=200, help="words per fake response")
+    parser.add_argument("--chunk-tokens", type=int, default=8)
+    parser.add_argument("--retrieval-ms", type=float, default=150)
+    parser.add_argument("--stance-ms", type=float, default=250)
+    parser.add_argument("--json", action="store_true", help="print the summary as JSON")
+    args = parser.parse_args(argv)
+
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    # Keep hashing cheap enough that login numbers measure the server, not bcrypt's cost factor
+    os.environ.setdefault("BCRYPT_ROUNDS", "4")
+    os.environ.setdefault("SECRET_KEY", "benchmark")
+    base_url = args.url
+    if base_url is None:
+        fake_backend.install(fake_backend.FakeConfig(
+            first_token_ms=args.first_token_ms, token_ms=args.token_ms, tokens=args.tokens,
+            chunk_tokens=args.chunk_tokens, retrieval_ms=args.retrieval_ms, stance_ms=args.stance_ms,
+        ))
+        base_url = serve_in_process(args.server)
+        # The dev server logs every request at info level regardless of the root level
+        logging.getLogger("werkzeug").setLevel(os.environ["LOG_LEVEL"])
+
+    if args.scenario != "register":
+        register_users(base_url, [f"user{i}@benchmark.test" for i in range(args.concurrency)])
+
+    results: List[Result] = []
+    per_worker = [args.requests // args.concurrency + (i < args.requests % args.concurrency)
+                  for i in range(args.concurrency)]
+    threads = [threading.Thread(target=run_worker,
+                                args=(i, base_url, args.scenario, args.turns, per_worker[i], results))
+               for i in range(args.concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    summaries = [summarize("all", results, elapsed)]
+    if args.scenario.startswith("chat"):
+        summaries.append(summarize("opening", [r for r in results if r.opening], elapsed))
+        summaries.append(summarize("follow-up", [r for r in results if not r.opening], elapsed))
+
+    if args.json:
+        json.dump({"scenario": args.scenario, "concurrency": args.concurrency, "server": args.server,
+                   "elapsed": elapsed, "results": summaries}, sys.stdout, indent=2)
+        print()
+    else:
+        print(f"{args.scenario} x{args.concurrency} ({args.server}) in {elapsed:.2f}s")
+        for summary in summaries:
+            print_summary(summary)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""Per-session setup cost: building model, tool and safety settings per conversation vs the ModelFactory.
+
+Runs offline (no requests are sent). From backend/:
+    python -m benchmarks.model_setup [sessions]
+"""
+import sys
+import time
+import vertexai
+from google.auth.credentials import AnonymousCredentials
+from vertexai.preview import rag
+from vertexai.preview.generative_models import GenerativeModel, Tool, SafetySetting, HarmCategory, HarmBlockThreshold
+from gcp.model_factory import ModelFactory, RAG_MODEL_NAME
+
+CORPUS = "projects/benchmark/locations/us-central1/ragCorpora/{}"
+
+
+def per_session_setup(corpus_name: str):
+    """What setup_chat_session did for every conversation before the factory"""
+    tools = [Tool.from_retrieval(
+        retrieval=rag.Retrieval(
+            source=rag.VertexRagStore(
+                rag_corpora=[corpus_name],
+                similarity_top_k=5,
+                vector_distance_threshold=0.7,
+            ),
+        )
+    )]
+    safety_settings = [
+        SafetySetting(category=HarmCategory.HARM_CATEGORY_HATE_SPEECH, threshold=HarmBlockThreshold.BLOCK_NONE),
+        SafetySetting(category=HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT, threshold=HarmBlockThreshold.BLOCK_NONE),
+        SafetySetting(category=HarmCategory.HARM_CATEGORY_HARASSMENT, threshold=HarmBlockThreshold.BLOCK_NONE),
+        SafetySetting(category=HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT, threshold=HarmBlockThreshold.BLOCK_NONE)
+    ]
+    model = GenerativeModel(RAG_MODEL_NAME, tools=tools, safety_settings=safety_settings)
+    return model.start_chat(response_validation=False)
+
+
+def measure(label: str, setup, sessions: int, corpora: int):
+    start = time.perf_counter()
+    for i in range(sessions):
+        setup(CORPUS.format(i % corpora))
+    elapsed = time.perf_counter() - start
+    print(f"{label:<12} {elapsed / sessions * 1e6:9.1f} µs/session")
+    return elapsed
+
+
+def main():
+    sessions = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    # 12 corpora: 6 subjects x 2 stances
+    corpora = 12
+    vertexai.init(project="benchmark", location="us-central1", credentials=AnonymousCredentials())
+
+    factory = ModelFactory()
+    before = measure("per-session", per_session_setup, sessions, corpora)
+    after = measure("factory", lambda corpus: factory.start_chat(RAG_MODEL_NAME, corpus, response_validation=False),
+                    sessions, corpora)
+    print(f"speedup      {before / after:9.1f}x over {sessions} sessions")
+
+
+if __name__ == "__main__":
+    main()
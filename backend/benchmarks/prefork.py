@@ -0,0 +1,92 @@
+"""Memory and startup time of a gunicorn deployment, with and without the preloaded master.
+
+Starts gunicorn (gunicorn.conf.py, UvicornWorker) on the fake backend for
+each worker count, waits until every worker has its services warmed up,
+then sums the proportional set size (PSS, shared pages split between the
+processes sharing them) of the master and workers. Linux only.
+
+From backend/:
+    python -m benchmarks.prefork [workers ...]
+"""
+import os
+import sys
+import time
+import socket
+import subprocess
+import tempfile
+from pathlib import Path
+from typing import List
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+READY_LINE = "Services warmed up"
+
+
+def pss_kb(pid: int) -> int:
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                if line.startswith("Pss:"):
+                    return int(line.split()[1])
+    except (FileNotFoundError, ProcessLookupError):
+        pass
+    return 0
+
+
+def children(pid: int) -> List[int]:
+    pids = []
+    for entry in os.listdir("/proc"):
+        if entry.isdigit():
+            try:
+                with open(f"/proc/{entry}/stat") as f:
+                    if int(f.read().rsplit(")", 1)[1].split()[1]) == pid:
+                        pids.append(int(entry))
+            except (FileNotFoundError, ProcessLookupError, IndexError):
+                pass
+    return pids
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def measure(workers: int, preload: bool, timeout: float = 600) -> dict:
+    env = {**os.environ, "GUNICORN_PRELOAD": "1" if preload else "0", "WARM_UP_ON_START": "1", "LOG_LEVEL": "INFO"}
+    # The master warms up once when preloading; otherwise every worker does
+    expected = workers + 1 if preload else workers
+    with tempfile.NamedTemporaryFile("w+") as log:
+        start = time.perf_counter()
+        master = subprocess.Popen(
+            [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "benchmarks.fake_asgi:application",
+             "-k", "uvicorn.workers.UvicornWorker", "-w", str(workers), "-b", f"127.0.0.1:{free_port()}"],
+            cwd=BACKEND_DIR, env=env, stdout=log, stderr=subprocess.STDOUT,
+        )
+        try:
+            while True:
+                log.seek(0)
+                if log.read().count(READY_LINE) >= expected:
+                    break
+                if master.poll() is not None or time.perf_counter() - start > timeout:
+                    raise RuntimeError(f"gunicorn did not warm up {workers} workers")
+                time.sleep(0.05)
+            ready = time.perf_counter() - start
+            pids = [master.pid] + children(master.pid)
+            return {"ready": ready, "pss_mb": sum(pss_kb(pid) for pid in pids) / 1024, "processes": len(pids)}
+        finally:
+            master.terminate()
+            master.wait()
+
+
+def main():
+    worker_counts = [int(arg) for arg in sys.argv[1:]] or [2, 8]
+    for preload in (False, True):
+        for workers in worker_counts:
+            result = measure(workers, preload)
+            label = "preload" if preload else "per-worker"
+            print(f"{label:<10} {workers:3d} workers  ready in {result['ready']:6.2f}s  "
+                  f"total PSS {result['pss_mb']:8.1f} MB ({result['processes']} processes)")
+
+
+if __name__ == "__main__":
+    main()
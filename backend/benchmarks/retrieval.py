@@ -0,0 +1,198 @@
+"""Retrieval quality and latency over the local index: dense, BM25, and hybrid.
+
+By default queries are generated from the indexed chunks themselves, so no labelled
+set is needed. A "span" query is a run of ``--span-words`` consecutive
+words from a sampled chunk (a quote or close paraphrase, as when a user
+echoes a source); its gold chunks are those of the same document that
+contain the span. A "title" query is a document's title; any chunk of
+that document is gold. Each query is run against the (subject, stance)
+corpus its document belongs to, and the report gives recall@k (any gold
+chunk in the top k), MRR, latency percentiles and the characters of
+context the top ``--top-k`` chunks would add to the prompt.
+
+Cutoffs (distance threshold, min_score) are disabled so rankings are
+compared on equal terms. Build the index first (python -m gcp.local_retrieval build).
+
+The generated queries are verbatim text from the index, which favours
+lexical matching: they compare rankings, but say nothing about how users
+phrase arguments and cannot be used to set top-k or cutoffs. For that,
+pass ``--queries-file`` with labelled argument queries, a JSON list of
+{"query", "subject", "stance", "sources": [paths under Papers/]}; any chunk
+of a listed source is gold. These are reported as "labelled".
+
+From backend/:
+    python -m benchmarks.retrieval --index-dir /tmp/local_index --queries 300
+    python -m benchmarks.retrieval --queries-file arguments.json
+"""
+import sys
+import copy
+import json
+import time
+import random
+import argparse
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+from benchmarks.load_test import percentile
+from gcp.local_retrieval import TOKEN_PATTERN
+from gcp.hybrid_retrieval import HybridRetriever, tokenize
+from gcp.retrieval_config import RetrievalConfig
+
+KS = (1, 3, 5, 10)
+
+
+class Query:
+    def __init__(self, kind: str, text: str, subject: str, stance: str, gold: set):
+        self.kind = kind
+        self.text = text
+        self.subject = subject
+        self.stance = stance
+        self.gold = gold
+
+
+def words(text: str) -> List[str]:
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+def make_queries(retriever: HybridRetriever, count: int, span_words: int, seed: int) -> List[Query]:
+    index = retriever.index
+    rng = random.Random(seed)
+    corpus_of: Dict[int, tuple] = {}
+    for key, (start, end) in index.ranges.items():
+        subject, stance = key.split("/")
+        for row in range(start, end):
+            corpus_of[row] = (subject, stance)
+    rows_of_source: Dict[str, List[int]] = {}
+    for row, chunk in enumerate(index.chunks):
+        rows_of_source.setdefault(chunk["source"], []).append(row)
+    chunk_words = [" ".join(words(chunk["text"])) for chunk in index.chunks]
+
+    queries = []
+    candidates = [row for row in range(len(index.chunks)) if len(chunk_words[row].split()) > 2 * span_words]
+    for row in rng.sample(candidates, min(count, len(candidates))):
+        tokens = chunk_words[row].split()
+        start = rng.randrange(len(tokens) - span_words)
+        span = " ".join(tokens[start:start + span_words])
+        source = index.chunks[row]["source"]
+        gold = {r for r in rows_of_source[source] if span in chunk_words[r]}
+        queries.append(Query("span", span, *corpus_of[row], gold))
+
+    sources = sorted(rows_of_source)
+    for source in rng.sample(sources, min(count, len(sources))):
+        rows = rows_of_source[source]
+        queries.append(Query("title", index.chunks[rows[0]]["title"], *corpus_of[rows[0]], set(rows)))
+    return queries
+
+
+def load_queries(retriever: HybridRetriever, path: Path) -> List[Query]:
+    rows_of_source: Dict[str, set] = {}
+    for row, chunk in enumerate(retriever.index.chunks):
+        rows_of_source.setdefault(chunk["source"].lower(), set()).add(row)
+    with open(path) as f:
+        labelled = json.load(f)
+    queries = []
+    for item in labelled:
+        gold = set().union(*(rows_of_source.get(source.lower(), set()) for source in item["sources"]))
+        if not gold:
+            print(f"Skipping {item['query']!r}: none of its sources are in the index", file=sys.stderr)
+            continue
+        queries.append(Query("labelled", item["query"], item["subject"], item["stance"], gold))
+    return queries
+
+
+def row_of(retriever: HybridRetriever) -> Callable[[dict], int]:
+    """Map a returned context back to its row; the contexts are copies of the index's chunk dicts"""
+    rows = {(chunk["source"], chunk["text"]): row for row, chunk in enumerate(retriever.index.chunks)}
+    return lambda context: rows[(context["source"], context["text"])]
+
+
+def evaluate(name: str, retrieve: Callable[[Query], List[dict]], queries: List[Query],
+             row: Callable[[dict], int], top_k: int) -> List[dict]:
+    results = {}
+    for query in queries:
+        start = time.perf_counter()
+        contexts = retrieve(query)
+        elapsed = (time.perf_counter() - start) * 1000
+        ranks = [rank for rank, context in enumerate(contexts, 1) if row(context) in query.gold]
+        first = ranks[0] if ranks else None
+        for kind in (query.kind, "all"):
+            r = results.setdefault(kind, {"latency": [], "first": [], "chars": []})
+            r["latency"].append(elapsed)
+            r["first"].append(first)
+            r["chars"].append(sum(len(c["text"]) for c in contexts[:top_k]))
+
+    summaries = []
+    for kind, r in results.items():
+        n = len(r["first"])
+        summaries.append({
+            "retriever": name,
+            "queries": kind,
+            "count": n,
+            **{f"recall@{k}": sum(f is not None and f <= k for f in r["first"]) / n for k in KS},
+            "mrr": sum(1 / f for f in r["first"] if f is not None) / n,
+            "latency_ms": {f"p{q}": percentile(r["latency"], q) for q in (50, 95)},
+            "context_chars": sum(r["chars"]) / n,
+        })
+    return summaries
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--index-dir", type=Path, help="defaults to LOCAL_INDEX_DIR or gcp/local_index")
+    parser.add_argument("--queries", type=int, default=200, help="span queries; title queries are one per document, up to this many")
+    parser.add_argument("--span-words", type=int, default=12)
+    parser.add_argument("--top-k", type=int, default=5, help="chunks counted towards context size")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--queries-file", type=Path, help="labelled argument queries (JSON); replaces the generated ones")
+    parser.add_argument("--json", action="store_true", help="print the summary as JSON")
+    args = parser.parse_args(argv)
+
+    config = RetrievalConfig(overrides={"default": {
+        "similarity_top_k": max(KS), "local_vector_distance_threshold": 2.0, "min_score": 0.0,
+    }})
+    start = time.perf_counter()
+    hybrid = HybridRetriever(args.index_dir, config)
+    build_ms = (time.perf_counter() - start) * 1000
+    # Same indexes, fusion only
+    fused = copy.copy(hybrid)
+    fused.rerank = False
+
+    def bm25(query: Query) -> List[dict]:
+        rows = hybrid.corpus_rows(query.subject, query.stance)
+        scores = hybrid.bm25.scores(tokenize(query.text))[rows]
+        return [hybrid.index.chunks[rows[p]] for p in hybrid.top(scores, max(KS)) if scores[p] > 0]
+
+    retrievers = {
+        "dense": lambda q: hybrid.dense.retrieve(q.text, q.subject, q.stance),
+        "bm25": bm25,
+        "hybrid": lambda q: fused.retrieve(q.text, q.subject, q.stance),
+        "hybrid+rerank": lambda q: hybrid.retrieve(q.text, q.subject, q.stance),
+    }
+
+    if args.queries_file:
+        queries = load_queries(hybrid, args.queries_file)
+    else:
+        queries = make_queries(hybrid, args.queries, args.span_words, args.seed)
+    row = row_of(hybrid)
+    summaries = []
+    for name, retrieve in retrievers.items():
+        summaries.extend(evaluate(name, retrieve, queries, row, args.top_k))
+
+    if args.json:
+        json.dump({"chunks": len(hybrid.index.chunks), "build_ms": build_ms, "results": summaries},
+                  sys.stdout, indent=2)
+        print()
+        return
+    print(f"{len(hybrid.index.chunks)} chunks, BM25 index built in {build_ms:.0f} ms")
+    for kind in ("span", "title", "labelled", "all"):
+        if not any(s["queries"] == kind for s in summaries):
+            continue
+        print(f"\n{kind} queries")
+        for s in (s for s in summaries if s["queries"] == kind):
+            recall = "  ".join(f"R@{k} {s[f'recall@{k}']:.3f}" for k in KS)
+            print(f"  {s['retriever']:<14} n={s['count']:<4} {recall}  MRR {s['mrr']:.3f}  "
+                  f"p50 {s['latency_ms']['p50']:6.2f} ms  p95 {s['latency_ms']['p95']:6.2f} ms  "
+                  f"ctx@{args.top_k} {s['context_chars']:7.0f} chars")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""Cold-start cost: importing the app, serving a first request, and building the clients.
+
+Each measurement runs in a fresh interpreter, as a new gunicorn worker or
+autoscaled instance would. "import" is what a worker pays before it can
+accept connections; "first request" adds app creation and one request
+that needs no clients; "services" is the deferred cost of importing
+Vertex AI and building the Mongo interface and chatbot (on the fake
+backend, so it runs offline), paid by warm-up or the first chat request.
+
+From backend/:
+    python -m benchmarks.startup [runs]
+"""
+import os
+import sys
+import json
+import statistics
+import subprocess
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+HEAVY_MODULES = ["vertexai", "google.cloud.storage", "google_auth_oauthlib", "pymongo", "numpy"]
+
+MEASURE_IMPORT = """
+import sys, time, json
+start = time.perf_counter()
+import {module}
+imported = time.perf_counter() - start
+print(json.dumps({{"seconds": imported, "loaded": [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+MEASURE_FIRST_REQUEST = """
+import sys, time, json
+start = time.perf_counter()
+from app import create_app
+response = create_app().test_client().get("/api/check_session")
+assert response.status_code == 200
+print(json.dumps({{"seconds": time.perf_counter() - start, "loaded": [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+MEASURE_SERVICES = """
+import sys, time, json
+start = time.perf_counter()
+from benchmarks import fake_backend
+fake_backend.install()
+from app import services
+services.warm_up()
+print(json.dumps({{"seconds": time.perf_counter() - start, "loaded": [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+
+def run(code: str) -> dict:
+    env = {**os.environ, "LOG_LEVEL": "ERROR", "WARM_UP_ON_START": "0",
+           "MONGODB_CONNECTION_STRING": os.getenv("MONGODB_CONNECTION_STRING", "mongodb://benchmark.invalid"),
+           "MONGODB_DB_NAME": os.getenv("MONGODB_DB_NAME", "benchmark")}
+    output = subprocess.run([sys.executable, "-c", code], cwd=BACKEND_DIR, env=env,
+                            capture_output=True, text=True, check=True).stdout
+    # The result is the last line; anything before it is the app's own output
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def measure(label: str, code: str, runs: int):
+    results = [run(code.format(module=label.split()[-1], heavy=HEAVY_MODULES)) for _ in range(runs)]
+    seconds = [r["seconds"] * 1000 for r in results]
+    loaded = ", ".join(results[-1]["loaded"]) or "none"
+    print(f"{label:<16} min {min(seconds):8.1f} ms  median {statistics.median(seconds):8.1f} ms  "
+          f"heavy modules loaded: {loaded}")
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    measure("import app", MEASURE_IMPORT, runs)
+    measure("import asgi", MEASURE_IMPORT, runs)
+    measure("first request", MEASURE_FIRST_REQUEST, runs)
+    measure("services", MEASURE_SERVICES, runs)
+
+
+if __name__ == "__main__":
+    main()
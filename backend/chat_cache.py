@@ -0,0 +1,140 @@
+import logging
+import os
+import threading
+import datetime
+from typing import Dict, List, Optional
+from bson import json_util
+from shared_store import MemoryStore
+
+logger = logging.getLogger(__name__)
+
+TITLE_LENGTH = 60
+
+
+def chat_title(message: str) -> str:
+    """A chat is titled after its first message"""
+    title = " ".join(message.split())
+    return title if len(title) <= TITLE_LENGTH else title[:TITLE_LENGTH - 1].rstrip() + "…"
+
+
+class ChatCache:
+    """Read-through cache of each user's chat summaries and the newest messages of each chat.
+
+    Entries live in ``store`` (a MemoryStore by default, or a SqliteStore so
+    every worker on the host shares them). With a private store the write
+    methods update entries in place. A shared store cannot be updated that
+    way: a read-modify-write from two workers can interleave, and the
+    sequence number of a queued message is only known once MongoDB assigns
+    it. So there the write methods delete the affected entries, and the next
+    read reloads them from MongoDB. Values are stored as extended JSON so
+    datetimes survive either backend. Restoring a conversation reads MongoDB
+    directly rather than this cache.
+    """
+
+    def __init__(self, store=None, recent_messages: int = None, ttl: float = None):
+        self.store = store or MemoryStore()
+        self.recent_messages = recent_messages or int(os.getenv("CHAT_CACHE_RECENT_MESSAGES", "20"))
+        self.ttl = ttl or float(os.getenv("CHAT_CACHE_TTL", "300"))
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def _load(self, key: str):
+        try:
+            value = self.store.get(key)
+        except Exception as e:
+            logger.warning("Chat cache unavailable: %s", e)
+            return None
+        return None if value is None else json_util.loads(value)
+
+    def _get(self, key: str):
+        value = self._load(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def _set(self, key: str, value):
+        try:
+            self.store.set(key, json_util.dumps(value), ttl=self.ttl)
+        except Exception as e:
+            logger.warning("Chat cache unavailable: %s", e)
+
+    def _delete(self, key: str):
+        try:
+            self.store.delete(key)
+        except Exception as e:
+            logger.warning("Chat cache unavailable: %s", e)
+
+    @staticmethod
+    def _chats_key(email: str) -> str:
+        return f"chats:{email}"
+
+    @staticmethod
+    def _recent_key(email: str, chat_id: str) -> str:
+        return f"recent:{email}:{chat_id}"
+
+    def get_chats(self, email: str) -> Optional[List[Dict]]:
+        return self._get(self._chats_key(email))
+
+    def set_chats(self, email: str, chats: List[Dict]):
+        self._set(self._chats_key(email), chats)
+
+    def get_recent(self, email: str, chat_id: str) -> Optional[Dict]:
+        """{"start": seq of the first cached message, "messages": [{"seq", "message"}, ...]}"""
+        return self._get(self._recent_key(email, chat_id))
+
+    def set_recent(self, email: str, chat_id: str, messages: List[Dict], count: int):
+        """Cache the newest of ``messages`` for a chat with ``count`` messages in total"""
+        messages = messages[-self.recent_messages:]
+        start = messages[0]["seq"] if messages else count
+        self._set(self._recent_key(email, chat_id), {"start": start, "messages": messages})
+
+    def chat_created(self, email: str, chat_id: str, now: datetime.datetime):
+        if self.store.shared:
+            self._delete(self._chats_key(email))
+            self._delete(self._recent_key(email, chat_id))
+            return
+        chats = self._load(self._chats_key(email))
+        if chats is not None and not any(chat["chat_id"] == chat_id for chat in chats):
+            chats.insert(0, {"chat_id": chat_id, "count": 0, "created_at": now, "updated_at": now})
+            self.set_chats(email, chats)
+        self._set(self._recent_key(email, chat_id), {"start": 0, "messages": []})
+
+    def message_added(self, email: str, chat_id: str, message: str, now: datetime.datetime):
+        # The summaries list is dropped rather than rewritten on every message; the next
+        # list_chats reloads it once
+        self._delete(self._chats_key(email))
+        if self.store.shared:
+            self._delete(self._recent_key(email, chat_id))
+            return
+
+        recent = self._load(self._recent_key(email, chat_id))
+        if recent is None:
+            return
+        # The cached messages run to the end of the chat, so the new message follows them
+        seq = recent["start"] + len(recent["messages"])
+        messages = recent["messages"] + [{"seq": seq, "message": message}]
+        self.set_recent(email, chat_id, messages, seq + 1)
+
+    def chat_deleted(self, email: str, chat_id: str):
+        if self.store.shared:
+            self._delete(self._chats_key(email))
+        else:
+            chats = self._load(self._chats_key(email))
+            if chats is not None:
+                self.set_chats(email, [chat for chat in chats if chat["chat_id"] != chat_id])
+        self._delete(self._recent_key(email, chat_id))
+
+    def user_deleted(self, email: str):
+        self._delete(self._chats_key(email))
+        try:
+            self.store.delete_prefix(f"recent:{email}:")
+        except Exception as e:
+            logger.warning("Chat cache unavailable: %s", e)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses}
@@ -0,0 +1,395 @@
+import logging
+import os
+import time
+import random
+import asyncio
+import threading
+import contextvars
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait, TimeoutError as FutureTimeoutError
+from typing import AsyncIterator, Awaitable, Callable, Iterator, Optional
+from google.api_core import exceptions as api_exceptions
+from observability import MODEL_CALL_EVENTS, MODEL_CALLS_IN_FLIGHT
+
+logger = logging.getLogger(__name__)
+
+
+class CallTimeout(TimeoutError):
+    """An attempt, or the whole call, ran past its deadline"""
+
+
+class CallRejected(Exception):
+    """Too many calls to the same upstream are already in flight"""
+
+
+# Returned by next() when a stream is exhausted
+_END = object()
+
+RETRYABLE_ERRORS = (
+    CallTimeout,
+    ConnectionError,
+    api_exceptions.TooManyRequests,
+    api_exceptions.ResourceExhausted,
+    api_exceptions.ServiceUnavailable,
+    api_exceptions.InternalServerError,
+    api_exceptions.DeadlineExceeded,
+)
+
+
+class RetryBudget:
+    """Caps retries and hedges at a fraction of regular traffic.
+
+    Every call deposits ``ratio`` tokens and each extra attempt spends one, so
+    during an outage retries add at most ``ratio`` more load instead of
+    multiplying it. ``min_per_second`` tokens trickle in regardless, so
+    quiet periods can still retry.
+    """
+
+    def __init__(self, ratio: float = 0.1, min_per_second: float = 1.0, max_balance: float = 20.0):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.max_balance = max_balance
+        self._lock = threading.Lock()
+        self._balance = max_balance
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._balance = min(self.max_balance, self._balance + (now - self._updated) * self.min_per_second)
+        self._updated = now
+
+    def record_call(self):
+        with self._lock:
+            self._refill()
+            self._balance = min(self.max_balance, self._balance + self.ratio)
+
+    def try_spend(self) -> bool:
+        with self._lock:
+            self._refill()
+            if self._balance >= 1:
+                self._balance -= 1
+                return True
+            return False
+
+
+class CallPolicy:
+    """Deadlines, jittered retries and optional hedging around calls to one upstream.
+
+    Each attempt may take ``attempt_timeout`` seconds and the call as a whole
+    ``deadline`` seconds. Failed attempts with a retryable error are retried
+    after full-jitter backoff while the shared ``budget`` allows. With
+    ``hedge`` on, a duplicate attempt is started once the first has run past
+    the recent p95 latency and whichever finishes first wins. At most
+    ``max_in_flight`` attempts run at once; beyond that calls are rejected
+    with CallRejected, so a slow upstream cannot tie up every worker.
+    """
+
+    def __init__(self, name: str, deadline: float, attempt_timeout: Optional[float] = None,
+                 max_attempts: int = 3, backoff: float = 0.2, max_backoff: float = 2.0,
+                 hedge: bool = False, hedge_min_samples: int = 20,
+                 max_in_flight: int = 32, budget: Optional[RetryBudget] = None):
+        self.name = name
+        self.deadline = deadline
+        self.attempt_timeout = attempt_timeout or deadline
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.hedge = hedge
+        self.hedge_min_samples = hedge_min_samples
+        self.max_in_flight = max_in_flight
+        self.budget = budget or RetryBudget()
+
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._latencies = deque(maxlen=256)
+        self._executor = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix=f"{name}-call")
+        # Reads of streamed responses; kept apart so stalled streams cannot hold up new attempts
+        self._stream_executor = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix=f"{name}-stream")
+        self.calls = 0
+        self.retries = 0
+        self.hedges = 0
+        self.timeouts = 0
+        self.rejected = 0
+
+    def hedge_delay(self) -> Optional[float]:
+        """Recent p95 attempt latency, or None while there are too few samples"""
+        if not self.hedge:
+            return None
+        with self._lock:
+            if len(self._latencies) < self.hedge_min_samples:
+                return None
+            latencies = sorted(self._latencies)
+        return latencies[int(0.95 * (len(latencies) - 1))]
+
+    def _acquire(self):
+        with self._lock:
+            if self._in_flight >= self.max_in_flight:
+                self.rejected += 1
+                MODEL_CALL_EVENTS.labels(self.name, "rejected").inc()
+                raise CallRejected(f"Too many {self.name} calls in flight")
+            self._in_flight += 1
+            MODEL_CALLS_IN_FLIGHT.labels(self.name).inc()
+
+    def _release(self, started: float, succeeded: bool):
+        with self._lock:
+            self._in_flight -= 1
+            MODEL_CALLS_IN_FLIGHT.labels(self.name).dec()
+            if succeeded:
+                self._latencies.append(time.monotonic() - started)
+
+    def _backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    def _retry_delay(self, error: Exception, attempt: int, deadline: float) -> Optional[float]:
+        """Seconds to wait before the next attempt, or None to give up"""
+        if not isinstance(error, RETRYABLE_ERRORS) or attempt + 1 >= self.max_attempts:
+            return None
+        delay = self._backoff(attempt)
+        if time.monotonic() + delay >= deadline or not self.budget.try_spend():
+            return None
+        with self._lock:
+            self.retries += 1
+            MODEL_CALL_EVENTS.labels(self.name, "retry").inc()
+        logger.warning("Retrying %s call after %s: %s", self.name, type(error).__name__, error)
+        return delay
+
+    def _timed_out(self, started: float) -> CallTimeout:
+        with self._lock:
+            self.timeouts += 1
+            MODEL_CALL_EVENTS.labels(self.name, "timeout").inc()
+        return CallTimeout(f"{self.name} attempt timed out after {time.monotonic() - started:.1f}s")
+
+    def _start_hedge(self) -> bool:
+        """Whether a duplicate attempt may start; it must fit in the budget and the in-flight limit"""
+        with self._lock:
+            if self._in_flight >= self.max_in_flight:
+                return False
+        if not self.budget.try_spend():
+            return False
+        with self._lock:
+            self.hedges += 1
+            MODEL_CALL_EVENTS.labels(self.name, "hedge").inc()
+        return True
+
+    def call(self, fn: Callable, *args):
+        """Run ``fn(*args)`` under the policy and return the first successful result"""
+        deadline = time.monotonic() + self.deadline
+        self.budget.record_call()
+        with self._lock:
+            self.calls += 1
+            MODEL_CALL_EVENTS.labels(self.name, "call").inc()
+        attempt = 0
+        while True:
+            try:
+                return self._attempt(fn, args, deadline)
+            except Exception as e:
+                delay = self._retry_delay(e, attempt, deadline)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                attempt += 1
+
+    def _submit(self, fn: Callable, args: tuple):
+        self._acquire()
+        started = time.monotonic()
+
+        def run():
+            succeeded = False
+            try:
+                result = fn(*args)
+                succeeded = True
+                return result
+            finally:
+                self._release(started, succeeded)
+
+        try:
+            # Each attempt runs in a copy of the caller's context, so its logs keep the trace id
+            return self._executor.submit(contextvars.copy_context().run, run)
+        except BaseException:
+            self._release(started, False)
+            raise
+
+    def _attempt(self, fn: Callable, args: tuple, deadline: float):
+        started = time.monotonic()
+        attempt_deadline = min(deadline, time.monotonic() + self.attempt_timeout)
+        futures = [self._submit(fn, args)]
+        hedge_delay = self.hedge_delay()
+        if hedge_delay is not None:
+            done, _ = wait(futures, timeout=min(hedge_delay, max(0.0, attempt_deadline - time.monotonic())))
+            if not done and time.monotonic() < attempt_deadline and self._start_hedge():
+                try:
+                    futures.append(self._submit(fn, args))
+                except CallRejected:
+                    pass
+
+        error = None
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, timeout=max(0.0, attempt_deadline - time.monotonic()),
+                                 return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            for future in done:
+                if future.exception() is None:
+                    # Losers keep running in the background; their results are dropped
+                    return future.result()
+                error = error or future.exception()
+        if error is not None and not pending:
+            raise error
+        raise self._timed_out(started)
+
+    async def call_async(self, fn: Callable[..., Awaitable], *args):
+        """Async counterpart of call; ``fn(*args)`` returns an awaitable and losing attempts are cancelled"""
+        deadline = time.monotonic() + self.deadline
+        self.budget.record_call()
+        with self._lock:
+            self.calls += 1
+            MODEL_CALL_EVENTS.labels(self.name, "call").inc()
+        attempt = 0
+        while True:
+            try:
+                return await self._attempt_async(fn, args, deadline)
+            except Exception as e:
+                delay = self._retry_delay(e, attempt, deadline)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                attempt += 1
+
+    def _create_task(self, fn: Callable[..., Awaitable], args: tuple) -> asyncio.Task:
+        self._acquire()
+        started = time.monotonic()
+
+        async def run():
+            succeeded = False
+            try:
+                result = await fn(*args)
+                succeeded = True
+                return result
+            finally:
+                self._release(started, succeeded)
+
+        return asyncio.ensure_future(run())
+
+    async def _attempt_async(self, fn: Callable[..., Awaitable], args: tuple, deadline: float):
+        started = time.monotonic()
+        attempt_deadline = min(deadline, time.monotonic() + self.attempt_timeout)
+        tasks = [self._create_task(fn, args)]
+        try:
+            hedge_delay = self.hedge_delay()
+            if hedge_delay is not None:
+                done, _ = await asyncio.wait(
+                    tasks, timeout=min(hedge_delay, max(0.0, attempt_deadline - time.monotonic()))
+                )
+                if not done and time.monotonic() < attempt_deadline and self._start_hedge():
+                    try:
+                        tasks.append(self._create_task(fn, args))
+                    except CallRejected:
+                        pass
+
+            error = None
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, timeout=max(0.0, attempt_deadline - time.monotonic()),
+                    return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    break
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = error or task.exception()
+            if error is not None and not pending:
+                raise error
+            raise self._timed_out(started)
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    def _stream_timed_out(self) -> CallTimeout:
+        with self._lock:
+            self.timeouts += 1
+            MODEL_CALL_EVENTS.labels(self.name, "timeout").inc()
+        return CallTimeout(f"{self.name} stream ran past its deadline")
+
+    @staticmethod
+    def _close(chunks: Iterator):
+        close = getattr(chunks, "close", None)
+        if close is not None:
+            try:
+                close()
+            except Exception as e:
+                logger.debug("Could not close stream: %s", e)
+
+    def stream(self, chunks: Iterator, deadline: float) -> Iterator:
+        """Yield the rest of a streamed response until it ends or ``deadline`` (time.monotonic()) passes.
+
+        ``call`` only bounds the wait for the first chunk; this bounds the
+        rest. Each chunk is read in the policy's stream executor, so a stream
+        that stalls raises CallTimeout instead of holding the caller, and is
+        closed as soon as its pending read returns.
+        """
+        future = None
+        try:
+            while True:
+                future = self._stream_executor.submit(contextvars.copy_context().run, next, chunks, _END)
+                try:
+                    chunk = future.result(timeout=max(0.0, deadline - time.monotonic()))
+                except FutureTimeoutError:
+                    raise self._stream_timed_out() from None
+                if chunk is _END:
+                    return
+                yield chunk
+        finally:
+            if future is not None and not future.done():
+                future.add_done_callback(lambda _: self._close(chunks))
+            else:
+                self._close(chunks)
+
+    async def stream_async(self, chunks: AsyncIterator, deadline: float) -> AsyncIterator:
+        """Async counterpart of stream; a stalled read is cancelled when the deadline passes"""
+        try:
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(chunks.__anext__(), timeout=max(0.0, deadline - time.monotonic()))
+                except StopAsyncIteration:
+                    return
+                except asyncio.TimeoutError:
+                    raise self._stream_timed_out() from None
+                yield chunk
+        finally:
+            aclose = getattr(chunks, "aclose", None)
+            if aclose is not None:
+                try:
+                    await aclose()
+                except Exception as e:
+                    logger.debug("Could not close stream: %s", e)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "retries": self.retries,
+                "hedges": self.hedges,
+                "timeouts": self.timeouts,
+                "rejected": self.rejected,
+                "in_flight": self._in_flight,
+            }
+
+
+def policy_from_env(name: str, deadline: float, attempt_timeout: float, hedge: bool,
+                    budget: RetryBudget) -> CallPolicy:
+    """Build a policy whose settings can be overridden with <NAME>_DEADLINE, <NAME>_ATTEMPT_TIMEOUT,
+    <NAME>_MAX_ATTEMPTS, <NAME>_HEDGE and <NAME>_MAX_IN_FLIGHT"""
+    prefix = name.upper()
+    return CallPolicy(
+        name,
+        deadline=float(os.getenv(f"{prefix}_DEADLINE", deadline)),
+        attempt_timeout=float(os.getenv(f"{prefix}_ATTEMPT_TIMEOUT", attempt_timeout)),
+        max_attempts=int(os.getenv(f"{prefix}_MAX_ATTEMPTS", "3")),
+        hedge=os.getenv(f"{prefix}_HEDGE", "1" if hedge else "0") == "1",
+        max_in_flight=int(os.getenv(f"{prefix}_MAX_IN_FLIGHT", "32")),
+        budget=budget,
+    )
@@ -0,0 +1,118 @@
+import logging
+import os
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Tuple
+from vertexai.preview.generative_models import ChatSession, Content, GenerativeModel, Part
+
+logger = logging.getLogger(__name__)
+
+Turn = Tuple[str, str]
+
+SUMMARY_ACK = "Understood. I will keep arguing my position, building on what we have already discussed."
+
+
+class ContextWindowManager:
+    """Keeps each conversation's prompt bounded as a debate grows.
+
+    The last ``keep_turns`` turns stay verbatim. Once ``summarize_batch`` more
+    have piled up, the older ones are folded into a rolling summary by
+    ``summary_model`` on a background thread, so the reply path never waits
+    on it. The chat session is then rebuilt from the roleplay prompt, the
+    summary and the verbatim turns. A session never holds more than
+    ``keep_turns + 2 * summarize_batch`` verbatim turns, even when
+    summarization falls behind or fails.
+    """
+
+    def __init__(self, summary_model: GenerativeModel, keep_turns: int = None,
+                 summarize_batch: int = None, summary_words: int = 200, max_workers: int = 2,
+                 call_policy=None):
+        self.summary_model = summary_model
+        self.call_policy = call_policy
+        self.keep_turns = keep_turns or int(os.getenv("CONTEXT_KEEP_TURNS", "6"))
+        self.summarize_batch = summarize_batch or int(os.getenv("CONTEXT_SUMMARY_BATCH", "4"))
+        self.summary_words = summary_words
+        self.max_turns = self.keep_turns + 2 * self.summarize_batch
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="context-summary")
+
+    def summary_prompt(self, previous_summary: str, turns: List[Turn]) -> str:
+        transcript = "\n\n".join(f"User: {user_text}\nAssistant: {bot_text}" for user_text, bot_text in turns)
+        previous = previous_summary or "(none yet)"
+        return f"""Update the running summary of a debate between a user and an assistant.
+                Keep both sides' main claims, the sources the assistant cited and any points the user conceded.
+                Write at most {self.summary_words} words of plain prose.
+
+                Current summary:
+                {previous}
+
+                New exchanges:
+                {transcript}"""
+
+    def summarize(self, previous_summary: str, turns: List[Turn]) -> str:
+        prompt = self.summary_prompt(previous_summary, turns)
+        if self.call_policy is not None:
+            response = self.call_policy.call(self.summary_model.generate_content, prompt)
+        else:
+            response = self.summary_model.generate_content(prompt)
+        return response.text.strip()
+
+    def record_turn(self, state, user_text: str, bot_text: str):
+        """Remember a completed turn and start folding old turns into the summary when due"""
+        state.turns.append((user_text, bot_text))
+        self._schedule_summary(state)
+
+    def _schedule_summary(self, state):
+        if state.summary_future is not None:
+            return
+        upto = len(state.turns) - self.keep_turns
+        if upto - state.summarized_turns <= self.summarize_batch:
+            return
+        turns = state.turns[state.summarized_turns:upto]
+        previous = state.summary
+
+        def fold() -> Tuple[str, int]:
+            return self.summarize(previous, turns), upto
+
+        state.summary_future = self._executor.submit(contextvars.copy_context().run, fold)
+
+    def window_start(self, state) -> int:
+        """Index of the first turn kept verbatim"""
+        return max(state.summarized_turns, len(state.turns) - self.max_turns)
+
+    def history(self, state, roleplay_prompt: str) -> List[Content]:
+        start = self.window_start(state)
+        turns = state.turns[start:]
+        if state.summary:
+            opening = f"{roleplay_prompt}\n\nSummary of the conversation so far:\n{state.summary}"
+            turns = [(opening, SUMMARY_ACK)] + turns
+        elif start > 0:
+            turns = [(roleplay_prompt, SUMMARY_ACK)] + turns
+
+        history = []
+        for user_text, bot_text in turns:
+            history.append(Content(role="user", parts=[Part.from_text(user_text)]))
+            history.append(Content(role="model", parts=[Part.from_text(bot_text)]))
+        return history
+
+    def refresh(self, state, roleplay_prompt: str, rebuild: Callable[[List[Content]], ChatSession],
+                force: bool = False):
+        """Apply a finished summary and trim the session; call before sending the next message"""
+        changed = force
+        future = state.summary_future
+        if future is not None and future.done():
+            state.summary_future = None
+            try:
+                summary, upto = future.result()
+                if upto > state.summarized_turns:
+                    state.summary, state.summarized_turns = summary, upto
+                    changed = True
+            except Exception as e:
+                logger.warning("Could not summarize conversation: %s", e)
+        self._schedule_summary(state)
+
+        start = self.window_start(state)
+        if changed or start != state.window_start:
+            state.window_start = start
+            history = self.history(state, roleplay_prompt)
+            state.chat_session = rebuild(history)
+            state.size = sum(len(part.text) for content in history for part in content.parts)
@@ -0,0 +1,251 @@
+import logging
+import os
+import json
+import time
+import hashlib
+import tempfile
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+from vertexai.preview import rag
+from google.cloud import storage
+
+logger = logging.getLogger(__name__)
+
+SUBJECTS = [
+    "abortion",
+    "gun_laws",
+    "immigration",
+    "artificial_intelligence_regulation",
+    "universal_basic_income",
+    "universal_healthcare",
+    "gene_editing",
+]
+STANCES = ["for", "against"]
+
+CHUNK_SIZE = 1024
+CHUNK_OVERLAP = 100
+
+DEFAULT_REGISTRY_PATH = Path(__file__).parent / "corpus_registry.json"
+
+# A corpus carries this display name suffix until its documents are fully imported
+BUILDING_SUFFIX = "-building"
+
+
+class CorpusRegistry:
+    """Keeps one prebuilt RAG corpus per (subject, stance) pair.
+
+    Each corpus is identified by its display name and a fingerprint of the
+    source documents, so documents are only chunked and embedded again when
+    the contents of the source folders change. A corpus only gets that
+    display name once its import has finished, so a half-imported corpus is
+    never adopted.
+    """
+
+    def __init__(self, base_bucket: str, embedding_model: str,
+                 registry_path: Optional[Path] = None,
+                 check_interval: float = 3600.0):
+        self.base_bucket = base_bucket
+        self.embedding_model = embedding_model
+        self.registry_path = Path(registry_path or os.getenv("CORPUS_REGISTRY_PATH", DEFAULT_REGISTRY_PATH))
+        # How often (seconds) a cached corpus is checked against its source documents
+        self.check_interval = check_interval
+
+        self._lock = threading.Lock()
+        self._building: Dict[Tuple[str, str], threading.Event] = {}
+        self._storage_client = None
+        # Never changed in place: updates swap in a new dict under the lock (_update), so
+        # readers can iterate whatever dict they picked up while a background check runs
+        self._entries = self._load()
+
+    def _load(self) -> Dict[str, dict]:
+        try:
+            with open(self.registry_path) as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _save(self):
+        with self._lock:
+            entries = self._entries
+        # A temporary file of our own, since other workers may be saving at the same time
+        with tempfile.NamedTemporaryFile("w", dir=self.registry_path.parent, suffix=".tmp", delete=False) as f:
+            json.dump(entries, f, indent=2)
+        os.replace(f.name, self.registry_path)
+
+    def _update(self, entries: Dict[str, dict]):
+        with self._lock:
+            self._entries = {**self._entries, **entries}
+
+    @staticmethod
+    def _key(subject: str, stance: str) -> str:
+        return f"{subject.lower()}/{stance.lower()}"
+
+    def corpus_names(self) -> List[str]:
+        """Names of every corpus in the registry, without checking them against their sources"""
+        with self._lock:
+            entries = self._entries
+        return [entry["name"] for entry in entries.values()]
+
+    def subject_of(self, corpus_name: str) -> Optional[str]:
+        with self._lock:
+            entries = self._entries
+        for key, entry in entries.items():
+            if entry["name"] == corpus_name:
+                return key.split("/")[0]
+        return None
+
+    def source_paths(self, subject: str, stance: str) -> List[str]:
+        """GCS folders whose documents make up the corpus"""
+        subject_path = f"{self.base_bucket.rstrip('/')}/{subject.lower()}"
+        return [f"{subject_path}/{stance.lower()}", f"{subject_path}/neutral"]
+
+    def fingerprint(self, paths: List[str]) -> str:
+        """Hash the name, size and checksum of every document under the given folders"""
+        if self._storage_client is None:
+            self._storage_client = storage.Client()
+
+        digest = hashlib.sha256()
+        for path in sorted(paths):
+            bucket_name, _, prefix = path.removeprefix("gs://").partition("/")
+            prefix = prefix.rstrip("/") + "/"
+            blobs = self._storage_client.list_blobs(bucket_name, prefix=prefix)
+            for blob in sorted(blobs, key=lambda b: b.name):
+                digest.update(f"{blob.name}\0{blob.size}\0{blob.md5_hash}\n".encode("utf-8"))
+        return digest.hexdigest()
+
+    def display_name(self, subject: str, stance: str, fingerprint: str) -> str:
+        return f"cli-rag-corpus-{subject}-{stance}-{fingerprint[:12]}".lower()
+
+    def get_corpus(self, subject: str, stance: str) -> Optional[str]:
+        """Return the corpus name for (subject, stance), building it only if none exists yet"""
+        key = self._key(subject, stance)
+        entry = self._entries.get(key)
+        if entry:
+            if time.time() - entry.get("checked_at", 0) > self.check_interval:
+                with self._lock:
+                    building = key in self._building
+                if not building:
+                    # Serve the existing corpus and check the source documents in the background
+                    threading.Thread(target=self.ensure_corpus, args=(subject, stance), daemon=True).start()
+            return entry["name"]
+        return self.ensure_corpus(subject, stance)
+
+    def ensure_corpus(self, subject: str, stance: str) -> Optional[str]:
+        """Make sure the corpus for (subject, stance) matches its source documents"""
+        key = self._key(subject, stance)
+
+        with self._lock:
+            event = self._building.get(key)
+            if event is None:
+                event = threading.Event()
+                self._building[key] = event
+                owner = True
+            else:
+                owner = False
+
+        if not owner:
+            # Another thread is already building this corpus
+            event.wait()
+            entry = self._entries.get(key)
+            return entry["name"] if entry else None
+
+        try:
+            return self._ensure_corpus(subject, stance)
+        except Exception as e:
+            logger.error("Error ensuring RAG corpus for %s %s: %s", stance, subject, e)
+            entry = self._entries.get(key)
+            return entry["name"] if entry else None
+        finally:
+            with self._lock:
+                del self._building[key]
+            event.set()
+
+    def _ensure_corpus(self, subject: str, stance: str) -> Optional[str]:
+        key = self._key(subject, stance)
+        paths = self.source_paths(subject, stance)
+        fingerprint = self.fingerprint(paths)
+
+        # Another worker may have built the corpus since we last read the registry
+        self._update(self._load())
+        entry = self._entries.get(key)
+        if entry and entry["fingerprint"] == fingerprint:
+            self._update({key: {**entry, "checked_at": time.time()}})
+            self._save()
+            return entry["name"]
+
+        display_name = self.display_name(subject, stance, fingerprint)
+        corpus_name = self._find_corpus(display_name)
+        if corpus_name is None:
+            corpus_name = self._build_corpus(display_name, paths)
+
+        previous = entry["name"] if entry else None
+        self._update({key: {
+            "name": corpus_name,
+            "display_name": display_name,
+            "fingerprint": fingerprint,
+            "checked_at": time.time(),
+        }})
+        self._save()
+
+        if previous and previous != corpus_name:
+            logger.info("Source documents changed, deleting old corpus %s", previous)
+            try:
+                rag.delete_corpus(name=previous)
+            except Exception as e:
+                logger.warning("Could not delete old corpus: %s", e)
+
+        return corpus_name
+
+    def _find_corpus(self, display_name: str) -> Optional[str]:
+        for corpus in rag.list_corpora():
+            if corpus.display_name == display_name:
+                logger.info("Found existing corpus %s for %s", corpus.name, display_name)
+                return corpus.name
+        return None
+
+    def _build_corpus(self, display_name: str, paths: List[str]) -> str:
+        logger.info("Building RAG corpus %s from: %s", display_name, paths)
+        embedding_model_config = rag.EmbeddingModelConfig(
+            publisher_model=self.embedding_model
+        )
+        corpus = rag.create_corpus(
+            display_name=display_name + BUILDING_SUFFIX,
+            embedding_model_config=embedding_model_config
+        )
+        try:
+            rag.import_files(
+                corpus_name=corpus.name,
+                paths=paths,
+                chunk_size=CHUNK_SIZE,
+                chunk_overlap=CHUNK_OVERLAP,
+                max_embedding_requests_per_min=900,
+            )
+            # Only now can _find_corpus adopt it
+            rag.update_corpus(corpus_name=corpus.name, display_name=display_name)
+        except Exception:
+            logger.error("Import into %s failed, deleting the partial corpus", corpus.name)
+            try:
+                rag.delete_corpus(name=corpus.name)
+            except Exception as e:
+                logger.warning("Could not delete partial corpus %s: %s", corpus.name, e)
+            raise
+        logger.info("Document import completed for %s", corpus.name)
+        return corpus.name
+
+    def prebuild(self, subjects: List[str] = SUBJECTS, stances: List[str] = STANCES):
+        """Build or refresh every (subject, stance) corpus ahead of time"""
+        for subject in subjects:
+            for stance in stances:
+                name = self.ensure_corpus(subject, stance)
+                print(f"{subject}/{stance}: {name}")
+
+
+if __name__ == "__main__":
+    import vertexai
+    from dotenv import load_dotenv
+
+    load_dotenv(Path(__file__).parent.parent.parent / '.env')
+    vertexai.init(project=os.getenv("PROJECT_ID"), location=os.getenv("GOOGLE_CLOUD_REGION", "us-central1"))
+    registry = CorpusRegistry(os.getenv("INPUT_GCS_BUCKET_BASE"), os.getenv("EMBEDDING_MODEL"))
+    registry.prebuild()
@@ -1,13 +1,60 @@
 import os
 import json
-from typing import List, Tuple, Optional
+import time
+import asyncio
+import logging
+import itertools
+from typing import AsyncIterator, Iterator, List, Tuple, Optional
 from dotenv import load_dotenv
 import vertexai
-from vertexai.preview import rag
-from vertexai.preview.generative_models import GenerativeModel, Tool, ChatSession, SafetySetting, HarmCategory, HarmBlockThreshold
+from vertexai.preview.generative_models import ChatSession, Content, Part
 from pathlib import Path
 # import fitz
-from google.cloud import storage
+from gcp.corpus_registry import CorpusRegistry
+from gcp.local_retrieval import LocalRetriever
+from gcp.hybrid_retrieval import HybridRetriever
+from gcp.retrieval_config import RetrievalConfig
+from gcp.stance_classifier import StanceClassifier
+from gcp.stance_cache import StanceCache, FALLBACK_RESULT
+from gcp.context_window import ContextWindowManager
+from gcp.model_factory import ModelFactory, DEFAULT_MODEL_NAME, RAG_MODEL_NAME
+from gcp.call_policy import RetryBudget, policy_from_env
+from gcp.response_cache import ResponseCache
+from shared_store import SqliteStore
+from observability import setup_logging, span, observe_stage, record_usage, RESPONSE_CHUNKS, STANCE_SOURCE
+
+logger = logging.getLogger(__name__)
+
+class ConversationState:
+    """Context of a single conversation: detected stance/subject and its live chat session"""
+    def __init__(self):
+        self.stance = None
+        self.subject = None
+        self.chat_session = None
+        self.corpus_name = None
+        self.is_first_message = True
+        # Completed (user, bot) turns; the first user turn is the roleplay prompt
+        self.turns = []
+        # Rolling summary of turns[:summarized_turns], see ContextWindowManager
+        self.summary = ""
+        self.summarized_turns = 0
+        self.summary_future = None
+        # Index of the first turn held verbatim by chat_session
+        self.window_start = 0
+        # Sources cited in the most recent response
+        self.citations = []
+        # Approximate number of characters held in the chat session history
+        self.size = 0
+
+    def snapshot(self) -> dict:
+        """Copy of the state before a turn, so a failed turn can be undone with restore()"""
+        snapshot = dict(vars(self))
+        snapshot["turns"] = list(self.turns)
+        snapshot["citations"] = list(self.citations)
+        return snapshot
+
+    def restore(self, snapshot: dict):
+        vars(self).update(snapshot)
 
 class RAGChatbot:
     def __init__(self):
@@ -21,201 +68,530 @@ class RAGChatbot:
         self.embedding_model = os.getenv("EMBEDDING_MODEL")
         self.base_bucket = os.getenv("INPUT_GCS_BUCKET_BASE")
         
-        print("Initializing Vertex AI...")
+        logger.info("Initializing Vertex AI...")
         vertexai.init(project=self.project_id, location=self.location)
         
-        # Initialize a default model for stance analysis with adjusted safety settings
-        print("Setting up default model...")
-        safety_settings=[
-            SafetySetting(category=HarmCategory.HARM_CATEGORY_HATE_SPEECH, threshold=HarmBlockThreshold.BLOCK_NONE),
-            SafetySetting(category=HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT, threshold=HarmBlockThreshold.BLOCK_NONE),
-            SafetySetting(category=HarmCategory.HARM_CATEGORY_HARASSMENT, threshold=HarmBlockThreshold.BLOCK_NONE),
-            SafetySetting(category=HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT, threshold=HarmBlockThreshold.BLOCK_NONE)
-        ]
-        self.default_model = GenerativeModel("gemini-1.5-flash-001", safety_settings=safety_settings)
+        # Models and retrieval tools are built once per (model, corpus) and shared by all sessions
+        self.model_factory = ModelFactory()
         
-        # Initialize conversation context
-        self.stance = None
-        self.subject = None
-        self.chat_session = None
-        self.is_first_message = True
+        # Initialize a default model for stance analysis
+        logger.info("Setting up default model...")
+        self.default_model = self.model_factory.model(DEFAULT_MODEL_NAME)
+        
+        # Deadlines, retries and hedging for model calls; retries share one budget
+        retry_budget = RetryBudget(ratio=float(os.getenv("LLM_RETRY_BUDGET_RATIO", "0.1")))
+        self.stance_policy = policy_from_env("stance", deadline=10, attempt_timeout=4, hedge=True, budget=retry_budget)
+        # For streamed replies an attempt lasts until the first chunk arrives
+        self.generation_policy = policy_from_env("generation", deadline=60, attempt_timeout=30, hedge=False,
+                                                 budget=retry_budget)
+        summary_policy = policy_from_env("summary", deadline=60, attempt_timeout=30, hedge=False, budget=retry_budget)
+        
+        # Resolves clear-cut stances without a model call
+        self.stance_classifier = StanceClassifier()
+        
+        # Remembers model stance results; STANCE_CACHE_PATH shares them across workers
+        stance_cache_path = os.getenv("STANCE_CACHE_PATH")
+        self.stance_cache = StanceCache(
+            max_entries=int(os.getenv("STANCE_CACHE_SIZE", "4096")),
+            shared_store=SqliteStore(stance_cache_path) if stance_cache_path else None,
+        )
         
-        print("RAG Chatbot initialized successfully!")
+        # One prebuilt corpus per (subject, stance), shared by every conversation
+        self.corpus_registry = CorpusRegistry(self.base_bucket, self.embedding_model)
+        
+        # Top-k and thresholds per subject (RETRIEVAL_CONFIG_PATH)
+        self.retrieval_config = RetrievalConfig()
+        
+        # Retrieval backend: "vertex" attaches the RAG corpus as a model tool,
+        # "local" retrieves from the offline Papers/ index and adds the chunks to the prompt,
+        # "hybrid" does the same with BM25 and dense retrieval fused and reranked
+        self.retrieval_backend = os.getenv("RETRIEVAL_BACKEND", "vertex").lower()
+        if self.retrieval_backend == "hybrid":
+            self.local_retriever = HybridRetriever(config=self.retrieval_config)
+        elif self.retrieval_backend == "local":
+            self.local_retriever = LocalRetriever(config=self.retrieval_config)
+        else:
+            self.local_retriever = None
+        
+        # Reuses grounded opening responses for near-identical opening arguments (RESPONSE_CACHE=1)
+        self.response_cache = ResponseCache()
+        
+        # Bounds the history sent with each message by summarizing older turns
+        self.context_window = ContextWindowManager(self.default_model, call_policy=summary_policy)
+        
+        # Conversation context used when no explicit state is passed (CLI usage)
+        self.state = ConversationState()
+        
+        logger.info("RAG Chatbot initialized successfully!")
 
-    def analyze_stance(self, text: str) -> Tuple[str, str]:
-        """Analyze the stance and subject from user input"""
-        try:
-            print("Analyzing stance...")
-            chat = self.default_model.start_chat()
-            
-            prompt = f"""You must return ONLY a JSON object with no other text, markdown, or formatting.
+    def warm_up(self):
+        """Build the model and retrieval tool for every registered corpus ahead of the first conversation.
+
+        Makes no network calls, so it can run in the gunicorn master: workers
+        forked afterwards share these objects copy-on-write.
+        """
+        for corpus_name in self.corpus_registry.corpus_names():
+            self.model_factory.model(RAG_MODEL_NAME, corpus_name, *self.vertex_retrieval_settings(corpus_name))
+
+    def vertex_retrieval_settings(self, corpus_name: str) -> Tuple[int, float]:
+        """(similarity_top_k, vector_distance_threshold) for the corpus's subject"""
+        settings = self.retrieval_config.settings(self.corpus_registry.subject_of(corpus_name))
+        return settings["similarity_top_k"], settings["vector_distance_threshold"]
+
+    def stance_prompt(self, text: str) -> str:
+        return f"""You must return ONLY a JSON object with no other text, markdown, or formatting.
             Analyze this text: '{text}'
             
             Schema:
             {{'stance': str,  // must be 'for' or 'against'
             'subject': str  // must be 'abortion', 'gun_laws', 'immigration', 'artificial_intelligence_regulation', 'universal_basic_income', 'universal_healthcare', 'gene_editing'
             }}"""
-            
-            response = chat.send_message(prompt, stream=False)
-            
-            # Clean the response text by removing markdown code fences
-            cleaned_response = response.text.strip()
-            if cleaned_response.startswith('```'):
-                cleaned_response = cleaned_response.split('```')[1]
-            if cleaned_response.startswith('json'):
-                cleaned_response = cleaned_response[4:]
-            cleaned_response = cleaned_response.strip()
-            
-            print(f"Raw stance analysis response: {cleaned_response}")
-            
-            result = json.loads(cleaned_response)
-            
+
+    def quick_stance(self, text: str) -> Optional[Tuple[str, str]]:
+        """Resolve the stance without a model call, from the local classifier or the cache"""
+        local_result = self.stance_classifier.classify(text)
+        if local_result:
             # Flip the stance to generate counter-argument
-            stance = "against" if result['stance'] == "for" else "for"
-            print(f"Detected stance: {stance}, subject: {result['subject']}")
-            return stance, result['subject']
+            user_stance, subject = local_result
+            stance = "against" if user_stance == "for" else "for"
+            logger.info("Detected stance locally: %s, subject: %s", stance, subject)
+            STANCE_SOURCE.labels("classifier").inc()
+            return stance, subject
+        
+        cached_result = self.stance_cache.get(text)
+        if cached_result:
+            logger.info("Using cached stance: %s, subject: %s", cached_result[0], cached_result[1])
+            STANCE_SOURCE.labels("cache").inc()
+        return cached_result
+
+    def parse_stance_response(self, text: str, response_text: str) -> Tuple[str, str]:
+        # Clean the response text by removing markdown code fences
+        cleaned_response = response_text.strip()
+        if cleaned_response.startswith('```'):
+            cleaned_response = cleaned_response.split('```')[1]
+        if cleaned_response.startswith('json'):
+            cleaned_response = cleaned_response[4:]
+        cleaned_response = cleaned_response.strip()
+        
+        logger.debug("Raw stance analysis response: %s", cleaned_response)
+        
+        result = json.loads(cleaned_response)
+        
+        # Flip the stance to generate counter-argument
+        stance = "against" if result['stance'] == "for" else "for"
+        logger.info("Detected stance: %s, subject: %s", stance, result['subject'])
+        self.stance_cache.put(text, (stance, result['subject']))
+        return stance, result['subject']
+
+    def analyze_stance(self, text: str) -> Tuple[str, str]:
+        """Analyze the stance and subject from user input"""
+        quick_result = self.quick_stance(text)
+        if quick_result:
+            return quick_result
+        
+        try:
+            logger.debug("Analyzing stance...")
+            STANCE_SOURCE.labels("model").inc()
+            prompt = self.stance_prompt(text)
+            with span("stance_model", logger):
+                response = self.stance_policy.call(lambda: self.default_model.start_chat().send_message(prompt, stream=False))
+            record_usage(response)
+            return self.parse_stance_response(text, response.text)
             
         except Exception as e:
-            print(f"Error in stance analysis: {e}")
-            return "neutral", "general"
+            logger.warning("Error in stance analysis: %s", e)
+            return FALLBACK_RESULT
 
-    def setup_rag_corpus(self, subject: str, stance: str) -> Optional[str]:
-        """Set up the RAG corpus with document embeddings"""
+    async def analyze_stance_async(self, text: str) -> Tuple[str, str]:
+        """Analyze the stance and subject without blocking the event loop"""
+        quick_result = self.quick_stance(text)
+        if quick_result:
+            return quick_result
+        
         try:
-            print(f"Setting up RAG corpus for {stance} {subject}...")
-            
-            # Create embedding model configuration
-            embedding_model_config = rag.EmbeddingModelConfig(
-                publisher_model=self.embedding_model
-            )
-            
-            # Create corpus
-            corpus = rag.create_corpus(
-                display_name=f"cli-rag-corpus-{subject}-{stance}".lower(),
-                embedding_model_config=embedding_model_config
-            )
-            
-            # Construct paths
-            subject_path = f"{self.base_bucket.rstrip('/')}/{subject.lower()}"
-            stance_bucket = f"{subject_path}/{stance.lower()}"
-            neutral_bucket = os.path.join(subject_path, "neutral")
-            
-            print(f"Importing documents from: {[stance_bucket, neutral_bucket]}")
-            
-            # Import documents from GCS buckets
-            print(f"Starting document import from: {[stance_bucket, neutral_bucket]}")
-            try:
-                import_response = rag.import_files(
-                    corpus_name=corpus.name,
-                    paths=[stance_bucket, neutral_bucket],
-                    chunk_size=1024,
-                    chunk_overlap=100,
-                    max_embedding_requests_per_min=900,
+            logger.debug("Analyzing stance...")
+            STANCE_SOURCE.labels("model").inc()
+            prompt = self.stance_prompt(text)
+            with span("stance_model", logger):
+                response = await self.stance_policy.call_async(
+                    lambda: self.default_model.start_chat().send_message_async(prompt, stream=False)
                 )
-                print("Document import completed successfully")
-                
-                # Verify corpus exists
-                try:
-                    verified_corpus = rag.get_corpus(corpus.name)
-                    print(f"Verified corpus creation: {verified_corpus.name}")
-                except Exception as verify_error:
-                    print(f"Warning: Could not verify corpus: {verify_error}")
-                
-            except Exception as import_error:
-                print(f"Warning during document import: {import_error}")
+            record_usage(response)
+            return self.parse_stance_response(text, response.text)
             
-            return corpus.name
+        except Exception as e:
+            logger.warning("Error in stance analysis: %s", e)
+            return FALLBACK_RESULT
+
+    def setup_rag_corpus(self, subject: str, stance: str) -> Optional[str]:
+        """Look up the prebuilt RAG corpus for this subject and stance"""
+        if self.local_retriever:
+            return None
+        try:
+            logger.debug("Setting up RAG corpus for %s %s...", stance, subject)
+            corpus_name = self.corpus_registry.get_corpus(subject, stance)
+            logger.info("Using corpus: %s", corpus_name)
+            return corpus_name
             
         except Exception as e:
-            print(f"Error setting up RAG corpus: {e}")
+            logger.error("Error setting up RAG corpus: %s", e)
             return None
 
-    def setup_chat_session(self, corpus_name: Optional[str] = None) -> ChatSession:
+    def setup_chat_session(self, corpus_name: Optional[str] = None, history: Optional[List[Content]] = None) -> ChatSession:
         """Initialize the chat session with RAG capability"""
         try:
-            print("Setting up chat session...")
+            logger.debug("Setting up chat session...")
             if corpus_name:
-                # Create RAG retrieval tool
-                retrieval_tool = Tool.from_retrieval(
-                    retrieval=rag.Retrieval(
-                        source=rag.VertexRagStore(
-                            rag_corpora=[corpus_name],
-                            similarity_top_k=5,
-                            vector_distance_threshold=0.7,
-                        ),
-                    )
-                )
-                
-                # Initialize model with RAG and adjusted safety settings
-                safety_settings=[
-                    SafetySetting(category=HarmCategory.HARM_CATEGORY_HATE_SPEECH, threshold=HarmBlockThreshold.BLOCK_NONE),
-                    SafetySetting(category=HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT, threshold=HarmBlockThreshold.BLOCK_NONE),
-                    SafetySetting(category=HarmCategory.HARM_CATEGORY_HARASSMENT, threshold=HarmBlockThreshold.BLOCK_NONE),
-                    SafetySetting(category=HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT, threshold=HarmBlockThreshold.BLOCK_NONE)
-                ]
-                
-                model = GenerativeModel(
-                    "gemini-1.5-pro-001",
-                    tools=[retrieval_tool],
-                    safety_settings=safety_settings
+                # The pro model with the corpus attached as a retrieval tool
+                similarity_top_k, vector_distance_threshold = self.vertex_retrieval_settings(corpus_name)
+                return self.model_factory.start_chat(
+                    RAG_MODEL_NAME, corpus_name, history=history, similarity_top_k=similarity_top_k,
+                    vector_distance_threshold=vector_distance_threshold, response_validation=False
                 )
-            else:
-                model = self.default_model
-            
-            return model.start_chat(response_validation=False)
+            if self.local_retriever:
+                # The pro model, grounded by the chunks added to the prompt
+                return self.model_factory.start_chat(RAG_MODEL_NAME, history=history, response_validation=False)
+            return self.default_model.start_chat(history=history, response_validation=False)
             
         except Exception as e:
-            print(f"Error setting up chat session: {e}")
-            return self.default_model.start_chat()
+            logger.error("Error setting up chat session: %s", e)
+            return self.default_model.start_chat(history=history)
 
-    def get_response(self, message: str, stream: bool = True) -> str:
-        """Get response from the model with optional streaming"""
-        try:
-            print("\nProcessing message...")
-            
-            # Only analyze stance and set up RAG for first message
-            if self.is_first_message:
-                self.stance, self.subject = self.analyze_stance(message)
-                print(f"Setting initial context - Stance: {self.stance}, Subject: {self.subject}")
-                
-                # Set up RAG corpus and chat session
-                corpus_name = self.setup_rag_corpus(self.subject, self.stance)
-                self.chat_session = self.setup_chat_session(corpus_name)
-                self.is_first_message = False
-                
-                # Construct initial roleplay prompt
-                prompt = f"""You are an AI assistant with access to retrieved documents about {self.subject}.
+    def roleplay_prompt(self, subject: str, stance: str) -> str:
+        """Initial prompt that sets up the counter-argument roleplay"""
+        return f"""You are an AI assistant with access to retrieved documents about {subject}.
                 Base your response ONLY on the retrieved documents.
                 For each claim you make, cite the specific document or source it comes from.
                 Make sure to only give the title of the document and clean it up (don't include .pdf or .docx).
-                Roleplay as someone who has done research in this area and is {self.stance} {self.subject}.
+                Roleplay as someone who has done research in this area and is {stance} {subject}.
                 Argue in first person and explain your position, supporting each point with citations from the retrieved documents.
                 Limit responses to 250 words."""
-            else:
-                # Use the message as is for subsequent interactions
-                prompt = message
+
+    def restore_conversation(self, messages: List[str]) -> ConversationState:
+        """Rebuild a conversation from stored messages (alternating user and bot turns)"""
+        state = ConversationState()
+        if not messages:
+            return state
+
+        state.stance, state.subject = self.analyze_stance(messages[0])
+        state.corpus_name = self.setup_rag_corpus(state.subject, state.stance)
+
+        # The first user turn was answered with the roleplay prompt, not the raw message
+        user_turns = [self.roleplay_prompt(state.subject, state.stance)] + messages[2::2]
+        bot_turns = messages[1::2]
+        state.turns = list(zip(user_turns, bot_turns))
+
+        # Long conversations come back as their newest turns; older ones are summarized in the background
+        self.refresh_context(state, force=True)
+        state.is_first_message = False
+        return state
+
+    def refresh_context(self, state: ConversationState, force: bool = False):
+        """Fold in a finished summary and trim the chat session to the context window"""
+        self.context_window.refresh(
+            state,
+            self.roleplay_prompt(state.subject, state.stance),
+            lambda history: self.setup_chat_session(state.corpus_name, history=history),
+            force=force,
+        )
+
+    def record_turn(self, message: str, response_text: str, state: ConversationState):
+        user_text = message if state.turns else self.roleplay_prompt(state.subject, state.stance)
+        self.context_window.record_turn(state, user_text, response_text)
+
+    def cached_opening(self, message: str, prompt: str, state: ConversationState) -> Tuple[Optional[str], str]:
+        """Look up the response cache on a conversation's first turn.
+
+        Returns (cached response to serve or None, prompt to send), where the
+        prompt carries the cached response as a draft in warm-start mode.
+        """
+        if state.turns:
+            return None, prompt
+        cached = self.response_cache.lookup(state.subject, state.stance, message)
+        if cached is None:
+            return None, prompt
+        if self.response_cache.mode == "warm":
+            return None, self.response_cache.warm_start_prompt(prompt, cached)
+
+        # Continue the conversation as if the model had just given the cached answer
+        history = [
+            Content(role="user", parts=[Part.from_text(prompt)]),
+            Content(role="model", parts=[Part.from_text(cached.response)]),
+        ]
+        state.chat_session = self.setup_chat_session(state.corpus_name, history=history)
+        state.citations = list(cached.citations)
+        return cached.response, prompt
+
+    def finish_turn(self, message: str, prompt: str, response_text: str, state: ConversationState):
+        if not state.turns:
+            self.response_cache.put(state.subject, state.stance, message, response_text, state.citations)
+        state.size += len(prompt) + len(response_text)
+        self.record_turn(message, response_text, state)
+
+    def prepare_prompt(self, message: str, state: ConversationState) -> str:
+        """Set up the conversation on its first message and return the prompt to send"""
+        state.citations = []
+        
+        # Only analyze stance and set up RAG for first message
+        if state.is_first_message:
+            with span("stance", logger):
+                state.stance, state.subject = self.analyze_stance(message)
+            logger.info("Setting initial context - Stance: %s, Subject: %s", state.stance, state.subject)
+            
+            # Set up RAG corpus and chat session
+            with span("corpus_setup", logger):
+                state.corpus_name = self.setup_rag_corpus(state.subject, state.stance)
+            state.chat_session = self.setup_chat_session(state.corpus_name)
+            state.is_first_message = False
+            
+            # Construct initial roleplay prompt
+            prompt = self.roleplay_prompt(state.subject, state.stance)
+        else:
+            self.refresh_context(state)
+            # Use the message as is for subsequent interactions
+            prompt = message
+        
+        return self.add_local_context(prompt, message, state)
+
+    async def prepare_prompt_async(self, message: str, state: ConversationState) -> str:
+        """Async counterpart of prepare_prompt; blocking setup runs in a worker thread"""
+        state.citations = []
+        
+        if state.is_first_message:
+            with span("stance", logger):
+                state.stance, state.subject = await self.analyze_stance_async(message)
+            logger.info("Setting initial context - Stance: %s, Subject: %s", state.stance, state.subject)
             
-            print("Generating response...")
-            # Get model response
-            responses = self.chat_session.send_message(prompt, stream=stream)
+            with span("corpus_setup", logger):
+                state.corpus_name = await asyncio.to_thread(self.setup_rag_corpus, state.subject, state.stance)
+            state.chat_session = self.setup_chat_session(state.corpus_name)
+            state.is_first_message = False
+            
+            prompt = self.roleplay_prompt(state.subject, state.stance)
+        else:
+            self.refresh_context(state)
+            prompt = message
+        
+        return await asyncio.to_thread(self.add_local_context, prompt, message, state)
+
+    def add_local_context(self, prompt: str, query: str, state: ConversationState) -> str:
+        """Prepend chunks from the local index when the local retrieval backend is enabled"""
+        if not self.local_retriever:
+            return prompt
+        with span("retrieval", logger):
+            contexts = self.local_retriever.retrieve(query, state.subject, state.stance)
+        logger.debug("Retrieved %d local chunks", len(contexts))
+        state.citations = [{"uri": c["source"], "title": c["title"]} for c in contexts]
+        if not contexts:
+            return prompt
+        return f"{LocalRetriever.format_contexts(contexts)}\n\n{prompt}"
+
+    def start_stream(self, prompt: str, corpus_name: Optional[str], history: List[Content]):
+        """Send ``prompt`` on a fresh session and wait for the first chunk.
+
+        Each attempt gets its own session so retried or hedged attempts never
+        append to the same history. Returns (session, first chunk, remaining chunks).
+        """
+        session = self.setup_chat_session(corpus_name, history=history)
+        responses = iter(session.send_message(prompt, stream=True))
+        return session, next(responses, None), responses
+
+    async def start_stream_async(self, prompt: str, corpus_name: Optional[str], history: List[Content]):
+        session = self.setup_chat_session(corpus_name, history=history)
+        responses = (await session.send_message_async(prompt, stream=True)).__aiter__()
+        try:
+            first = await responses.__anext__()
+        except StopAsyncIteration:
+            first = None
+        return session, first, responses
+
+    @staticmethod
+    def extract_citations(chunk) -> List[dict]:
+        """Collect the retrieved sources attached to a response chunk"""
+        citations = []
+        try:
+            metadata = chunk.candidates[0].grounding_metadata
+            for grounding_chunk in metadata.grounding_chunks:
+                context = grounding_chunk.retrieved_context
+                citations.append({"uri": context.uri, "title": context.title})
+        except (AttributeError, IndexError):
+            pass
+        return citations
+
+    def stream_response(self, message: str, state: Optional[ConversationState] = None) -> Iterator[str]:
+        """Yield response text chunks as soon as the model produces them.
+
+        Citations found in the response are stored on ``state.citations``
+        once the stream is exhausted. If the stream fails or is abandoned
+        before then, the conversation is rolled back to where it was before
+        the message, so a retry starts the turn afresh.
+        """
+        state = state or self.state
+        snapshot = state.snapshot()
+        try:
+            yield from self._stream_turn(message, state)
+        except BaseException:
+            state.restore(snapshot)
+            raise
+
+    def _stream_turn(self, message: str, state: ConversationState) -> Iterator[str]:
+        prompt = self.prepare_prompt(message, state)
+        cached_response, prompt = self.cached_opening(message, prompt, state)
+        if cached_response is not None:
+            self.finish_turn(message, prompt, cached_response, state)
+            yield cached_response
+            return
+        
+        logger.debug("Generating response...")
+        started = time.perf_counter()
+        # The whole stream, not just the first chunk, has to finish within the policy's deadline
+        deadline = time.monotonic() + self.generation_policy.deadline
+        session, first, responses = self.generation_policy.call(
+            self.start_stream, prompt, state.corpus_name, list(state.chat_session.history)
+        )
+        observe_stage("first_token", time.perf_counter() - started)
+        state.chat_session = session
+        
+        response_text = []
+        chunk = None
+        chunk_count = 0
+        remaining = self.generation_policy.stream(responses, deadline)
+        for chunk in itertools.chain([first] if first is not None else [], remaining):
+            chunk_count += 1
+            for citation in self.extract_citations(chunk):
+                if citation not in state.citations:
+                    state.citations.append(citation)
+            if chunk.text:
+                response_text.append(chunk.text)
+                yield chunk.text
+        
+        observe_stage("generation", time.perf_counter() - started)
+        RESPONSE_CHUNKS.observe(chunk_count)
+        # Usage totals arrive with the last chunk
+        record_usage(chunk)
+        response_text = "".join(response_text)
+        self.finish_turn(message, prompt, response_text, state)
+
+    async def stream_response_async(self, message: str, state: Optional[ConversationState] = None) -> AsyncIterator[str]:
+        """Async counterpart of stream_response"""
+        state = state or self.state
+        snapshot = state.snapshot()
+        turn = self._stream_turn_async(message, state)
+        try:
+            async for text in turn:
+                yield text
+        except BaseException:
+            state.restore(snapshot)
+            raise
+        finally:
+            await turn.aclose()
+
+    async def _stream_turn_async(self, message: str, state: ConversationState) -> AsyncIterator[str]:
+        prompt = await self.prepare_prompt_async(message, state)
+        cached_response, prompt = self.cached_opening(message, prompt, state)
+        if cached_response is not None:
+            self.finish_turn(message, prompt, cached_response, state)
+            yield cached_response
+            return
+        
+        logger.debug("Generating response...")
+        started = time.perf_counter()
+        deadline = time.monotonic() + self.generation_policy.deadline
+        session, first, responses = await self.generation_policy.call_async(
+            self.start_stream_async, prompt, state.corpus_name, list(state.chat_session.history)
+        )
+        observe_stage("first_token", time.perf_counter() - started)
+        state.chat_session = session
+        
+        remaining = self.generation_policy.stream_async(responses, deadline)
+        
+        async def chunks():
+            if first is not None:
+                yield first
+            async for chunk in remaining:
+                yield chunk
+        
+        response_text = []
+        chunk = None
+        chunk_count = 0
+        try:
+            async for chunk in chunks():
+                chunk_count += 1
+                for citation in self.extract_citations(chunk):
+                    if citation not in state.citations:
+                        state.citations.append(citation)
+                if chunk.text:
+                    response_text.append(chunk.text)
+                    yield chunk.text
+        finally:
+            # Cancels the model's stream when the turn is abandoned
+            await remaining.aclose()
+        
+        observe_stage("generation", time.perf_counter() - started)
+        RESPONSE_CHUNKS.observe(chunk_count)
+        record_usage(chunk)
+        response_text = "".join(response_text)
+        self.finish_turn(message, prompt, response_text, state)
+
+    def get_response(self, message: str, stream: bool = True, state: Optional[ConversationState] = None,
+                     echo: bool = False) -> str:
+        """Get response from the model with optional streaming; ``echo`` prints chunks as they arrive (CLI).
+
+        Raises if the model call fails, after rolling the conversation back to
+        where it was before the message.
+        """
+        state = state or self.state
+        snapshot = state.snapshot()
+        try:
+            logger.debug("Processing message...")
             
             if stream:
                 # Stream the response
                 response_text = []
-                print("\nBot: ", end="", flush=True)
-                for chunk in responses:
-                    if chunk.text:
-                        print(chunk.text, end="", flush=True)
-                        response_text.append(chunk.text)
-                print("\n")
+                if echo:
+                    print("\nBot: ", end="", flush=True)
+                for text in self.stream_response(message, state):
+                    if echo:
+                        print(text, end="", flush=True)
+                    response_text.append(text)
+                if echo:
+                    print("\n")
                 return "".join(response_text)
-            else:
-                # Return complete response
-                return responses.text
+            
+            prompt = self.prepare_prompt(message, state)
+            cached_response, prompt = self.cached_opening(message, prompt, state)
+            if cached_response is not None:
+                self.finish_turn(message, prompt, cached_response, state)
+                return cached_response
+            
+            logger.debug("Generating response...")
+            history = list(state.chat_session.history)
+            
+            def send():
+                session = self.setup_chat_session(state.corpus_name, history=history)
+                return session, session.send_message(prompt, stream=False)
+            
+            with span("generation", logger):
+                state.chat_session, response = self.generation_policy.call(send)
+            record_usage(response)
+            state.citations.extend(self.extract_citations(response))
+            self.finish_turn(message, prompt, response.text, state)
+            # Return complete response
+            return response.text
                 
         except Exception as e:
-            print(f"\nError getting response: {e}")
-            return f"Error: {str(e)}"
+            logger.error("Error getting response: %s", e)
+            state.restore(snapshot)
+            raise
+
+    async def get_response_async(self, message: str, state: Optional[ConversationState] = None) -> str:
+        """Get the full response without blocking the event loop; raises like get_response"""
+        try:
+            logger.debug("Processing message...")
+            return "".join([text async for text in self.stream_response_async(message, state)])
+        except Exception as e:
+            logger.error("Error getting response: %s", e)
+            raise
 
 class ChatSessionManager:
     def __init__(self):
@@ -232,9 +608,14 @@ class ChatSessionManager:
             self.stream_enabled = True
             return "Streaming enabled."
         else:
-            return self.chatbot.get_response(message, stream=self.stream_enabled)
+            try:
+                return self.chatbot.get_response(message, stream=self.stream_enabled, echo=True)
+            except Exception as e:
+                print(f"\nError: {e}")
+                return f"Error: {e}"
 
 if __name__ == "__main__":
+    setup_logging()
     try:
         # Initialize the chat session manager
         print("Initializing RAG chatbot...")
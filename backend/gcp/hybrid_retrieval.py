@@ -0,0 +1,214 @@
+import math
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from gcp.local_retrieval import LocalIndex, LocalRetriever, TOKEN_PATTERN
+from gcp.retrieval_config import RetrievalConfig
+
+# Too common to say anything about a chunk; also dropped from queries
+STOPWORDS = frozenset("""
+a about after all also an and any are as at be because been but by can could did do does for from had has
+have he her his how i if in into is it its just may me more most my no not of on one or other our out over
+she should so some such than that the their them then there these they this those to under up us was we
+were what when where which while who why will with would you your
+""".split())
+
+RRF_K = 60
+
+
+def tokenize(text: str) -> List[str]:
+    return [token for token in TOKEN_PATTERN.findall(text.lower()) if token not in STOPWORDS]
+
+
+class BM25Index:
+    """Okapi BM25 over a list of chunk texts, stored as flat posting arrays.
+
+    Each term's postings are a slice of ``doc_ids`` and of ``weights``, the
+    BM25 term-frequency component with length normalization already
+    applied, so scoring a query is one idf-scaled scatter-add per term.
+    The distinct bigrams of each chunk are kept as sorted term-id pairs for
+    phrase matching.
+    """
+
+    def __init__(self, texts: List[str], k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.doc_count = len(texts)
+
+        term_ids: Dict[str, int] = {}
+        doc_terms: List[Dict[int, int]] = []
+        doc_tokens: List[List[int]] = []
+        doc_lengths = np.zeros(self.doc_count, dtype=np.float32)
+        for doc, text in enumerate(texts):
+            counts: Dict[int, int] = {}
+            tokens = [term_ids.setdefault(token, len(term_ids)) for token in tokenize(text)]
+            for term in tokens:
+                counts[term] = counts.get(term, 0) + 1
+            doc_terms.append(counts)
+            doc_tokens.append(tokens)
+            doc_lengths[doc] = len(tokens)
+        self.term_ids = term_ids
+
+        bigrams = [np.unique(self._bigram_ids(tokens)) for tokens in doc_tokens]
+        self.bigram_offsets = np.concatenate([[0], np.cumsum([len(b) for b in bigrams])]).astype(np.int64)
+        self.bigrams = np.concatenate(bigrams) if bigrams else np.zeros(0, dtype=np.int64)
+
+        document_frequency = np.zeros(len(term_ids), dtype=np.int64)
+        for counts in doc_terms:
+            for term in counts:
+                document_frequency[term] += 1
+        self.offsets = np.concatenate([[0], np.cumsum(document_frequency)])
+        self.doc_ids = np.zeros(self.offsets[-1], dtype=np.int32)
+        term_frequencies = np.zeros(self.offsets[-1], dtype=np.float32)
+        cursor = self.offsets[:-1].copy()
+        for doc, counts in enumerate(doc_terms):
+            for term, count in counts.items():
+                self.doc_ids[cursor[term]] = doc
+                term_frequencies[cursor[term]] = count
+                cursor[term] += 1
+
+        average_length = float(doc_lengths.mean()) if self.doc_count else 0.0
+        norms = k1 * (1 - b + b * doc_lengths / (average_length or 1.0))
+        self.weights = term_frequencies * (k1 + 1) / (term_frequencies + norms[self.doc_ids])
+        self.idf = np.log(1 + (self.doc_count - document_frequency + 0.5) / (document_frequency + 0.5))
+
+    def _bigram_ids(self, tokens: List[int]) -> np.ndarray:
+        tokens = np.asarray(tokens, dtype=np.int64)
+        return tokens[:-1] * len(self.term_ids) + tokens[1:]
+
+    def query_bigrams(self, query_terms: List[str]) -> np.ndarray:
+        """Distinct bigram ids of the query; a bigram with an unknown term is -1 and never matches"""
+        ids = [self.term_ids.get(term, -1) for term in query_terms]
+        pairs = {(a, b) for a, b in zip(ids, ids[1:])}
+        return np.array([a * len(self.term_ids) + b if a >= 0 and b >= 0 else -1 for a, b in pairs], dtype=np.int64)
+
+    def bigram_matches(self, doc: int, bigram_ids: np.ndarray) -> int:
+        """How many of ``bigram_ids`` occur in the chunk"""
+        doc_bigrams = self.bigrams[self.bigram_offsets[doc]:self.bigram_offsets[doc + 1]]
+        if not len(doc_bigrams):
+            return 0
+        positions = np.searchsorted(doc_bigrams, bigram_ids).clip(max=len(doc_bigrams) - 1)
+        return int(np.count_nonzero(doc_bigrams[positions] == bigram_ids))
+
+    def postings(self, term: str) -> Optional[Tuple[np.ndarray, np.ndarray, float]]:
+        """(doc ids, weights, idf) for a term, or None if no chunk contains it"""
+        term_id = self.term_ids.get(term)
+        if term_id is None:
+            return None
+        start, end = self.offsets[term_id], self.offsets[term_id + 1]
+        return self.doc_ids[start:end], self.weights[start:end], float(self.idf[term_id])
+
+    def scores(self, query_terms: List[str]) -> np.ndarray:
+        """BM25 score of every chunk for the query"""
+        scores = np.zeros(self.doc_count, dtype=np.float32)
+        for term in set(query_terms):
+            postings = self.postings(term)
+            if postings is not None:
+                doc_ids, weights, idf = postings
+                scores[doc_ids] += idf * weights
+        return scores
+
+
+class HybridRetriever:
+    """BM25 and dense retrieval over the local index, fused and reranked.
+
+    Each of BM25 and the dense index nominates its ``candidates`` best
+    chunks of the (subject, stance) corpus; the lists are merged with
+    reciprocal rank fusion, and the merged candidates are reranked by a
+    cheap lexical/semantic score: the idf-weighted share of query terms
+    the chunk contains, the share of query bigrams it contains, and its
+    dense similarity. The ``similarity_top_k`` best chunks scoring at least
+    ``min_score`` are returned; both come from the subject's RetrievalConfig.
+    """
+
+    def __init__(self, index_dir: Optional[Path] = None, config: Optional[RetrievalConfig] = None,
+                 rerank: bool = True):
+        self.dense = LocalRetriever(index_dir, config)
+        self.index = self.dense.index
+        self.config = self.dense.config
+        self.rerank = rerank
+        # Built from the chunk texts at startup; in the gunicorn master when preloading
+        self.bm25 = BM25Index([chunk["text"] for chunk in self.index.chunks])
+
+    def corpus_rows(self, subject: str, stance: str) -> np.ndarray:
+        ranges = self.index.corpus_ranges(subject, stance)
+        if not ranges:
+            return np.zeros(0, dtype=np.int64)
+        return np.concatenate([np.arange(start, end) for start, end in ranges])
+
+    @staticmethod
+    def top(scores: np.ndarray, k: int) -> np.ndarray:
+        """Positions of the ``k`` highest scores, best first"""
+        k = min(k, len(scores))
+        if k == 0:
+            return np.zeros(0, dtype=np.int64)
+        top = np.argpartition(-scores, k - 1)[:k]
+        return top[np.argsort(-scores[top], kind="stable")]
+
+    def rerank_scores(self, query_terms: List[str], rows: np.ndarray, similarities: np.ndarray) -> np.ndarray:
+        """Rerank score in [0, 1] for each candidate row"""
+        terms = set(query_terms)
+        total_idf = 0.0
+        coverage = np.zeros(len(rows), dtype=np.float32)
+        for term in terms:
+            postings = self.bm25.postings(term)
+            if postings is None:
+                # A term no chunk contains still counts against coverage
+                total_idf += math.log(1 + (self.bm25.doc_count + 0.5) / 0.5)
+                continue
+            doc_ids, _, idf = postings
+            total_idf += idf
+            coverage += idf * np.isin(rows, doc_ids)
+        coverage /= total_idf or 1.0
+
+        query_bigrams = self.bm25.query_bigrams(query_terms)
+        phrase = np.zeros(len(rows), dtype=np.float32)
+        if len(query_bigrams):
+            for i, row in enumerate(rows):
+                phrase[i] = self.bm25.bigram_matches(row, query_bigrams) / len(query_bigrams)
+
+        similarity = np.clip(similarities, 0, None)
+        similarity = similarity / (similarity.max() or 1.0)
+        return 0.45 * coverage + 0.25 * phrase + 0.30 * similarity
+
+    def retrieve(self, query: str, subject: str, stance: str) -> List[dict]:
+        settings = self.config.settings(subject)
+        rows = self.corpus_rows(subject, stance)
+        query_terms = tokenize(query)
+        if not len(rows):
+            return []
+
+        similarities = np.concatenate([
+            self.index.embedder.embed([query]) @ self.index.embeddings[start:end].T
+            for start, end in self.index.corpus_ranges(subject, stance)
+        ], axis=1)[0]
+        sparse = self.bm25.scores(query_terms)[rows]
+
+        # Reciprocal rank fusion over each retriever's candidates; positions index into rows.
+        # Chunks sharing no term with the query all score 0 and their order is arbitrary, so
+        # BM25 only nominates chunks that match
+        sparse_ranking = self.top(sparse, settings["candidates"])
+        sparse_ranking = sparse_ranking[sparse[sparse_ranking] > 0]
+        fused: Dict[int, float] = {}
+        for ranking in (sparse_ranking, self.top(similarities, settings["candidates"])):
+            for rank, position in enumerate(ranking):
+                fused[position] = fused.get(position, 0.0) + 1.0 / (RRF_K + rank + 1)
+        positions = np.array(sorted(fused, key=lambda p: -fused[p]), dtype=np.int64)
+        if self.rerank:
+            scores = self.rerank_scores(query_terms, rows[positions], similarities[positions])
+            order = np.argsort(-scores, kind="stable")
+            positions, scores = positions[order], scores[order]
+        else:
+            scores = np.array([fused[p] for p in positions], dtype=np.float32)
+
+        contexts = []
+        for position, score in zip(positions, scores):
+            if len(contexts) == settings["similarity_top_k"]:
+                break
+            if self.rerank and score < settings["min_score"]:
+                break
+            chunk = self.index.chunks[rows[position]]
+            contexts.append(dict(chunk, distance=1.0 - float(similarities[position]), score=float(score)))
+        return contexts
+
+    format_contexts = staticmethod(LocalRetriever.format_contexts)
@@ -0,0 +1,198 @@
+import os
+import json
+import hashlib
+from pathlib import Path
+from typing import Dict, List, Optional
+import numpy as np
+from gcp.local_retrieval import (
+    PAPERS_DIR, DEFAULT_INDEX_DIR, CHUNK_SIZE, CHUNK_OVERLAP,
+    HashingEmbedder, chunk_text,
+)
+from gcp.pdf_extraction import BulkExtractor
+
+
+def file_sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class IngestionPipeline:
+    """Incrementally keeps the local index in sync with the Papers/ tree.
+
+    Every PDF is hashed and recorded in a manifest. Only new or changed files
+    are extracted, chunked and embedded; their chunks are stored per document
+    under ``docs/<sha256>`` so the combined index can be reassembled from the
+    stored parts without touching unchanged documents.
+    """
+
+    def __init__(self, papers_dir: Path = PAPERS_DIR, index_dir: Path = DEFAULT_INDEX_DIR,
+                 dim: int = 2048, chunk_size: int = CHUNK_SIZE, chunk_overlap: int = CHUNK_OVERLAP,
+                 extraction_cache_dir: Optional[Path] = None, max_workers: Optional[int] = None):
+        self.papers_dir = Path(papers_dir)
+        self.index_dir = Path(index_dir)
+        self.docs_dir = self.index_dir / "docs"
+        self.manifest_path = self.index_dir / "manifest.json"
+        self.extractor = BulkExtractor(
+            extraction_cache_dir or os.getenv("EXTRACTION_CACHE_DIR", self.index_dir / "extracted"),
+            max_workers=max_workers,
+        )
+        self.embedder = HashingEmbedder(dim)
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+
+    def _settings(self) -> dict:
+        return {"dim": self.embedder.dim, "chunk_size": self.chunk_size, "chunk_overlap": self.chunk_overlap}
+
+    def load_manifest(self) -> dict:
+        try:
+            with open(self.manifest_path) as f:
+                manifest = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            # Any stored parts were built with unknown settings
+            self._clear_parts()
+            return {"settings": self._settings(), "files": {}}
+        if manifest.get("settings") != self._settings():
+            print("Chunking or embedding settings changed, re-ingesting every document")
+            self._clear_parts()
+            return {"settings": self._settings(), "files": {}}
+        return manifest
+
+    def _clear_parts(self):
+        """Delete every stored document part, so none built with other settings is reused"""
+        for path in self.docs_dir.glob("*"):
+            if path.suffix in (".npy", ".json"):
+                path.unlink(missing_ok=True)
+
+    def _write_json(self, path: Path, data):
+        tmp_path = path.with_suffix(".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+
+    def scan(self) -> Dict[str, Path]:
+        """Map the relative path of every PDF under <subject>/<stance>/ to its location"""
+        return {
+            str(path.relative_to(self.papers_dir)): path
+            for path in sorted(self.papers_dir.glob("*/*/*.pdf"))
+        }
+
+    def ingest_document(self, pages: List[str], sha256: str) -> int:
+        """Chunk and embed one extracted document and store its parts; returns the chunk count"""
+        text = "\n".join(pages)
+        chunks = chunk_text(text, self.chunk_size, self.chunk_overlap)
+        np.save(self.docs_dir / f"{sha256}.npy", self.embedder.embed(chunks))
+        self._write_json(self.docs_dir / f"{sha256}.json", chunks)
+        return len(chunks)
+
+    def run(self) -> dict:
+        """Bring the index up to date; returns counts of added, updated, removed and unchanged files"""
+        self.docs_dir.mkdir(parents=True, exist_ok=True)
+        manifest = self.load_manifest()
+        files = manifest["files"]
+        current = self.scan()
+        stats = {"added": 0, "updated": 0, "removed": 0, "unchanged": 0}
+
+        for relpath in [p for p in files if p not in current]:
+            entry = files.pop(relpath)
+            self._release(entry["sha256"], files)
+            print(f"Removed {relpath}")
+            stats["removed"] += 1
+
+        to_extract = {}
+        for relpath, path in current.items():
+            stat = path.stat()
+            entry = files.get(relpath)
+            if entry and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime:
+                stats["unchanged"] += 1
+                continue
+
+            sha256 = file_sha256(path)
+            if entry and entry["sha256"] == sha256:
+                # Touched but not modified
+                entry["mtime"] = stat.st_mtime
+                stats["unchanged"] += 1
+                continue
+
+            if (self.docs_dir / f"{sha256}.npy").exists():
+                # Same content already ingested under another path
+                with open(self.docs_dir / f"{sha256}.json") as f:
+                    self._record(files, relpath, sha256, stat, len(json.load(f)), stats)
+            else:
+                to_extract[relpath] = (path, sha256)
+
+        # Extraction runs in parallel; chunking and embedding happen here as documents finish
+        for relpath, pages in self.extractor.extract_all(to_extract):
+            if pages is None:
+                continue
+            path, sha256 = to_extract[relpath]
+            chunk_count = self.ingest_document(pages, sha256)
+            self._record(files, relpath, sha256, path.stat(), chunk_count, stats)
+
+        changed = stats["added"] or stats["updated"] or stats["removed"]
+        if changed or not (self.index_dir / "metadata.json").exists():
+            self.assemble(files)
+        self._write_json(self.manifest_path, manifest)
+        print(f"Ingestion finished: {stats}")
+        return stats
+
+    def _record(self, files: dict, relpath: str, sha256: str, stat: os.stat_result, chunk_count: int, stats: dict):
+        entry = files.get(relpath)
+        previous = entry["sha256"] if entry else None
+        files[relpath] = {
+            "sha256": sha256,
+            "size": stat.st_size,
+            "mtime": stat.st_mtime,
+            "chunks": chunk_count,
+        }
+        if previous:
+            self._release(previous, files)
+        stats["updated" if entry else "added"] += 1
+        print(f"{'Updated' if entry else 'Added'} {relpath}: {chunk_count} chunks")
+
+    def _release(self, sha256: str, files: dict):
+        """Delete the stored chunks of a document no longer referenced by any path"""
+        if any(entry["sha256"] == sha256 for entry in files.values()):
+            return
+        for suffix in (".npy", ".json"):
+            (self.docs_dir / f"{sha256}{suffix}").unlink(missing_ok=True)
+
+    def assemble(self, files: dict):
+        """Concatenate the stored per-document parts into the index read by LocalIndex"""
+        chunks: List[dict] = []
+        ranges: Dict[str, tuple] = {}
+        blocks = []
+
+        by_folder: Dict[str, List[str]] = {}
+        for relpath in sorted(files):
+            folder = str(Path(relpath).parent).lower()
+            by_folder.setdefault(folder, []).append(relpath)
+
+        for folder, relpaths in by_folder.items():
+            start = len(chunks)
+            for relpath in relpaths:
+                sha256 = files[relpath]["sha256"]
+                with open(self.docs_dir / f"{sha256}.json") as f:
+                    texts = json.load(f)
+                if not texts:
+                    continue
+                blocks.append(np.load(self.docs_dir / f"{sha256}.npy"))
+                title = Path(relpath).stem
+                chunks.extend({"text": text, "title": title, "source": relpath} for text in texts)
+            ranges[folder] = (start, len(chunks))
+
+        matrix = np.concatenate(blocks) if blocks else np.zeros((0, self.embedder.dim), dtype=np.float32)
+        # Write to temporary files and swap them in, so processes that have the
+        # old matrix memory-mapped keep reading a consistent snapshot
+        tmp_path = self.index_dir / "embeddings.tmp.npy"
+        np.save(tmp_path, matrix.astype(np.float32))
+        os.replace(tmp_path, self.index_dir / "embeddings.npy")
+        self._write_json(self.index_dir / "metadata.json",
+                         {"dim": self.embedder.dim, "chunks": chunks, "ranges": ranges})
+        print(f"Assembled local index: {len(chunks)} chunks from {len(files)} documents")
+
+
+if __name__ == "__main__":
+    IngestionPipeline().run()
@@ -0,0 +1,167 @@
+import os
+import re
+import json
+import zlib
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+import numpy as np
+from gcp.retrieval_config import RetrievalConfig, DEFAULT_SETTINGS
+
+PAPERS_DIR = Path(__file__).parent.parent.parent / "Papers"
+DEFAULT_INDEX_DIR = Path(__file__).parent / "local_index"
+
+CHUNK_SIZE = 1024
+CHUNK_OVERLAP = 100
+SIMILARITY_TOP_K = DEFAULT_SETTINGS["similarity_top_k"]
+VECTOR_DISTANCE_THRESHOLD = DEFAULT_SETTINGS["local_vector_distance_threshold"]
+
+# Stance analysis labels that differ from the folder names under Papers/
+SUBJECT_FOLDERS = {
+    "artificial_intelligence_regulation": "artificial_intelligence",
+    "universal_healthcare": "healthcare",
+}
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:'[a-z]+)?")
+
+
+def subject_folder(subject: str) -> str:
+    subject = subject.lower()
+    return SUBJECT_FOLDERS.get(subject, subject)
+
+
+def chunk_text(text: str, chunk_size: int = CHUNK_SIZE, chunk_overlap: int = CHUNK_OVERLAP) -> List[str]:
+    """Split text into windows of ``chunk_size`` words overlapping by ``chunk_overlap`` words"""
+    words = text.split()
+    if not words:
+        return []
+    step = max(chunk_size - chunk_overlap, 1)
+    chunks = []
+    for start in range(0, len(words), step):
+        chunks.append(" ".join(words[start:start + chunk_size]))
+        if start + chunk_size >= len(words):
+            break
+    return chunks
+
+
+class HashingEmbedder:
+    """Stateless text embedder using the hashing trick over unigrams and bigrams.
+
+    Needs no vocabulary or model download, so the same vectors are produced
+    in every process and the index can be built and queried offline.
+    """
+
+    def __init__(self, dim: int = 2048):
+        self.dim = dim
+
+    def _features(self, text: str) -> Dict[int, float]:
+        tokens = TOKEN_PATTERN.findall(text.lower())
+        features: Dict[int, float] = {}
+        grams = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+        for gram in grams:
+            h = zlib.crc32(gram.encode("utf-8"))
+            index = h % self.dim
+            sign = 1.0 if (h >> 31) & 1 else -1.0
+            features[index] = features.get(index, 0.0) + sign
+        return features
+
+    def embed(self, texts: Iterable[str]) -> np.ndarray:
+        texts = list(texts)
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for index, value in self._features(text).items():
+                # Sublinear term frequency keeps long chunks from being dominated by common terms
+                matrix[row, index] = np.sign(value) * (1.0 + np.log(abs(value))) if value else 0.0
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return matrix / norms
+
+
+class LocalIndex:
+    """Chunk embeddings for the Papers/ corpus stored as a memory-mapped float32 matrix.
+
+    Rows are grouped by ``<subject>/<stance>`` folder so a (subject, stance)
+    corpus is a couple of contiguous slices of the matrix. The files are
+    written by ``gcp.ingestion.IngestionPipeline``.
+    """
+
+    def __init__(self, index_dir: Path = DEFAULT_INDEX_DIR):
+        self.index_dir = Path(index_dir)
+        with open(self.index_dir / "metadata.json") as f:
+            metadata = json.load(f)
+        self.embedder = HashingEmbedder(metadata["dim"])
+        self.chunks: List[dict] = metadata["chunks"]
+        self.ranges: Dict[str, Tuple[int, int]] = {k: tuple(v) for k, v in metadata["ranges"].items()}
+        self.embeddings = np.load(self.index_dir / "embeddings.npy", mmap_mode="r")
+
+    def corpus_ranges(self, subject: str, stance: str) -> List[Tuple[int, int]]:
+        """Row ranges making up the corpus for a subject: its stance folder plus neutral"""
+        folder = subject_folder(subject)
+        wanted = {stance.lower(), "neutral"}
+        return [r for key, r in self.ranges.items()
+                if key.split("/")[0] == folder and key.split("/")[1] in wanted]
+
+    def query(self, queries: List[str], subject: str, stance: str,
+              similarity_top_k: int = SIMILARITY_TOP_K,
+              vector_distance_threshold: float = VECTOR_DISTANCE_THRESHOLD) -> List[List[dict]]:
+        """Return the closest chunks for each query, as one batched matrix product per slice"""
+        ranges = self.corpus_ranges(subject, stance)
+        if not queries or not ranges:
+            return [[] for _ in queries]
+
+        query_matrix = self.embedder.embed(queries)
+        rows = np.concatenate([np.arange(start, end) for start, end in ranges])
+        scores = np.concatenate([query_matrix @ self.embeddings[start:end].T for start, end in ranges], axis=1)
+
+        results = []
+        k = min(similarity_top_k, scores.shape[1])
+        for query_scores in scores:
+            top = np.argpartition(-query_scores, k - 1)[:k] if k else []
+            top = sorted(top, key=lambda i: -query_scores[i])
+            contexts = []
+            for i in top:
+                distance = 1.0 - float(query_scores[i])
+                if distance > vector_distance_threshold:
+                    continue
+                contexts.append(dict(self.chunks[rows[i]], distance=distance))
+            results.append(contexts)
+        return results
+
+
+class LocalRetriever:
+    """Drop-in replacement for the Vertex RAG store backed by a LocalIndex; top-k and
+    threshold come from the subject's RetrievalConfig"""
+
+    def __init__(self, index_dir: Optional[Path] = None, config: Optional[RetrievalConfig] = None):
+        self.index = LocalIndex(index_dir or os.getenv("LOCAL_INDEX_DIR", DEFAULT_INDEX_DIR))
+        self.config = config or RetrievalConfig()
+
+    def retrieve(self, query: str, subject: str, stance: str) -> List[dict]:
+        settings = self.config.settings(subject)
+        return self.index.query(
+            [query], subject, stance,
+            similarity_top_k=settings["similarity_top_k"],
+            vector_distance_threshold=settings["local_vector_distance_threshold"],
+        )[0]
+
+    @staticmethod
+    def format_contexts(contexts: List[dict]) -> str:
+        """Render retrieved chunks as a prompt section the model can cite from"""
+        sections = [f"[{i}] {c['title']}\n{c['text']}" for i, c in enumerate(contexts, 1)]
+        return "Retrieved documents:\n\n" + "\n\n".join(sections)
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+
+    if len(sys.argv) > 1 and sys.argv[1] == "build":
+        from gcp.ingestion import IngestionPipeline
+        IngestionPipeline().run()
+    else:
+        retriever = LocalRetriever()
+        query = " ".join(sys.argv[1:]) or "guns should be banned"
+        start = time.perf_counter()
+        contexts = retriever.retrieve(query, "gun_laws", "for")
+        print(f"Retrieved {len(contexts)} chunks in {(time.perf_counter() - start) * 1000:.1f} ms")
+        for c in contexts:
+            print(f"{c['distance']:.3f}  {c['title']}")
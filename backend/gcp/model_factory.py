@@ -0,0 +1,81 @@
+import threading
+from collections import OrderedDict
+from typing import List, Optional
+from vertexai.preview import rag
+from vertexai.preview.generative_models import GenerativeModel, Tool, ChatSession, Content, SafetySetting, HarmCategory, HarmBlockThreshold
+
+DEFAULT_MODEL_NAME = "gemini-1.5-flash-001"
+RAG_MODEL_NAME = "gemini-1.5-pro-001"
+
+# Debates cover sensitive subjects, so no category is blocked
+SAFETY_SETTINGS = [
+    SafetySetting(category=HarmCategory.HARM_CATEGORY_HATE_SPEECH, threshold=HarmBlockThreshold.BLOCK_NONE),
+    SafetySetting(category=HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT, threshold=HarmBlockThreshold.BLOCK_NONE),
+    SafetySetting(category=HarmCategory.HARM_CATEGORY_HARASSMENT, threshold=HarmBlockThreshold.BLOCK_NONE),
+    SafetySetting(category=HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT, threshold=HarmBlockThreshold.BLOCK_NONE)
+]
+
+
+class ModelFactory:
+    """Builds each (model_name, corpus, retrieval settings) model and its retrieval tool once and reuses it.
+
+    GenerativeModel and Tool objects hold only configuration, so one instance
+    can back any number of chat sessions; start_chat() on a cached model is
+    all a new conversation pays for.
+    """
+
+    def __init__(self, similarity_top_k: int = 5, vector_distance_threshold: float = 0.7,
+                 max_models: int = 64):
+        self.similarity_top_k = similarity_top_k
+        self.vector_distance_threshold = vector_distance_threshold
+        self.max_models = max_models
+
+        self._lock = threading.Lock()
+        self._models: "OrderedDict[tuple, GenerativeModel]" = OrderedDict()
+
+    def retrieval_tool(self, corpus_name: str, similarity_top_k: Optional[int] = None,
+                       vector_distance_threshold: Optional[float] = None) -> Tool:
+        return Tool.from_retrieval(
+            retrieval=rag.Retrieval(
+                source=rag.VertexRagStore(
+                    rag_corpora=[corpus_name],
+                    similarity_top_k=self.similarity_top_k if similarity_top_k is None else similarity_top_k,
+                    vector_distance_threshold=(self.vector_distance_threshold if vector_distance_threshold is None
+                                               else vector_distance_threshold),
+                ),
+            )
+        )
+
+    def model(self, model_name: str = DEFAULT_MODEL_NAME, corpus_name: Optional[str] = None,
+              similarity_top_k: Optional[int] = None, vector_distance_threshold: Optional[float] = None) -> GenerativeModel:
+        if corpus_name is None:
+            similarity_top_k = vector_distance_threshold = None
+        else:
+            # Resolve the defaults first, so both spellings of the same settings share one model
+            similarity_top_k = self.similarity_top_k if similarity_top_k is None else similarity_top_k
+            if vector_distance_threshold is None:
+                vector_distance_threshold = self.vector_distance_threshold
+        key = (model_name, corpus_name, similarity_top_k, vector_distance_threshold)
+        with self._lock:
+            model = self._models.get(key)
+            if model is not None:
+                self._models.move_to_end(key)
+                return model
+
+        tools = [self.retrieval_tool(corpus_name, similarity_top_k, vector_distance_threshold)] if corpus_name else None
+        model = GenerativeModel(model_name, tools=tools, safety_settings=SAFETY_SETTINGS)
+
+        with self._lock:
+            # Keep the first instance if another thread built the same model meanwhile
+            model = self._models.setdefault(key, model)
+            self._models.move_to_end(key)
+            # Rebuilt corpora get new names, so old entries simply age out
+            while len(self._models) > self.max_models:
+                self._models.popitem(last=False)
+            return model
+
+    def start_chat(self, model_name: str = DEFAULT_MODEL_NAME, corpus_name: Optional[str] = None,
+                   history: Optional[List[Content]] = None, similarity_top_k: Optional[int] = None,
+                   vector_distance_threshold: Optional[float] = None, **kwargs) -> ChatSession:
+        model = self.model(model_name, corpus_name, similarity_top_k, vector_distance_threshold)
+        return model.start_chat(history=history, **kwargs)
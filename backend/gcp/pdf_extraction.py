@@ -0,0 +1,120 @@
+import os
+import gzip
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, Iterator, List, Optional, Tuple
+
+# Pages are stored separated by form feeds, which PDF text extraction never emits inside a page
+PAGE_SEPARATOR = "\f"
+
+
+def iter_pages(path: Path, start: int = 0, end: Optional[int] = None) -> Iterator[str]:
+    """Yield the text of pages ``start`` to ``end`` one at a time"""
+    import fitz
+    with fitz.open(path) as document:
+        end = document.page_count if end is None else min(end, document.page_count)
+        for page_number in range(start, end):
+            yield document[page_number].get_text().replace(PAGE_SEPARATOR, " ")
+
+
+def page_count(path: Path) -> int:
+    import fitz
+    with fitz.open(path) as document:
+        return document.page_count
+
+
+def _extract_range(path: str, start: int, end: int) -> List[str]:
+    # Runs in a worker process
+    return list(iter_pages(Path(path), start, end))
+
+
+class ExtractionCache:
+    """Extracted page text on disk, keyed by the SHA-256 of the source file"""
+
+    def __init__(self, cache_dir: Path):
+        self.cache_dir = Path(cache_dir)
+
+    def _path(self, sha256: str) -> Path:
+        return self.cache_dir / sha256[:2] / f"{sha256}.txt.gz"
+
+    def get(self, sha256: str) -> Optional[List[str]]:
+        try:
+            with gzip.open(self._path(sha256), "rt", encoding="utf-8") as f:
+                return f.read().split(PAGE_SEPARATOR)
+        except FileNotFoundError:
+            return None
+
+    def put(self, sha256: str, pages: List[str]):
+        path = self._path(sha256)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(".tmp")
+        with gzip.open(tmp_path, "wt", encoding="utf-8", compresslevel=6) as f:
+            f.write(PAGE_SEPARATOR.join(pages))
+        os.replace(tmp_path, path)
+
+
+class BulkExtractor:
+    """Extracts many PDFs across a process pool, skipping documents already in the cache.
+
+    Large documents are split into page ranges so a single long PDF does not
+    serialise the whole run.
+    """
+
+    def __init__(self, cache_dir: Path, max_workers: Optional[int] = None, pages_per_task: int = 32):
+        self.cache = ExtractionCache(cache_dir)
+        self.max_workers = max_workers or os.cpu_count()
+        self.pages_per_task = pages_per_task
+
+    def extract_all(self, documents: Dict[str, Tuple[Path, str]]) -> Iterator[Tuple[str, Optional[List[str]]]]:
+        """Yield ``(key, pages)`` for each ``key -> (path, sha256)`` as soon as its pages are ready.
+
+        ``pages`` is None when the document could not be extracted.
+        """
+        pending = {}
+        for key, (path, sha256) in documents.items():
+            pages = self.cache.get(sha256)
+            if pages is not None:
+                yield key, pages
+            else:
+                pending[key] = (path, sha256)
+
+        if not pending:
+            return
+
+        with ProcessPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {}
+            parts: Dict[str, Dict[int, List[str]]] = {}
+            remaining: Dict[str, int] = {}
+            for key, (path, _) in pending.items():
+                try:
+                    total = page_count(path)
+                except Exception as e:
+                    print(f"Warning: Could not open {path}: {e}")
+                    yield key, None
+                    continue
+                starts = range(0, max(total, 1), self.pages_per_task)
+                parts[key] = {}
+                remaining[key] = len(starts)
+                for start in starts:
+                    future = executor.submit(_extract_range, str(path), start, start + self.pages_per_task)
+                    futures[future] = (key, start)
+
+            for future in as_completed(futures):
+                key, start = futures[future]
+                if key not in parts:
+                    # An earlier page range of this document already failed
+                    continue
+                try:
+                    parts[key][start] = future.result()
+                except Exception as e:
+                    print(f"Warning: Could not extract {pending[key][0]}: {e}")
+                    del parts[key]
+                    yield key, None
+                    continue
+
+                remaining[key] -= 1
+                if remaining[key] == 0:
+                    pages = [page for s in sorted(parts[key]) for page in parts[key][s]]
+                    self.cache.put(pending[key][1], pages)
+                    del parts[key]
+                    yield key, pages
@@ -0,0 +1,118 @@
+import logging
+import os
+import time
+import threading
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from gcp.local_retrieval import HashingEmbedder
+from observability import RESPONSE_CACHE_LOOKUPS
+
+logger = logging.getLogger(__name__)
+
+
+class CachedResponse:
+    def __init__(self, message: str, response: str, citations: List[dict], expires_at: float):
+        self.message = message
+        self.response = response
+        self.citations = citations
+        self.expires_at = expires_at
+
+
+class _Bucket:
+    """Responses for one (subject, stance), with their message embeddings stacked for one matmul per lookup"""
+    def __init__(self, dim: int):
+        self.vectors = np.zeros((0, dim), dtype=np.float32)
+        self.entries: List[CachedResponse] = []
+
+
+class ResponseCache:
+    """Opening responses keyed by (subject, stance) and the embedding of the user's first message.
+
+    A new opening argument whose cosine similarity to a cached one reaches
+    ``similarity`` gets that response: served directly in "serve" mode, or
+    passed to the model as a draft in "warm" mode. Each (subject, stance)
+    keeps at most ``max_per_key`` responses, oldest first out, and entries
+    expire after ``ttl`` seconds. Only grounded responses (with citations)
+    are stored. Disabled unless RESPONSE_CACHE=1.
+    """
+
+    def __init__(self, enabled: bool = None, mode: str = None, similarity: float = None,
+                 ttl: float = None, max_per_key: int = 256, embedder: Optional[HashingEmbedder] = None):
+        self.enabled = enabled if enabled is not None else os.getenv("RESPONSE_CACHE", "0") == "1"
+        self.mode = (mode or os.getenv("RESPONSE_CACHE_MODE", "serve")).lower()
+        self.similarity = similarity or float(os.getenv("RESPONSE_CACHE_SIMILARITY", "0.75"))
+        self.ttl = ttl or float(os.getenv("RESPONSE_CACHE_TTL", str(24 * 3600)))
+        self.max_per_key = max_per_key
+        self.embedder = embedder or HashingEmbedder()
+
+        self._lock = threading.Lock()
+        self._buckets: Dict[Tuple[str, str], _Bucket] = {}
+        self._hits: Dict[str, int] = defaultdict(int)
+        self._misses: Dict[str, int] = defaultdict(int)
+
+    def _embed(self, message: str) -> np.ndarray:
+        return self.embedder.embed([message])[0]
+
+    def _expire(self, bucket: _Bucket):
+        now = time.time()
+        keep = [i for i, entry in enumerate(bucket.entries) if entry.expires_at > now]
+        if len(keep) != len(bucket.entries):
+            bucket.vectors = bucket.vectors[keep]
+            bucket.entries = [bucket.entries[i] for i in keep]
+
+    def lookup(self, subject: str, stance: str, message: str) -> Optional[CachedResponse]:
+        if not self.enabled:
+            return None
+        vector = self._embed(message)
+        with self._lock:
+            bucket = self._buckets.get((subject, stance))
+            if bucket is not None:
+                self._expire(bucket)
+            if bucket is None or not bucket.entries:
+                self._misses[subject] += 1
+                RESPONSE_CACHE_LOOKUPS.labels(subject, "miss").inc()
+                return None
+            scores = bucket.vectors @ vector
+            best = int(np.argmax(scores))
+            if scores[best] < self.similarity:
+                self._misses[subject] += 1
+                RESPONSE_CACHE_LOOKUPS.labels(subject, "miss").inc()
+                return None
+            self._hits[subject] += 1
+            entry = bucket.entries[best]
+        RESPONSE_CACHE_LOOKUPS.labels(subject, "hit").inc()
+        logger.info("Response cache hit for %s %s (similarity %.2f)", stance, subject, scores[best])
+        return entry
+
+    def put(self, subject: str, stance: str, message: str, response: str, citations: List[dict]):
+        if not self.enabled or not response or not citations:
+            return
+        vector = self._embed(message)
+        entry = CachedResponse(message, response, list(citations), time.time() + self.ttl)
+        with self._lock:
+            bucket = self._buckets.setdefault((subject, stance), _Bucket(self.embedder.dim))
+            self._expire(bucket)
+            if bucket.entries and float(np.max(bucket.vectors @ vector)) >= 0.999:
+                # Same opening argument again: keep the existing answer
+                return
+            bucket.vectors = np.vstack([bucket.vectors, vector[None, :]])[-self.max_per_key:]
+            bucket.entries = (bucket.entries + [entry])[-self.max_per_key:]
+
+    def warm_start_prompt(self, prompt: str, cached: CachedResponse) -> str:
+        return f"""{prompt}
+
+                A previous answer to a similar opening argument is below. Reuse its sources and
+                structure where they fit, but respond to this conversation:
+                {cached.response}"""
+
+    def stats(self) -> dict:
+        """Hits, misses and hit rate per subject, plus the number of cached responses"""
+        with self._lock:
+            subjects = set(self._hits) | set(self._misses)
+            per_subject = {}
+            for subject in sorted(subjects):
+                hits, misses = self._hits[subject], self._misses[subject]
+                per_subject[subject] = {"hits": hits, "misses": misses, "hit_rate": hits / (hits + misses)}
+            size = sum(len(bucket.entries) for bucket in self._buckets.values())
+        return {"enabled": self.enabled, "size": size, "subjects": per_subject}
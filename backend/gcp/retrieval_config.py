@@ -0,0 +1,53 @@
+import os
+import json
+import logging
+from pathlib import Path
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Untuned starting points: no subject has been tuned yet. Tune per subject only against labelled
+# argument queries (benchmarks/retrieval.py --queries-file), not the generated span/title queries
+DEFAULT_SETTINGS = {
+    # Chunks passed to the model
+    "similarity_top_k": 5,
+    # Vertex RAG store cutoff (cosine distance of Vertex embeddings)
+    "vector_distance_threshold": 0.7,
+    # Local dense index cutoff; sparse hashed vectors sit further apart than Vertex embeddings
+    "local_vector_distance_threshold": float(os.getenv("LOCAL_VECTOR_DISTANCE_THRESHOLD", "0.95")),
+    # Hybrid retrieval: chunks taken from each of BM25 and the dense index before fusion
+    "candidates": 30,
+    # Hybrid retrieval: reranked chunks scoring below this are dropped
+    "min_score": 0.2,
+}
+
+
+class RetrievalConfig:
+    """Retrieval settings per subject.
+
+    Every subject uses DEFAULT_SETTINGS unless the JSON file at
+    RETRIEVAL_CONFIG_PATH overrides them, either for all subjects under
+    "default" or per subject under "subjects", e.g.
+    {"default": {"similarity_top_k": 4}, "subjects": {"gene_editing": {"min_score": 0.3}}}.
+    """
+
+    def __init__(self, path: Optional[Path] = None, overrides: Optional[dict] = None):
+        self.path = path or os.getenv("RETRIEVAL_CONFIG_PATH")
+        config = overrides if overrides is not None else self._load()
+        self.default = {**DEFAULT_SETTINGS, **config.get("default", {})}
+        self.subjects: Dict[str, dict] = {
+            subject.lower(): {**self.default, **settings} for subject, settings in config.get("subjects", {}).items()
+        }
+
+    def _load(self) -> dict:
+        if not self.path:
+            return {}
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError) as e:
+            logger.warning("Ignoring retrieval config %s: %s", self.path, e)
+            return {}
+
+    def settings(self, subject: Optional[str]) -> dict:
+        return self.subjects.get((subject or "").lower(), self.default)
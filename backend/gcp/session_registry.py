@@ -0,0 +1,132 @@
+import logging
+import time
+import asyncio
+import threading
+from collections import OrderedDict
+from typing import AsyncIterator, Callable, Iterator, List, Optional, Tuple
+from gcp.gcpchatbotintegrated import RAGChatbot, ConversationState
+
+logger = logging.getLogger(__name__)
+
+
+class _SessionEntry:
+    def __init__(self, state: ConversationState):
+        self.state = state
+        self.lock = threading.Lock()
+        # Used instead of ``lock`` by the async request path
+        self.async_lock = asyncio.Lock()
+        self.last_used = time.monotonic()
+
+
+class SessionRegistry:
+    """Live conversations keyed by (user, chat_id) with LRU/TTL eviction.
+
+    The registry holds at most ``max_sessions`` conversations and roughly
+    ``max_chars`` characters of chat history. Evicted conversations are
+    rebuilt lazily from stored history through ``history_loader``.
+    """
+
+    def __init__(self, chatbot: RAGChatbot,
+                 history_loader: Optional[Callable[[str, str], List[str]]] = None,
+                 max_sessions: int = 256,
+                 ttl: float = 1800.0,
+                 max_chars: int = 8_000_000):
+        self.chatbot = chatbot
+        self.history_loader = history_loader
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.max_chars = max_chars
+
+        self._lock = threading.Lock()
+        self._sessions: "OrderedDict[Tuple[str, str], _SessionEntry]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def _get_entry(self, user: str, chat_id: str) -> _SessionEntry:
+        key = (user, chat_id)
+        with self._lock:
+            entry = self._sessions.get(key)
+            if entry is not None:
+                self._sessions.move_to_end(key)
+                entry.last_used = time.monotonic()
+                return entry
+
+        # Rebuild outside the registry lock, restoring history may call the model
+        state = ConversationState()
+        if self.history_loader is not None:
+            try:
+                messages = self.history_loader(user, chat_id)
+                if messages:
+                    logger.info("Restoring chat %s for %s from %d stored messages", chat_id, user, len(messages))
+                    state = self.chatbot.restore_conversation(messages)
+            except Exception as e:
+                logger.error("Error restoring chat %s for %s: %s", chat_id, user, e)
+
+        with self._lock:
+            # Another request may have created the same session in the meantime
+            entry = self._sessions.get(key)
+            if entry is None:
+                entry = _SessionEntry(state)
+                self._sessions[key] = entry
+            self._sessions.move_to_end(key)
+            entry.last_used = time.monotonic()
+            self._evict()
+            return entry
+
+    def _evict(self):
+        """Drop expired sessions, then least recently used ones until under the caps"""
+        now = time.monotonic()
+        for key in [k for k, e in self._sessions.items() if now - e.last_used > self.ttl]:
+            del self._sessions[key]
+
+        total_chars = sum(e.state.size for e in self._sessions.values())
+        while self._sessions and (len(self._sessions) > self.max_sessions or total_chars > self.max_chars):
+            if len(self._sessions) == 1:
+                break
+            _, entry = self._sessions.popitem(last=False)
+            total_chars -= entry.state.size
+
+    def send_message(self, user: str, chat_id: str, message: str, stream: bool = True) -> str:
+        entry = self._get_entry(user, chat_id)
+        # Messages within one conversation are handled in order
+        with entry.lock:
+            response = self.chatbot.get_response(message, stream=stream, state=entry.state)
+        with self._lock:
+            self._evict()
+        return response
+
+    def stream_message(self, user: str, chat_id: str, message: str) -> Iterator[str]:
+        """Yield response chunks; the conversation's citations are available once exhausted"""
+        entry = self._get_entry(user, chat_id)
+        with entry.lock:
+            yield from self.chatbot.stream_response(message, state=entry.state)
+        with self._lock:
+            self._evict()
+
+    async def send_message_async(self, user: str, chat_id: str, message: str) -> str:
+        # Restoring an evicted conversation may block, so it runs in a worker thread
+        entry = await asyncio.to_thread(self._get_entry, user, chat_id)
+        async with entry.async_lock:
+            response = await self.chatbot.get_response_async(message, state=entry.state)
+        with self._lock:
+            self._evict()
+        return response
+
+    async def stream_message_async(self, user: str, chat_id: str, message: str) -> AsyncIterator[str]:
+        entry = await asyncio.to_thread(self._get_entry, user, chat_id)
+        async with entry.async_lock:
+            async for text in self.chatbot.stream_response_async(message, state=entry.state):
+                yield text
+        with self._lock:
+            self._evict()
+
+    async def get_state_async(self, user: str, chat_id: str) -> ConversationState:
+        return (await asyncio.to_thread(self._get_entry, user, chat_id)).state
+
+    def get_state(self, user: str, chat_id: str) -> ConversationState:
+        return self._get_entry(user, chat_id).state
+
+    def discard(self, user: str, chat_id: str):
+        with self._lock:
+            self._sessions.pop((user, chat_id), None)
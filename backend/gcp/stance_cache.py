@@ -0,0 +1,98 @@
+import logging
+import re
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple
+from shared_store import SqliteStore
+from observability import STANCE_CACHE_LOOKUPS
+
+logger = logging.getLogger(__name__)
+
+# Returned by analyze_stance when the model call fails; never cached
+FALLBACK_RESULT = ("neutral", "general")
+
+PUNCTUATION_PATTERN = re.compile(r"[^\w\s']")
+WHITESPACE_PATTERN = re.compile(r"\s+")
+
+
+def normalize(text: str) -> str:
+    """Lowercase, drop punctuation and collapse whitespace so trivial variants share a key"""
+    text = PUNCTUATION_PATTERN.sub(" ", text.lower())
+    return WHITESPACE_PATTERN.sub(" ", text).strip()
+
+
+class StanceCache:
+    """Bounded LRU cache of (stance, subject) results keyed by normalized input.
+
+    When a ``shared_store`` is given, results are also written there so other
+    workers on the same host can reuse them.
+    """
+
+    def __init__(self, max_entries: int = 4096, shared_store: Optional[SqliteStore] = None,
+                 shared_ttl: float = 7 * 24 * 3600):
+        self.max_entries = max_entries
+        self.shared_store = shared_store
+        self.shared_ttl = shared_ttl
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, Tuple[str, str]]" = OrderedDict()
+
+    def get(self, text: str) -> Optional[Tuple[str, str]]:
+        key = normalize(text)
+        with self._lock:
+            result = self._entries.get(key)
+            if result is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+        if result is not None:
+            STANCE_CACHE_LOOKUPS.labels("hit").inc()
+            return result
+
+        if self.shared_store is not None:
+            try:
+                shared = self.shared_store.get(f"stance:{key}")
+            except Exception as e:
+                logger.warning("Stance cache store unavailable: %s", e)
+                shared = None
+            if shared is not None:
+                result = tuple(shared)
+                self._remember(key, result)
+                with self._lock:
+                    self.shared_hits += 1
+                STANCE_CACHE_LOOKUPS.labels("shared_hit").inc()
+                return result
+
+        with self._lock:
+            self.misses += 1
+        STANCE_CACHE_LOOKUPS.labels("miss").inc()
+        return None
+
+    def put(self, text: str, result: Tuple[str, str]):
+        if tuple(result) == FALLBACK_RESULT:
+            return
+        key = normalize(text)
+        self._remember(key, tuple(result))
+        if self.shared_store is not None:
+            try:
+                self.shared_store.set(f"stance:{key}", list(result), ttl=self.shared_ttl)
+            except Exception as e:
+                logger.warning("Stance cache store unavailable: %s", e)
+
+    def _remember(self, key: str, result: Tuple[str, str]):
+        with self._lock:
+            self._entries[key] = result
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "shared_hits": self.shared_hits,
+                "misses": self.misses,
+                "size": len(self._entries),
+            }
@@ -0,0 +1,148 @@
+import re
+from typing import Dict, List, Optional, Tuple
+
+SUBJECT_KEYWORDS: Dict[str, List[str]] = {
+    "abortion": [
+        r"abortions?", r"pro[- ]life", r"pro[- ]choice", r"roe v\.? wade", r"unborn",
+        r"fetus(es)?", r"foetus", r"terminat(e|ing|ion of) (a )?pregnanc(y|ies)",
+        r"planned parenthood", r"reproductive rights?",
+    ],
+    "gun_laws": [
+        r"guns?", r"firearms?", r"rifles?", r"handguns?", r"ar-?15s?", r"second amendment",
+        r"2nd amendment", r"nra", r"mass shootings?", r"gun control", r"assault weapons?",
+    ],
+    "immigration": [
+        r"immigra(nts?|tion)", r"(im)?migrants?", r"borders?", r"refugees?", r"asylum",
+        r"deport(ation|ations|ed|ing)?", r"undocumented", r"illegal aliens?",
+    ],
+    "artificial_intelligence_regulation": [
+        r"ai", r"a\.i\.?", r"artificial intelligence", r"machine learning", r"chat ?gpt",
+        r"llms?", r"large language models?", r"ai regulation",
+    ],
+    "universal_basic_income": [
+        r"ubi", r"basic income", r"universal income", r"guaranteed income",
+        r"cash transfers?", r"free money",
+    ],
+    "universal_healthcare": [
+        r"health ?care", r"medicare( for all)?", r"single[- ]payer", r"universal coverage",
+        r"health insurance", r"medicaid", r"public health system",
+    ],
+    "gene_editing": [
+        r"gene editing", r"crispr", r"genome( editing)?", r"gene therapy", r"designer bab(y|ies)",
+        r"germline", r"genetic(ally)? (engineering|modification|modified|engineered)",
+        r"edit(ing)? (human )?(genes|embryos)",
+    ],
+}
+
+# Subjects that are themselves restrictions: calling for a ban means being "for" them, and
+# calling the regulated thing harmful does too
+REGULATION_SUBJECTS = {"gun_laws", "artificial_intelligence_regulation"}
+
+SUPPORT_CUES = [
+    r"support", r"in favou?r of", r"should be (legal|allowed|permitted|available|free|expanded)",
+    r"(is|are) (a )?(human )?right", r"(is|are) (good|great|beneficial|necessary|essential|important|needed)",
+    r"benefits?", r"pro[- ]choice", r"we need( more)?", r"should (have|get|receive|provide|implement|adopt)",
+    r"(helps?|saves?|improves?)", r"agree with",
+]
+OPPOSE_CUES = [
+    r"oppose", r"against", r"(is|are) (wrong|bad|evil|harmful|dangerous|immoral|unethical|a mistake|useless|pointless)",
+    r"harms?", r"pro[- ]life", r"abolish(ed)?", r"get rid of",
+    r"(is|are) (too )?(expensive|costly)", r"waste of", r"(destroys?|ruins?|stifles?|hurts?|kills?)",
+    r"disagree with",
+]
+RESTRICT_CUES = [
+    r"ban(ned|ning|s)?", r"(should be|made) illegal", r"outlaw(ed|ing|s)?", r"restrict(s|ed|ing|ions?)?\b",
+    r"regulat(e|es|ed|ing|ion|ions)\b", r"strict(er)?\b", r"tighter", r"limit(s|ed|ing)?\b", r"crack down",
+    r"deport(s|ed|ing|ations?)?\b", r"build (a|the) wall", r"close (the )?borders?",
+    r"cut(s|ting)?\b", r"defund(ed|ing)?\b",
+]
+# Wording showing that a text about a regulation subject is talking about the rules themselves
+# rather than the regulated thing (guns, AI)
+REGULATION_TERMS = re.compile(r"\b(laws?|control|regulations?|restrictions?|legislation|background checks?|rules)\b")
+# Any of these (or a word ending in n't) in the same clause as a stance cue makes the clause
+# ambiguous: "I don't think guns should be banned", "banning guns will not reduce crime"
+NEGATIONS = {
+    "not", "no", "never", "nobody", "none", "nothing", "neither", "nor", "nowhere", "cannot",
+    "dont", "doesnt", "isnt", "arent", "wont", "cant", "shouldnt", "without", "hardly", "barely",
+}
+CLAUSE_BREAKS = re.compile(r"[,;:!?]|\.(?=\s|$)|\b(but|although|though|however|whereas|while|because|yet)\b")
+
+WORD_PATTERN = re.compile(r"[a-z0-9'.-]+")
+
+
+class StanceClassifier:
+    """Keyword classifier for the user's stance and subject.
+
+    Returns a result only when one subject clearly dominates and every stance
+    cue points the same way; anything ambiguous, including a cue in a negated
+    clause or a judgement about a restriction ("banning guns is wrong"), returns
+    None so the caller can fall back to the language model.
+    """
+
+    def __init__(self, min_subject_margin: int = 1, min_cues: int = 1):
+        self.min_subject_margin = min_subject_margin
+        self.min_cues = min_cues
+        self.subject_patterns = {
+            subject: re.compile(r"\b(" + "|".join(patterns) + r")\b")
+            for subject, patterns in SUBJECT_KEYWORDS.items()
+        }
+        self.cue_patterns = [
+            (re.compile(r"\b(" + "|".join(cues) + r")"), kind)
+            for cues, kind in ((SUPPORT_CUES, "support"), (OPPOSE_CUES, "oppose"), (RESTRICT_CUES, "restrict"))
+        ]
+
+    def classify_subject(self, text: str) -> Optional[str]:
+        scores = sorted(
+            ((len(pattern.findall(text)), subject) for subject, pattern in self.subject_patterns.items()),
+            reverse=True,
+        )
+        (best, subject), (runner_up, _) = scores[0], scores[1]
+        if best == 0 or best - runner_up < self.min_subject_margin:
+            return None
+        return subject
+
+    @staticmethod
+    def _negated(text: str, position: int) -> bool:
+        """Whether the clause around ``position`` contains a negation, before or after it"""
+        breaks = [match.end() for match in CLAUSE_BREAKS.finditer(text, 0, position)]
+        start = breaks[-1] if breaks else 0
+        end = CLAUSE_BREAKS.search(text, position)
+        clause = text[start:end.start() if end else len(text)]
+        return any(word in NEGATIONS or word.endswith("n't") for word in WORD_PATTERN.findall(clause))
+
+    def classify_stance(self, text: str, subject: str) -> Optional[str]:
+        """Return the user's own stance on the subject ('for' or 'against')"""
+        # For regulation subjects, opinions about the regulated thing count inversely
+        about_thing = subject in REGULATION_SUBJECTS and not REGULATION_TERMS.search(text)
+        values = []
+        kinds = set()
+        for pattern, kind in self.cue_patterns:
+            for match in pattern.finditer(text):
+                kinds.add(kind)
+                if kind == "restrict":
+                    value = 1 if subject in REGULATION_SUBJECTS else -1
+                else:
+                    value = 1 if kind == "support" else -1
+                    if about_thing:
+                        value = -value
+                if self._negated(text, match.start()):
+                    return None
+                values.append(value)
+        # A judgement next to a restriction may be about the restriction or the restricted thing;
+        # keywords can't tell which, so leave it to the language model
+        if "restrict" in kinds and kinds & {"support", "oppose"}:
+            return None
+        if len(values) < self.min_cues or len(set(values)) > 1:
+            return None
+        return "for" if values[0] > 0 else "against"
+
+    def classify(self, text: str) -> Optional[Tuple[str, str]]:
+        """Return the user's (stance, subject), or None when the input is ambiguous"""
+        text = text.lower().replace("\u2019", "'")
+        subject = self.classify_subject(text)
+        if subject is None:
+            return None
+        stance = self.classify_stance(text, subject)
+        if stance is None:
+            return None
+        return stance, subject
@@ -0,0 +1,134 @@
+import os
+import re
+import time
+import logging
+import threading
+from typing import Dict, Optional
+import requests
+from google.auth import jwt
+
+GOOGLE_CERTS_URL = "https://www.googleapis.com/oauth2/v1/certs"
+GOOGLE_ISSUERS = ("accounts.google.com", "https://accounts.google.com")
+
+MAX_AGE_PATTERN = re.compile(r"max-age=(\d+)")
+
+logger = logging.getLogger(__name__)
+
+
+class CertificatesUnavailable(Exception):
+    """Google's signing certificates could not be fetched, so no token can be verified"""
+
+
+class GoogleCertCache:
+    """Google's ID token signing certificates, cached locally.
+
+    Certificates are kept for as long as the response's Cache-Control
+    max-age allows and refreshed in the background shortly before they
+    expire, so token verification normally needs no network access.
+    """
+
+    def __init__(self, certs_url: Optional[str] = None, refresh_margin: float = 300.0,
+                 default_max_age: float = 3600.0, min_refetch_interval: float = 30.0,
+                 timeout: float = 5.0):
+        self.certs_url = certs_url or os.getenv("GOOGLE_CERTS_URL", GOOGLE_CERTS_URL)
+        self.refresh_margin = refresh_margin
+        self.default_max_age = default_max_age
+        self.min_refetch_interval = min_refetch_interval
+        self.timeout = timeout
+
+        self._lock = threading.Lock()
+        self._refreshing = False
+        self._certs: Dict[str, str] = {}
+        self._expires_at = 0.0
+        self._fetched_at = 0.0
+
+    def _max_age(self, response: requests.Response) -> float:
+        match = MAX_AGE_PATTERN.search(response.headers.get("Cache-Control", ""))
+        max_age = float(match.group(1)) if match else self.default_max_age
+        # The response may already have spent part of its lifetime in a shared cache
+        age = float(response.headers.get("Age", "0") or 0)
+        return max(max_age - age, 0.0)
+
+    def refresh(self) -> Dict[str, str]:
+        try:
+            response = requests.get(self.certs_url, timeout=self.timeout)
+            response.raise_for_status()
+            certs = response.json()
+        except (requests.RequestException, ValueError) as e:
+            raise CertificatesUnavailable(f"Could not fetch Google certificates: {e}") from e
+        now = time.time()
+        with self._lock:
+            self._certs = certs
+            self._fetched_at = now
+            self._expires_at = now + self._max_age(response)
+        return certs
+
+    def _refresh_in_background(self):
+        try:
+            self.refresh()
+        except CertificatesUnavailable as e:
+            # The cached certificates are still valid; the next request retries
+            logger.warning("%s", e)
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+    def certs(self) -> Dict[str, str]:
+        now = time.time()
+        with self._lock:
+            certs, expires_at = self._certs, self._expires_at
+            start_background = (
+                certs and expires_at - now < self.refresh_margin and not self._refreshing and now < expires_at
+            )
+            if start_background:
+                self._refreshing = True
+
+        if not certs or now >= expires_at:
+            return self.refresh()
+        if start_background:
+            threading.Thread(target=self._refresh_in_background, daemon=True).start()
+        return certs
+
+    def refetch_for_unknown_key(self) -> bool:
+        """Refresh early after seeing an unknown key id (key rotation), at most once per interval"""
+        with self._lock:
+            if time.time() - self._fetched_at < self.min_refetch_interval:
+                return False
+        self.refresh()
+        return True
+
+
+class GoogleTokenVerifier:
+    """Verifies Google ID tokens offline against a GoogleCertCache"""
+
+    def __init__(self, client_id: str, cert_cache: Optional[GoogleCertCache] = None,
+                 clock_skew: int = 10):
+        self.client_id = client_id
+        self.cert_cache = cert_cache or GoogleCertCache()
+        self.clock_skew = clock_skew
+
+    def _decode(self, token: str) -> dict:
+        return jwt.decode(
+            token,
+            certs=self.cert_cache.certs(),
+            audience=self.client_id,
+            clock_skew_in_seconds=self.clock_skew,
+        )
+
+    def verify(self, token: str) -> dict:
+        """Return the token's claims; raises ValueError if it is invalid.
+
+        Raises CertificatesUnavailable if the certificates are missing or
+        expired and cannot be fetched.
+        """
+        try:
+            idinfo = self._decode(token)
+        except ValueError as e:
+            if "Certificate for key id" in str(e) and self.cert_cache.refetch_for_unknown_key():
+                idinfo = self._decode(token)
+            else:
+                raise
+
+        if idinfo.get("iss") not in GOOGLE_ISSUERS:
+            raise ValueError(f"Wrong issuer: {idinfo.get('iss')}")
+        return idinfo
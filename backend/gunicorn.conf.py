@@ -0,0 +1,46 @@
+"""Gunicorn settings, read automatically when gunicorn starts from backend/ (see Procfile).
+
+The app is imported and warmed up once in the master, then workers are
+forked from it and share that read-only state copy-on-write: the corpus
+registry, configured models and retrieval tools, the stance classifier
+and the memory-mapped local index. Anything tied to a process (Mongo and
+Vertex AI connections, SQLite handles, thread pools, the write-behind
+flusher, the log listener) is created lazily per process, so each worker
+builds its own after the fork. Set GUNICORN_PRELOAD=0 to import the app in
+every worker instead.
+"""
+import gc
+import os
+import shutil
+import tempfile
+
+preload_app = os.getenv("GUNICORN_PRELOAD", "1") == "1"
+
+# Metrics files from a previous run would be summed into this one. This runs before the app
+# is imported, which creates the master's own files
+_multiproc_dir = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+if _multiproc_dir:
+    shutil.rmtree(_multiproc_dir, ignore_errors=True)
+    os.makedirs(_multiproc_dir, exist_ok=True)
+
+
+def on_starting(server):
+    # Workers without sticky routing must share the chat cache, or each serves its own stale copy
+    if server.cfg.workers > 1 and not os.getenv("CHAT_CACHE_PATH"):
+        os.environ["CHAT_CACHE_PATH"] = os.path.join(tempfile.gettempdir(), f"chat-cache-{os.getpid()}.sqlite3")
+
+
+def when_ready(server):
+    if not preload_app:
+        return
+    from app import services
+    services.warm_up()
+    # Move everything built so far out of the collector's reach; otherwise the first collection
+    # in each worker writes to every shared object and copies its pages
+    gc.freeze()
+
+
+def child_exit(server, worker):
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,122 @@
+import os
+import logging
+import threading
+from typing import Dict, List, Optional, Tuple
+import certifi
+import pymongo
+
+IndexKeys = List[Tuple[str, int]]
+
+logger = logging.getLogger(__name__)
+
+# Index options compared against the existing spec; anything else (v, ns, ...) is server bookkeeping
+COMPARED_OPTIONS = ("unique", "sparse", "partialFilterExpression", "expireAfterSeconds")
+
+
+def default_index_name(keys: IndexKeys) -> str:
+    """The name MongoDB gives an index when none is specified, e.g. username_1"""
+    return "_".join(f"{field}_{direction}" for field, direction in keys)
+
+
+def client_options_from_env() -> dict:
+    return {
+        "maxPoolSize": int(os.getenv("MONGODB_MAX_POOL_SIZE", "50")),
+        "minPoolSize": int(os.getenv("MONGODB_MIN_POOL_SIZE", "0")),
+        "maxIdleTimeMS": int(os.getenv("MONGODB_MAX_IDLE_TIME_MS", "300000")),
+        "serverSelectionTimeoutMS": int(os.getenv("MONGODB_SERVER_SELECTION_TIMEOUT_MS", "5000")),
+        "connectTimeoutMS": int(os.getenv("MONGODB_CONNECT_TIMEOUT_MS", "5000")),
+        "socketTimeoutMS": int(os.getenv("MONGODB_SOCKET_TIMEOUT_MS", "20000")),
+    }
+
+
+class MongoClientManager:
+    """Owns the MongoClient for one database and creates it on first use.
+
+    Nothing touches the network until a collection is used, so building the
+    manager (e.g. at import time in the gunicorn master) is cheap. A client
+    created before a fork is never reused in the child: each process gets its
+    own client and connection pool.
+    """
+
+    def __init__(self, connection_string: str, db_name: str, **client_options):
+        self.connection_string = connection_string
+        self.db_name = db_name
+        self.client_options = {"tlsCAFile": certifi.where(), **client_options_from_env(), **client_options}
+
+        self._lock = threading.Lock()
+        self._client: Optional[pymongo.MongoClient] = None
+        self._pid: Optional[int] = None
+        self._indexes: Dict[str, List[Tuple[IndexKeys, dict]]] = {}
+        self._indexes_ensured = False
+
+    @property
+    def client(self) -> pymongo.MongoClient:
+        if self._client is None or self._pid != os.getpid():
+            with self._lock:
+                if self._client is None or self._pid != os.getpid():
+                    # connect=False: the pool is only opened by the first operation
+                    self._client = pymongo.MongoClient(self.connection_string, connect=False, **self.client_options)
+                    self._pid = os.getpid()
+        return self._client
+
+    @property
+    def db(self):
+        return self.client[self.db_name]
+
+    def collection(self, name: str):
+        if self._indexes and not self._indexes_ensured:
+            self.ensure_indexes()
+        return self.db[name]
+
+    def register_index(self, collection: str, keys: IndexKeys, **options):
+        """Declare an index; it is created on first use if missing"""
+        self._indexes.setdefault(collection, []).append((keys, options))
+
+    def ensure_index(self, collection: str, keys: IndexKeys, **options) -> bool:
+        """Create the index unless an equivalent one already exists; returns True if it was created.
+
+        An existing index with the same name but a different spec is left
+        alone (dropping it would rebuild under live traffic) and reported.
+        """
+        name = options.get("name") or default_index_name(keys)
+        existing = self.db[collection].index_information().get(name)
+        if existing is not None:
+            existing_keys = [(field, int(direction)) for field, direction in existing["key"]]
+            wanted = {option: options.get(option) for option in COMPARED_OPTIONS}
+            found = {option: existing.get(option) for option in COMPARED_OPTIONS}
+            if existing_keys != list(keys) or wanted != found:
+                logger.warning("Index %s.%s differs from the declared spec; leaving it unchanged", collection, name)
+            return False
+
+        self.db[collection].create_index(keys, name=name, **options)
+        logger.info("Created index %s.%s", collection, name)
+        return True
+
+    def ensure_indexes(self):
+        with self._lock:
+            if self._indexes_ensured:
+                return
+            self._indexes_ensured = True
+        try:
+            for collection, indexes in self._indexes.items():
+                for keys, options in indexes:
+                    self.ensure_index(collection, keys, **options)
+        except pymongo.errors.PyMongoError as e:
+            # Try again on the next use rather than failing the request
+            logger.warning("Could not ensure indexes: %s", e)
+            with self._lock:
+                self._indexes_ensured = False
+
+    def ping(self) -> bool:
+        try:
+            self.client.admin.command("ping")
+            return True
+        except pymongo.errors.PyMongoError:
+            return False
+
+    def close(self):
+        with self._lock:
+            if self._client is not None and self._pid == os.getpid():
+                self._client.close()
+            self._client = None
+            self._pid = None
@@ -1,15 +1,17 @@
 import pymongo
-import bcrypt
 from typing import Optional, List, Dict
-from google.oauth2 import id_token
-from google.auth.transport import requests
-from google_auth_oauthlib.flow import InstalledAppFlow
 from pathlib import Path
 from dotenv import load_dotenv
 import os
+import logging
 import datetime
-import certifi
 from bson.objectid import ObjectId
+from password_hashing import PasswordHashingPool, HashingOverloaded
+from google_token_verifier import GoogleTokenVerifier
+from mongo_client import MongoClientManager
+from write_behind import WriteBehindBuffer
+from chat_cache import ChatCache, chat_title
+from shared_store import SqliteStore
 
 # Load environment variables from .env file
 env_path = Path(__file__).parent.parent / '.env'
@@ -21,59 +23,87 @@ MONGODB_DB_NAME = os.getenv('MONGODB_DB_NAME')
 GOOGLE_AUTH_CLIENT_ID = os.getenv('GOOGLE_AUTH_CLIENT_ID')
 GOOGLE_AUTH_CLIENT_SECRET = os.getenv('GOOGLE_AUTH_CLIENT_SECRET')
 
+logger = logging.getLogger(__name__)
+
 class MongoDBInterface:
     def __init__(self):
         if not MONGODB_CONNECTION_STRING or not MONGODB_DB_NAME:
             raise ValueError("MongoDB connection string and database name must be set in .env file")
             
-        # Use certifi for SSL certificate verification
-        self.client = pymongo.MongoClient(
-            MONGODB_CONNECTION_STRING,
-            tlsCAFile=certifi.where(),
-            serverSelectionTimeoutMS=30000
-        )
+        # Connects lazily, once per process, so importing this module is cheap in every worker
+        self.mongo = MongoClientManager(MONGODB_CONNECTION_STRING, MONGODB_DB_NAME)
         
-        # Test the connection
-        try:
-            self.client.server_info()
-        except pymongo.errors.ServerSelectionTimeoutError as err:
-            raise ConnectionError(f"Failed to connect to MongoDB: {err}")
-            
-        self.db = self.client[MONGODB_DB_NAME]
+        # Password hashing runs on its own bounded pool, off the request threads
+        self.password_pool = PasswordHashingPool()
         
-        # Set up collections
-        self.login_info = self.db.login_info
-        self.chat_history = self.db.chat_history
+        # Verifies Google ID tokens against locally cached signing certificates
+        self.token_verifier = GoogleTokenVerifier(GOOGLE_AUTH_CLIENT_ID)
         
-        # Drop existing indexes if they exist
-        try:
-            self.login_info.drop_index("username_1")
-            self.chat_history.drop_index("email_1")
-        except:
-            pass
-            
-        # Create indexes with partial filter expressions to exclude null values
-        self.login_info.create_index(
+        # Chat messages are appended in batches off the reply path; reads of a chat flush it first
+        self.message_writes = WriteBehindBuffer(self._write_messages)
+        
+        # Chat summaries and recent messages, kept up to date by the write methods below
+        chat_cache_path = os.getenv('CHAT_CACHE_PATH')
+        self.chat_cache = ChatCache(SqliteStore(chat_cache_path, table="chat_cache") if chat_cache_path else None)
+        
+        # Indexes are created on first use only if missing; existing ones are never dropped.
+        # Partial filter expressions exclude null values.
+        self.mongo.register_index(
+            "login_info",
             [("username", pymongo.ASCENDING)],
             unique=True,
             partialFilterExpression={"username": {"$type": "string"}}
         )
-        self.chat_history.create_index(
+        self.mongo.register_index(
+            "chat_history",
             [("email", pymongo.ASCENDING)],
             unique=True,
             partialFilterExpression={"email": {"$type": "string"}}
         )
+        self.mongo.register_index(
+            "chat_messages",
+            [("email", pymongo.ASCENDING), ("chat_id", pymongo.ASCENDING), ("seq", pymongo.ASCENDING)],
+            unique=True
+        )
+        self.mongo.register_index(
+            "chats",
+            [("email", pymongo.ASCENDING), ("chat_id", pymongo.ASCENDING)],
+            unique=True
+        )
+
+    @property
+    def db(self):
+        return self.mongo.db
+
+    @property
+    def login_info(self):
+        return self.mongo.collection("login_info")
+
+    @property
+    def chat_history(self):
+        # Legacy layout: one document per user with every chat embedded (see migrate_chat_history)
+        return self.mongo.collection("chat_history")
+
+    @property
+    def chat_messages(self):
+        # One document per message
+        return self.mongo.collection("chat_messages")
+
+    @property
+    def chats(self):
+        # One summary document per chat
+        return self.mongo.collection("chats")
 
     def create_user(self, username: str, password: str) -> bool:
         if not username or not isinstance(username, str):
-            print("Username must be a non-empty string.")
+            logger.info("Rejected user creation: empty username")
             return False
             
         if self.login_info.find_one({"username": username}):
-            print("Username already exists.")
+            logger.info("Rejected user creation: username already exists")
             return False
         
-        hashed_password = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
+        hashed_password = self.password_pool.hash_password(password)
         
         # Create user in login_info
         self.login_info.insert_one({
@@ -82,98 +112,279 @@ class MongoDBInterface:
             "loginTime": datetime.datetime.now()
         })
         
-        # Initialize empty chat history for the user
-        self.chat_history.insert_one({
-            "email": username,
-            "chats": {}  # Empty dict to store chat_id -> messages mapping
-        })
-        
-        print("User created successfully.")
+        logger.info("Created user")
         return True
 
     def verify_user(self, username: str, password: str) -> bool:
         user = self.login_info.find_one({"username": username})
-        if user and bcrypt.checkpw(password.encode('utf-8'), user['password']):
-            print("Login successful.")
+        if user and 'password' in user and self.password_pool.check_password(password, user['password']):
+            # Upgrade hashes made with a weaker scheme or outdated cost parameters
+            if self.password_pool.needs_rehash(user['password']):
+                try:
+                    new_hash = self.password_pool.hash_password(password)
+                except HashingOverloaded:
+                    # The password is correct; upgrade on a later login rather than fail this one
+                    logger.info("Skipped password hash upgrade: hashing pool overloaded")
+                else:
+                    self.login_info.update_one({"_id": user["_id"]}, {"$set": {"password": new_hash}})
+                    logger.info("Upgraded password hash")
+            logger.debug("Login successful")
             return True
-        print("Invalid username or password.")
+        logger.info("Login failed: invalid username or password")
         return False
 
     def change_password(self, username: str, new_password: str) -> bool:
         user = self.login_info.find_one({"username": username})
         if user:
-            hashed_password = bcrypt.hashpw(new_password.encode('utf-8'), bcrypt.gensalt())
+            hashed_password = self.password_pool.hash_password(new_password)
             self.login_info.update_one({"username": username}, {"$set": {"password": hashed_password}})
-            print("Password updated successfully.")
+            logger.info("Password updated")
             return True
-        print("User not found.")
+        logger.info("Password change failed: user not found")
         return False
 
     def create_new_chat(self, email: str, chat_id: str) -> bool:
         """
         Create a new chat for a user with empty message list.
         """
-        result = self.chat_history.update_one(
-            {"email": email},
-            {"$set": {f"chats.{chat_id}": []}}
+        now = datetime.datetime.now()
+        result = self.chats.update_one(
+            {"email": email, "chat_id": chat_id},
+            {"$setOnInsert": {"count": 0, "created_at": now, "updated_at": now}},
+            upsert=True
         )
-        return result.modified_count > 0
+        if result.upserted_id is None:
+            return False
+        self.chat_cache.chat_created(email, chat_id, now)
+        return True
 
     def add_message_to_chat(self, email: str, chat_id: str, message: str) -> bool:
         """
-        Add a message to a specific chat.
+        Queue a message for a specific chat, creating the chat if needed.
         """
-        result = self.chat_history.update_one(
-            {"email": email},
-            {"$push": {f"chats.{chat_id}": message}}
-        )
-        return result.modified_count > 0
+        now = datetime.datetime.now()
+        # The sequence number is assigned on the first write attempt and kept on the item
+        self.message_writes.add((email, chat_id), {"message": message, "created_at": now, "seq": None})
+        self.chat_cache.message_added(email, chat_id, message, now)
+        return True
+
+    def _write_messages(self, batches: Dict) -> None:
+        """
+        Write queued messages: one sequence reservation per chat, one bulk upsert for all of them.
+        A retried batch keeps the sequence numbers reserved by the failed attempt, and messages
+        that attempt already inserted are matched by them instead of inserted twice.
+        """
+        operations = []
+        for (email, chat_id), messages in batches.items():
+            unassigned = [message for message in messages if message["seq"] is None]
+            if unassigned:
+                # Reserve a block of sequence numbers for this chat
+                chat = self.chats.find_one_and_update(
+                    {"email": email, "chat_id": chat_id},
+                    {
+                        "$inc": {"count": len(unassigned)},
+                        "$set": {"updated_at": messages[-1]["created_at"], "last_message": messages[-1]["message"]},
+                        "$setOnInsert": {"created_at": messages[0]["created_at"]}
+                    },
+                    projection={"count": 1, "_id": 0},
+                    upsert=True,
+                    return_document=pymongo.ReturnDocument.AFTER
+                )
+                first_seq = chat["count"] - len(unassigned)
+                for offset, message in enumerate(unassigned):
+                    message["seq"] = first_seq + offset
+            if messages[0]["seq"] == 0:
+                self.chats.update_one(
+                    {"email": email, "chat_id": chat_id, "title": {"$exists": False}},
+                    {"$set": {"title": chat_title(messages[0]["message"])}}
+                )
+            operations.extend(
+                pymongo.UpdateOne(
+                    {"email": email, "chat_id": chat_id, "seq": message["seq"]},
+                    {"$setOnInsert": {"message": message["message"], "created_at": message["created_at"]}},
+                    upsert=True
+                )
+                for message in messages
+            )
+        if operations:
+            self.chat_messages.bulk_write(operations, ordered=False)
 
-    def get_chat_messages(self, email: str, chat_id: str) -> List[str]:
+    def flush_messages(self, email: str = None, chat_id: str = None) -> None:
         """
-        Get all messages from a specific chat.
+        Write queued messages now: for one chat, every chat of one user, or everything.
         """
-        user_chats = self.chat_history.find_one({"email": email})
-        if user_chats and "chats" in user_chats and chat_id in user_chats["chats"]:
-            return user_chats["chats"][chat_id]
-        return []
+        if email is None:
+            self.message_writes.flush()
+        elif chat_id is None:
+            self.message_writes.flush(self.message_writes.keys_for(lambda key: key[0] == email))
+        else:
+            self.message_writes.flush([(email, chat_id)])
+
+    def get_chat_messages(self, email: str, chat_id: str, after: Optional[int] = None,
+                          limit: Optional[int] = None) -> List[str]:
+        """
+        Get messages from a specific chat in order, optionally only those after
+        sequence number ``after`` and at most ``limit`` of them.
+        """
+        cached = self._cached_messages(email, chat_id, after)
+        if cached is not None:
+            messages = [doc["message"] for doc in cached]
+            return messages[:limit] if limit else messages
+        return self.read_chat_messages(email, chat_id, after, limit)
+
+    def read_chat_messages(self, email: str, chat_id: str, after: Optional[int] = None,
+                           limit: Optional[int] = None) -> List[str]:
+        """
+        Like get_chat_messages, but always read from MongoDB. Conversations are
+        restored from this, since another worker's cache may be behind.
+        """
+        self.flush_messages(email, chat_id)
+        query = {"email": email, "chat_id": chat_id}
+        if after is not None:
+            query["seq"] = {"$gt": after}
+        cursor = self.chat_messages.find(query, {"message": 1, "_id": 0}).sort("seq", pymongo.ASCENDING)
+        if limit:
+            cursor = cursor.limit(limit)
+        return [doc["message"] for doc in cursor]
+
+    def get_chat_page(self, email: str, chat_id: str, after: Optional[int] = None, limit: int = 50) -> Dict:
+        """
+        Get one page of messages. Pass the returned ``next`` value as ``after``
+        to fetch the following page; it is None once the chat is exhausted.
+        """
+        cached = self._cached_messages(email, chat_id, after)
+        if cached is not None:
+            return {
+                "messages": cached[:limit],
+                "next": cached[limit - 1]["seq"] if len(cached) > limit else None
+            }
+
+        self.flush_messages(email, chat_id)
+        query = {"email": email, "chat_id": chat_id}
+        if after is not None:
+            query["seq"] = {"$gt": after}
+        cursor = self.chat_messages.find(
+            query, {"seq": 1, "message": 1, "_id": 0}
+        ).sort("seq", pymongo.ASCENDING).limit(limit + 1)
+        messages = list(cursor)
+        has_more = len(messages) > limit
+        messages = messages[:limit]
+        if not has_more and (messages or after is None):
+            # This page reaches the end of the chat, so it is the chat's newest messages
+            count = messages[-1]["seq"] + 1 if messages else 0
+            self.chat_cache.set_recent(email, chat_id, messages, count)
+        return {
+            "messages": messages,
+            "next": messages[-1]["seq"] if has_more else None
+        }
+
+    def _cached_messages(self, email: str, chat_id: str, after: Optional[int]) -> Optional[List[Dict]]:
+        """
+        Messages after ``after`` from the recent-messages cache, or None if it does not cover them.
+        """
+        recent = self.chat_cache.get_recent(email, chat_id)
+        start = 0 if after is None else after + 1
+        if recent is None or start < recent["start"]:
+            return None
+        return [doc for doc in recent["messages"] if doc["seq"] >= start]
+
+    def list_chats(self, email: str) -> List[Dict]:
+        """
+        Get the id, title, last message, message count and timestamps of every
+        chat, most recent first.
+        """
+        cached = self.chat_cache.get_chats(email)
+        if cached is not None:
+            return cached
+
+        self.flush_messages(email)
+        cursor = self.chats.find(
+            {"email": email},
+            {"chat_id": 1, "title": 1, "last_message": 1, "count": 1, "created_at": 1, "updated_at": 1, "_id": 0}
+        ).sort("updated_at", pymongo.DESCENDING)
+        chats = list(cursor)
+        self.chat_cache.set_chats(email, chats)
+        return chats
 
     def get_all_chats(self, email: str) -> Dict[str, List[str]]:
         """
-        Get all chats for a user.
+        Get all chats for a user. This reads every message; prefer list_chats
+        and get_chat_page for anything user-facing.
         """
-        user_chats = self.chat_history.find_one({"email": email})
-        if user_chats and "chats" in user_chats:
-            return user_chats["chats"]
-        return {}
+        self.flush_messages(email)
+        chats = {chat["chat_id"]: [] for chat in self.list_chats(email)}
+        cursor = self.chat_messages.find(
+            {"email": email}, {"chat_id": 1, "message": 1, "_id": 0}
+        ).sort([("chat_id", pymongo.ASCENDING), ("seq", pymongo.ASCENDING)])
+        for doc in cursor:
+            chats.setdefault(doc["chat_id"], []).append(doc["message"])
+        return chats
 
     def delete_chat(self, email: str, chat_id: str) -> bool:
         """
         Delete a specific chat.
         """
-        result = self.chat_history.update_one(
-            {"email": email},
-            {"$unset": {f"chats.{chat_id}": ""}}
-        )
-        return result.modified_count > 0
+        self.message_writes.discard([(email, chat_id)])
+        self.chat_cache.chat_deleted(email, chat_id)
+        self.chat_messages.delete_many({"email": email, "chat_id": chat_id})
+        result = self.chats.delete_one({"email": email, "chat_id": chat_id})
+        return result.deleted_count > 0
+
+    def migrate_chat_history(self) -> int:
+        """
+        Copy chats embedded in the legacy chat_history documents into the
+        message collection. Safe to re-run: messages are keyed by their
+        position in the old array. Returns the number of chats migrated.
+        """
+        migrated = 0
+        for user_chats in self.chat_history.find({"chats": {"$exists": True}}):
+            email = user_chats["email"]
+            for chat_id, messages in user_chats.get("chats", {}).items():
+                now = datetime.datetime.now()
+                operations = [
+                    pymongo.UpdateOne(
+                        {"email": email, "chat_id": chat_id, "seq": seq},
+                        {"$setOnInsert": {"message": message, "created_at": now}},
+                        upsert=True
+                    )
+                    for seq, message in enumerate(messages)
+                ]
+                if operations:
+                    self.chat_messages.bulk_write(operations, ordered=False)
+                summary = {"title": chat_title(messages[0]), "last_message": messages[-1]} if messages else {}
+                self.chats.update_one(
+                    {"email": email, "chat_id": chat_id},
+                    {"$max": {"count": len(messages)},
+                     "$setOnInsert": {"created_at": now, "updated_at": now, **summary}},
+                    upsert=True
+                )
+                migrated += 1
+            self.chat_history.update_one({"_id": user_chats["_id"]}, {"$unset": {"chats": ""}})
+        logger.info("Migrated %d chats to the message collection", migrated)
+        return migrated
 
     def delete_user(self, username: str) -> bool:
         """
         Delete a user and all their chat history.
         """
         if not self.login_info.find_one({"username": username}):
-            print("User not found.")
+            logger.info("User deletion failed: user not found")
             return False
             
         # Delete user and their chat history
+        self.message_writes.discard(self.message_writes.keys_for(lambda key: key[0] == username))
+        self.chat_cache.user_deleted(username)
         self.login_info.delete_one({"username": username})
         self.chat_history.delete_one({"email": username})
-        print("User and associated chat history deleted successfully.")
+        self.chat_messages.delete_many({"email": username})
+        self.chats.delete_many({"email": username})
+        logger.info("Deleted user and their chat history")
         return True
 
-    def google_login(self, token: str) -> bool:
+    def google_login(self, token: str) -> Optional[str]:
+        """The verified account's email, or None if the token is invalid"""
         try:
-            idinfo = id_token.verify_oauth2_token(token, requests.Request(), GOOGLE_AUTH_CLIENT_ID)
+            idinfo = self.token_verifier.verify(token)
             if 'email' in idinfo:
                 email = idinfo['email']
                 user = self.login_info.find_one({"username": email})
@@ -183,19 +394,16 @@ class MongoDBInterface:
                         "username": email,
                         "google_id": idinfo['sub']
                     })
-                    # Initialize empty chat history
-                    self.chat_history.insert_one({
-                        "email": email,
-                        "chats": {}
-                    })
-                    print("User created successfully with Google login.")
-                print("Google login successful.")
-                return True
-        except ValueError:
-            print("Invalid token.")
-        return False
+                    logger.info("Created user from Google login")
+                logger.debug("Google login successful")
+                return email
+        except ValueError as e:
+            logger.info("Google login failed: %s", e)
+        return None
 
     def google_auth_flow(self):
+        # Only the interactive CLI flow needs google_auth_oauthlib
+        from google_auth_oauthlib.flow import InstalledAppFlow
         flow = InstalledAppFlow.from_client_config(
             {
                 "web": {
@@ -212,6 +420,17 @@ class MongoDBInterface:
         return credentials.token
 
 if __name__ == "__main__":
+    import sys
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    if len(sys.argv) > 1 and sys.argv[1] == "migrate":
+        # Move chats from the legacy chat_history layout to the message collection
+        MongoDBInterface().migrate_chat_history()
+        sys.exit(0)
+    if len(sys.argv) > 1 and sys.argv[1] == "ensure-indexes":
+        # Create any missing indexes ahead of a deploy instead of on the first request
+        MongoDBInterface().mongo.ensure_indexes()
+        sys.exit(0)
+
     # Example usage
     try:
         mongo_interface = MongoDBInterface()
@@ -0,0 +1,162 @@
+"""Logging, trace ids and Prometheus metrics for the chat pipeline.
+
+Log records go through a QueueHandler, so request threads never block on
+stdout; a QueueListener thread does the writing. Every record carries the
+current request's trace id. Set LOG_FORMAT=json for JSON lines and
+LOG_LEVEL to change the level. When PROMETHEUS_MULTIPROC_DIR is set,
+/metrics aggregates every gunicorn worker.
+"""
+import os
+import sys
+import time
+import uuid
+import queue
+import logging
+import contextvars
+from contextlib import contextmanager
+from logging.handlers import QueueHandler, QueueListener
+from typing import Optional
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess, REGISTRY
+)
+
+trace_id_var: contextvars.ContextVar = contextvars.ContextVar("trace_id", default="-")
+
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8, 15, 30, 60)
+
+STAGE_SECONDS = Histogram(
+    "chat_stage_seconds", "Time spent in each chat pipeline stage", ["stage"], buckets=STAGE_BUCKETS
+)
+STAGE_ERRORS = Counter("chat_stage_errors_total", "Chat pipeline stages that raised", ["stage"])
+TOKENS = Counter("chat_tokens_total", "Model tokens by kind (prompt or response)", ["kind"])
+RESPONSE_CHUNKS = Histogram(
+    "chat_response_chunks", "Streamed chunks per response", buckets=(1, 2, 5, 10, 20, 50, 100, 200)
+)
+STANCE_SOURCE = Counter("chat_stance_source_total", "How the stance was resolved", ["source"])
+REQUESTS = Counter("chat_requests_total", "Chat API requests", ["route", "status"])
+STANCE_CACHE_LOOKUPS = Counter(
+    "chat_stance_cache_lookups_total", "Stance cache lookups by result (hit, shared_hit or miss)", ["result"]
+)
+RESPONSE_CACHE_LOOKUPS = Counter(
+    "chat_response_cache_lookups_total", "Opening response cache lookups by subject and result (hit or miss)",
+    ["subject", "result"]
+)
+MODEL_CALL_EVENTS = Counter(
+    "chat_model_call_events_total", "Model calls and their retries, hedges, timeouts and rejections",
+    ["policy", "event"]
+)
+MODEL_CALLS_IN_FLIGHT = Gauge(
+    "chat_model_calls_in_flight", "Model call attempts running", ["policy"], multiprocess_mode="livesum"
+)
+WRITE_BEHIND_FAILURES = Counter("chat_write_behind_failures_total", "Failed write-behind flushes (retried)")
+WRITE_BEHIND_SPILLED = Counter(
+    "chat_write_behind_spilled_total", "Writes still failing at exit, saved to disk for the next process"
+)
+PASSWORD_HASH_SECONDS = Histogram(
+    "password_hash_seconds", "Time spent computing a password hash or check",
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10)
+)
+PASSWORD_HASH_REJECTED = Counter(
+    "password_hash_rejected_total", "Password hashes refused by an overloaded pool", ["reason"]
+)
+for reason in ("queue_full", "timeout"):
+    PASSWORD_HASH_REJECTED.labels(reason)
+
+_listener: Optional[QueueListener] = None
+
+
+class TraceIdFilter(logging.Filter):
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.trace_id = trace_id_var.get()
+        return True
+
+
+def _formatter() -> logging.Formatter:
+    if os.getenv("LOG_FORMAT", "text").lower() == "json":
+        from pythonjsonlogger.json import JsonFormatter
+        return JsonFormatter("%(asctime)s %(levelname)s %(name)s %(trace_id)s %(message)s")
+    return logging.Formatter("%(asctime)s %(levelname)s [%(trace_id)s] %(name)s: %(message)s")
+
+
+def _start_listener(log_queue: queue.Queue):
+    global _listener
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(_formatter())
+    _listener = QueueListener(log_queue, handler, respect_handler_level=False)
+    _listener.start()
+
+
+def _restart_after_fork(queue_handler: QueueHandler):
+    # The parent's listener thread is gone in the child and may have held the queue's lock
+    # at fork time, so the child starts over with a fresh queue
+    log_queue: queue.Queue = queue.Queue(-1)
+    queue_handler.queue = log_queue
+    _start_listener(log_queue)
+
+
+def setup_logging():
+    """Route all logging through a queue; safe to call more than once"""
+    if _listener is not None:
+        return
+    log_queue: queue.Queue = queue.Queue(-1)
+    queue_handler = QueueHandler(log_queue)
+    # Filter on the handler so the trace id is read on the request's thread
+    queue_handler.addFilter(TraceIdFilter())
+
+    root = logging.getLogger()
+    root.handlers = [queue_handler]
+    root.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+    _start_listener(log_queue)
+
+    # The listener thread does not survive a fork (gunicorn workers); start a fresh one in the child
+    if hasattr(os, "register_at_fork"):
+        os.register_at_fork(after_in_child=lambda: _restart_after_fork(queue_handler))
+
+
+def new_trace(trace_id: Optional[str] = None) -> str:
+    """Start a trace for the current request (thread or task) and return its id"""
+    trace_id = trace_id or uuid.uuid4().hex[:16]
+    trace_id_var.set(trace_id)
+    return trace_id
+
+
+@contextmanager
+def span(stage: str, logger: Optional[logging.Logger] = None):
+    """Time a pipeline stage into chat_stage_seconds and log its duration at debug level"""
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        STAGE_ERRORS.labels(stage).inc()
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.labels(stage).observe(elapsed)
+        (logger or logging.getLogger(__name__)).debug("%s took %.1f ms", stage, elapsed * 1000)
+
+
+def observe_stage(stage: str, seconds: float):
+    STAGE_SECONDS.labels(stage).observe(seconds)
+
+
+def record_usage(response):
+    """Count prompt and response tokens from a response's usage metadata, when present"""
+    usage = getattr(response, "usage_metadata", None)
+    if usage is None:
+        return
+    prompt_tokens = getattr(usage, "prompt_token_count", 0) or 0
+    response_tokens = getattr(usage, "candidates_token_count", 0) or 0
+    if prompt_tokens:
+        TOKENS.labels("prompt").inc(prompt_tokens)
+    if response_tokens:
+        TOKENS.labels("response").inc(response_tokens)
+
+
+def metrics_payload():
+    """(body, content type) for the /metrics endpoint"""
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -0,0 +1,306 @@
+import os
+import json
+import time
+import logging
+import tempfile
+import threading
+import contextvars
+from pathlib import Path
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Callable, List, Optional, Union
+import bcrypt
+from observability import PASSWORD_HASH_SECONDS, PASSWORD_HASH_REJECTED
+
+logger = logging.getLogger(__name__)
+
+StoredHash = Union[bytes, str]
+
+# Calibrated parameters, shared by every worker on the host (PASSWORD_HASH_PARAMS_PATH)
+DEFAULT_PARAMS_PATH = Path(__file__).parent / "password_hash_params.json"
+
+
+class HashingOverloaded(Exception):
+    """Raised when too many password hashes are already queued, or one waited past the pool's timeout"""
+
+
+def _measure_ms(fn: Callable, repeat: int = 3) -> float:
+    """Best-of-``repeat`` wall time of ``fn`` in milliseconds"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+class BcryptHasher:
+    name = "bcrypt"
+    # Stored hashes are only ever moved to a scheme of higher strength
+    strength = 1
+
+    def __init__(self, rounds: int = None):
+        self.rounds = rounds or int(os.getenv("BCRYPT_ROUNDS", "12"))
+
+    def hash(self, password: str) -> bytes:
+        return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds=self.rounds))
+
+    def verify(self, password: str, hashed: StoredHash) -> bool:
+        if isinstance(hashed, str):
+            hashed = hashed.encode('utf-8')
+        return bcrypt.checkpw(password.encode('utf-8'), hashed)
+
+    def identify(self, hashed: StoredHash) -> bool:
+        prefix = hashed[:2]
+        return prefix in (b"$2", "$2")
+
+    def needs_rehash(self, hashed: StoredHash) -> bool:
+        if isinstance(hashed, bytes):
+            hashed = hashed.decode('utf-8')
+        # Format: $2b$<cost>$<salt+hash>. Only weaker hashes are upgraded, so processes configured
+        # with different costs never keep rehashing each other's hashes
+        return int(hashed.split("$")[2]) < self.rounds
+
+    def params(self) -> dict:
+        return {"rounds": self.rounds}
+
+    @classmethod
+    def calibrate(cls, target_ms: float, min_rounds: int = 10, max_rounds: int = 16) -> "BcryptHasher":
+        """Pick the highest cost whose hash time stays within ``target_ms`` on this host"""
+        rounds = min_rounds
+        # Each extra round doubles the cost, so extrapolate from one measurement
+        elapsed = _measure_ms(lambda: cls(min_rounds).hash("calibration"))
+        while rounds < max_rounds and elapsed * 2 <= target_ms:
+            rounds += 1
+            elapsed *= 2
+        return cls(rounds)
+
+
+class Argon2Hasher:
+    name = "argon2id"
+    strength = 2
+
+    def __init__(self, time_cost: int = None, memory_cost: int = None, parallelism: int = 1):
+        from argon2 import PasswordHasher, Type
+        self.time_cost = time_cost or int(os.getenv("ARGON2_TIME_COST", "3"))
+        # KiB
+        self.memory_cost = memory_cost or int(os.getenv("ARGON2_MEMORY_COST", "65536"))
+        self.parallelism = parallelism
+        self._hasher = PasswordHasher(
+            time_cost=self.time_cost,
+            memory_cost=self.memory_cost,
+            parallelism=self.parallelism,
+            type=Type.ID,
+        )
+
+    def hash(self, password: str) -> str:
+        return self._hasher.hash(password)
+
+    def verify(self, password: str, hashed: StoredHash) -> bool:
+        from argon2.exceptions import VerificationError, InvalidHashError
+        if isinstance(hashed, bytes):
+            hashed = hashed.decode('utf-8')
+        try:
+            return self._hasher.verify(hashed, password)
+        except (VerificationError, InvalidHashError):
+            return False
+
+    def identify(self, hashed: StoredHash) -> bool:
+        prefix = hashed[:9]
+        return prefix in (b"$argon2id", "$argon2id")
+
+    def needs_rehash(self, hashed: StoredHash) -> bool:
+        from argon2 import extract_parameters
+        from argon2.exceptions import InvalidHashError
+        if isinstance(hashed, bytes):
+            hashed = hashed.decode('utf-8')
+        try:
+            params = extract_parameters(hashed)
+        except InvalidHashError:
+            return True
+        # Like bcrypt, only weaker hashes are upgraded
+        return params.time_cost < self.time_cost or params.memory_cost < self.memory_cost
+
+    def params(self) -> dict:
+        return {"time_cost": self.time_cost, "memory_cost": self.memory_cost, "parallelism": self.parallelism}
+
+    @classmethod
+    def calibrate(cls, target_ms: float, memory_cost: int = None, max_time_cost: int = 10) -> "Argon2Hasher":
+        """Keep the memory cost fixed and raise the number of passes up to ``target_ms``"""
+        hasher = cls(time_cost=1, memory_cost=memory_cost)
+        per_pass = _measure_ms(lambda: hasher.hash("calibration"))
+        time_cost = max(1, min(max_time_cost, int(target_ms // max(per_pass, 0.001))))
+        return cls(time_cost=time_cost, memory_cost=hasher.memory_cost)
+
+
+HASHERS = {BcryptHasher.name: BcryptHasher, Argon2Hasher.name: Argon2Hasher}
+
+
+def _load_params(path: Path, key: str) -> Optional[dict]:
+    try:
+        with open(path) as f:
+            return json.load(f).get(key)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def _save_params(path: Path, key: str, params: dict) -> dict:
+    """Store ``params`` unless another process got there first; returns the stored parameters"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with tempfile.NamedTemporaryFile("w", dir=path.parent, suffix=".tmp", delete=False) as f:
+        json.dump({key: params}, f)
+    try:
+        # Linking fails if the file exists, so the first calibration wins and the rest adopt it
+        os.link(f.name, path)
+    except FileExistsError:
+        stored = _load_params(path, key)
+        if stored is not None:
+            return stored
+        # Calibrated for another hasher or target; this one replaces it
+        os.replace(f.name, path)
+    finally:
+        if os.path.exists(f.name):
+            os.unlink(f.name)
+    return params
+
+
+def hasher_from_env():
+    """Build the preferred hasher from PASSWORD_HASHER, calibrated when PASSWORD_HASH_TARGET_MS is set.
+
+    Calibration runs once per host: the result is stored at
+    PASSWORD_HASH_PARAMS_PATH and reused by every later worker. To use the
+    same cost on every host, calibrate once (python password_hashing.py
+    calibrate <ms>) and set BCRYPT_ROUNDS or ARGON2_TIME_COST instead.
+    """
+    hasher_class = HASHERS[os.getenv("PASSWORD_HASHER", BcryptHasher.name)]
+    target_ms = os.getenv("PASSWORD_HASH_TARGET_MS")
+    if not target_ms:
+        return hasher_class()
+    path = Path(os.getenv("PASSWORD_HASH_PARAMS_PATH", DEFAULT_PARAMS_PATH))
+    key = f"{hasher_class.name}:{float(target_ms)}"
+    params = _load_params(path, key)
+    if params is None:
+        params = _save_params(path, key, hasher_class.calibrate(float(target_ms)).params())
+        logger.info("Calibrated %s to %s for %s ms per hash", hasher_class.name, params, target_ms)
+    return hasher_class(**params)
+
+
+class PasswordHashingPool:
+    """Runs password hashing on a dedicated, size-limited thread pool.
+
+    New hashes use ``hasher``; stored hashes of any known scheme can still be
+    verified and are reported as stale by needs_rehash. bcrypt and argon2
+    both release the GIL, so a few threads keep hashing off the request
+    threads' CPU budget. At most ``max_pending`` hashes may be running or
+    queued; beyond that requests are rejected with HashingOverloaded instead
+    of piling up behind a login storm.
+    """
+
+    def __init__(self, hasher=None, max_workers: int = None, max_pending: int = None,
+                 timeout: float = 10.0):
+        self.max_workers = max_workers or int(os.getenv("PASSWORD_HASH_WORKERS", os.cpu_count() or 1))
+        self.max_pending = max_pending or int(os.getenv("PASSWORD_HASH_MAX_PENDING", self.max_workers * 8))
+        self.hasher = hasher or hasher_from_env()
+        # Verifiers for every supported scheme, so older hashes keep working
+        self.verifiers: List = [self.hasher] + [
+            cls() for name, cls in HASHERS.items() if name != self.hasher.name
+        ]
+        self.timeout = timeout
+
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="password-hash")
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=1024)
+        self.completed = 0
+        self.rejected = 0
+
+    def run(self, fn: Callable, *args):
+        """Run ``fn(*args)`` on the pool and wait for its result"""
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            PASSWORD_HASH_REJECTED.labels("queue_full").inc()
+            raise HashingOverloaded("Password hashing queue is full")
+
+        def timed():
+            start = time.perf_counter()
+            try:
+                return fn(*args)
+            finally:
+                elapsed = time.perf_counter() - start
+                PASSWORD_HASH_SECONDS.observe(elapsed)
+                with self._lock:
+                    self._latencies.append(elapsed)
+                    self.completed += 1
+
+        try:
+            future = self._executor.submit(contextvars.copy_context().run, timed)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            # Drop it if it is still queued; the caller gets a 503 rather than a 500
+            future.cancel()
+            with self._lock:
+                self.rejected += 1
+            PASSWORD_HASH_REJECTED.labels("timeout").inc()
+            raise HashingOverloaded(f"Password hashing took longer than {self.timeout}s")
+
+    def _verifier(self, hashed: StoredHash):
+        for verifier in self.verifiers:
+            if verifier.identify(hashed):
+                return verifier
+        return None
+
+    def hash_password(self, password: str) -> StoredHash:
+        return self.run(self.hasher.hash, password)
+
+    def check_password(self, password: str, hashed: StoredHash) -> bool:
+        verifier = self._verifier(hashed)
+        if verifier is None:
+            return False
+        return self.run(verifier.verify, password, hashed)
+
+    def needs_rehash(self, hashed: StoredHash) -> bool:
+        """True when the hash uses a weaker scheme, or the configured scheme with weaker parameters.
+
+        Hashes of a stronger scheme are kept: configuring bcrypt never turns
+        argon2 hashes back into bcrypt ones.
+        """
+        if self.hasher.identify(hashed):
+            return self.hasher.needs_rehash(hashed)
+        verifier = self._verifier(hashed)
+        return verifier is None or verifier.strength < self.hasher.strength
+
+    def stats(self) -> dict:
+        """Hash latency percentiles (ms) over the most recent hashes"""
+        with self._lock:
+            latencies = sorted(self._latencies)
+            completed, rejected = self.completed, self.rejected
+
+        def percentile(p: float) -> float:
+            if not latencies:
+                return 0.0
+            return latencies[min(int(p * len(latencies)), len(latencies) - 1)] * 1000
+
+        return {
+            "completed": completed,
+            "rejected": rejected,
+            "hasher": self.hasher.name,
+            "params": self.hasher.params(),
+            "p50_ms": percentile(0.5),
+            "p99_ms": percentile(0.99),
+        }
+
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) == 3 and sys.argv[1] == "calibrate":
+        hasher_class = HASHERS[os.getenv("PASSWORD_HASHER", BcryptHasher.name)]
+        print(json.dumps(hasher_class.calibrate(float(sys.argv[2])).params()))
+    else:
+        print("Usage: python password_hashing.py calibrate <target_ms>")
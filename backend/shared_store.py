@@ -0,0 +1,119 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from pathlib import Path
+from collections import OrderedDict
+from typing import Any, Optional
+
+
+class MemoryStore:
+    """In-process store with the same interface as SqliteStore, bounded by LRU eviction"""
+
+    # Only this process reads and writes it
+    shared = False
+
+    def __init__(self, max_entries: int = 10000):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at is not None and expires_at < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        expires_at = time.time() + ttl if ttl else None
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key: str):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def delete_prefix(self, prefix: str):
+        with self._lock:
+            for key in [key for key in self._entries if key.startswith(prefix)]:
+                del self._entries[key]
+
+    def purge_expired(self):
+        now = time.time()
+        with self._lock:
+            for key in [key for key, (_, expires_at) in self._entries.items()
+                        if expires_at is not None and expires_at < now]:
+                del self._entries[key]
+
+
+class SqliteStore:
+    """Small key-value store in a local SQLite file, shared by every worker on the host.
+
+    Values are stored as JSON with an optional expiry time. Each thread (and
+    each process after a fork) opens its own connection.
+    """
+
+    # Other processes read and write it concurrently
+    shared = True
+
+    def __init__(self, path: Path, table: str = "cache"):
+        self.path = str(path)
+        self.table = table
+        self._local = threading.local()
+        with self._connection() as connection:
+            connection.execute(
+                f"CREATE TABLE IF NOT EXISTS {self.table} "
+                "(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL)"
+            )
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def get(self, key: str) -> Optional[Any]:
+        row = self._connection().execute(
+            f"SELECT value, expires_at FROM {self.table} WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        value, expires_at = row
+        if expires_at is not None and expires_at < time.time():
+            self.delete(key)
+            return None
+        return json.loads(value)
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        expires_at = time.time() + ttl if ttl else None
+        self._connection().execute(
+            f"INSERT OR REPLACE INTO {self.table} (key, value, expires_at) VALUES (?, ?, ?)",
+            (key, json.dumps(value), expires_at),
+        )
+
+    def delete(self, key: str):
+        self._connection().execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+
+    def delete_prefix(self, prefix: str):
+        self._connection().execute(
+            f"DELETE FROM {self.table} WHERE substr(key, 1, ?) = ?", (len(prefix), prefix)
+        )
+
+    def purge_expired(self):
+        self._connection().execute(
+            f"DELETE FROM {self.table} WHERE expires_at IS NOT NULL AND expires_at < ?", (time.time(),)
+        )
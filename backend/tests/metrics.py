@@ -0,0 +1,8 @@
+def sample(metric, suffix: str = "_total", **labels) -> float:
+    """Current value of one sample of a prometheus_client metric, 0 if it has not been recorded"""
+    name = metric._name + suffix
+    for family in metric.collect():
+        for s in family.samples:
+            if s.name == name and s.labels == labels:
+                return s.value
+    return 0.0
@@ -0,0 +1,159 @@
+import time
+import asyncio
+import threading
+import pytest
+from gcp.call_policy import CallPolicy, CallRejected, CallTimeout, RetryBudget
+from observability import MODEL_CALL_EVENTS, MODEL_CALLS_IN_FLIGHT
+from tests.metrics import sample
+
+
+def full_budget() -> RetryBudget:
+    return RetryBudget(ratio=0.1, min_per_second=0.0, max_balance=10.0)
+
+
+def empty_budget() -> RetryBudget:
+    budget = RetryBudget(ratio=0.0, min_per_second=0.0, max_balance=10.0)
+    budget._balance = 0.0
+    return budget
+
+
+def flaky(failures: int, error: Exception):
+    calls = []
+
+    def fn():
+        calls.append(1)
+        if len(calls) <= failures:
+            raise error
+        return len(calls)
+    return fn, calls
+
+
+def test_retry_budget_spends_whole_tokens():
+    budget = RetryBudget(ratio=0.5, min_per_second=0.0, max_balance=1.0)
+    assert budget.try_spend()
+    assert not budget.try_spend()
+    budget.record_call()
+    budget.record_call()
+    assert budget.try_spend()
+
+
+def test_retries_retryable_errors():
+    policy = CallPolicy("retried", deadline=5, backoff=0.001, budget=full_budget())
+    fn, calls = flaky(2, ConnectionError("reset"))
+    assert policy.call(fn) == 3
+    assert policy.stats()["retries"] == 2
+    assert sample(MODEL_CALL_EVENTS, policy="retried", event="call") == 1
+    assert sample(MODEL_CALL_EVENTS, policy="retried", event="retry") == 2
+    assert sample(MODEL_CALLS_IN_FLIGHT, "", policy="retried") == 0
+
+
+def test_does_not_retry_other_errors():
+    policy = CallPolicy("test", deadline=5, backoff=0.001, budget=full_budget())
+    fn, calls = flaky(1, ValueError("bad request"))
+    with pytest.raises(ValueError):
+        policy.call(fn)
+    assert len(calls) == 1
+
+
+def test_retries_stop_when_the_budget_is_spent():
+    policy = CallPolicy("test", deadline=5, backoff=0.001, budget=empty_budget())
+    fn, calls = flaky(1, ConnectionError("reset"))
+    with pytest.raises(ConnectionError):
+        policy.call(fn)
+    assert len(calls) == 1
+
+
+def test_attempt_timeout_and_deadline():
+    release = threading.Event()
+    policy = CallPolicy("test", deadline=0.3, attempt_timeout=0.1, backoff=0.001, budget=full_budget())
+    started = time.monotonic()
+    with pytest.raises(CallTimeout):
+        policy.call(release.wait, 5)
+    release.set()
+    assert time.monotonic() - started < 1
+    assert policy.stats()["timeouts"] >= 1
+
+
+def test_rejects_beyond_max_in_flight():
+    release = threading.Event()
+    policy = CallPolicy("test", deadline=5, max_attempts=1, max_in_flight=1, budget=full_budget())
+    blocker = threading.Thread(target=policy.call, args=(release.wait, 5))
+    blocker.start()
+    time.sleep(0.05)
+    with pytest.raises(CallRejected):
+        policy.call(lambda: None)
+    release.set()
+    blocker.join()
+    assert policy.stats()["rejected"] == 1
+
+
+def test_hedges_a_slow_attempt():
+    policy = CallPolicy("test", deadline=5, hedge=True, hedge_min_samples=1, budget=full_budget())
+    policy._latencies.append(0.01)
+    calls = []
+
+    def fn():
+        calls.append(1)
+        if len(calls) == 1:
+            time.sleep(0.5)
+            return "slow"
+        return "hedge"
+
+    started = time.monotonic()
+    assert policy.call(fn) == "hedge"
+    assert time.monotonic() - started < 0.4
+    assert policy.stats()["hedges"] == 1
+
+
+def test_call_async_times_out():
+    policy = CallPolicy("test", deadline=0.2, attempt_timeout=0.1, max_attempts=1, budget=full_budget())
+    with pytest.raises(CallTimeout):
+        asyncio.run(policy.call_async(asyncio.sleep, 5))
+
+
+def test_stream_passes_chunks_through():
+    policy = CallPolicy("test", deadline=5)
+    assert list(policy.stream(iter([1, 2, 3]), time.monotonic() + 5)) == [1, 2, 3]
+
+
+def test_stream_stalled_after_first_chunk_times_out_and_is_closed():
+    release = threading.Event()
+    closed = threading.Event()
+
+    def chunks():
+        try:
+            yield 1
+            release.wait(5)
+            yield 2
+        finally:
+            closed.set()
+
+    policy = CallPolicy("test", deadline=5)
+    received = []
+    with pytest.raises(CallTimeout):
+        for chunk in policy.stream(chunks(), time.monotonic() + 0.2):
+            received.append(chunk)
+    assert received == [1]
+    # The stalled read still holds the stream; it is closed once the read returns
+    release.set()
+    assert closed.wait(1)
+
+
+def test_stream_async_stalled_times_out_and_is_closed():
+    closed = []
+
+    async def chunks():
+        try:
+            yield 1
+            await asyncio.sleep(5)
+            yield 2
+        finally:
+            closed.append(True)
+
+    async def consume():
+        policy = CallPolicy("test", deadline=5)
+        return [chunk async for chunk in policy.stream_async(chunks(), time.monotonic() + 0.2)]
+
+    with pytest.raises(CallTimeout):
+        asyncio.run(consume())
+    assert closed == [True]
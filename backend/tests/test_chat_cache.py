@@ -0,0 +1,60 @@
+import datetime
+from chat_cache import ChatCache, chat_title
+from shared_store import MemoryStore, SqliteStore
+
+NOW = datetime.datetime(2024, 1, 1, 12, 0)
+
+
+def test_chat_title_is_shortened():
+    assert chat_title("  Guns   should be banned ") == "Guns should be banned"
+    title = chat_title("word " * 40)
+    assert len(title) == 60 and title.endswith("…")
+
+
+def test_private_store_appends_new_messages():
+    cache = ChatCache(MemoryStore(), recent_messages=2)
+    cache.chat_created("a@b.c", "chat", NOW)
+    for message in ("one", "two", "three"):
+        cache.message_added("a@b.c", "chat", message, NOW)
+    assert cache.get_recent("a@b.c", "chat") == {
+        "start": 1, "messages": [{"seq": 1, "message": "two"}, {"seq": 2, "message": "three"}]
+    }
+
+
+def test_private_store_keeps_the_chat_list_up_to_date():
+    cache = ChatCache(MemoryStore())
+    cache.set_chats("a@b.c", [{"chat_id": "old", "count": 2, "created_at": NOW, "updated_at": NOW}])
+    cache.chat_created("a@b.c", "new", NOW)
+    assert [chat["chat_id"] for chat in cache.get_chats("a@b.c")] == ["new", "old"]
+    cache.chat_deleted("a@b.c", "old")
+    assert [chat["chat_id"] for chat in cache.get_chats("a@b.c")] == ["new"]
+    # Message counts change with every message, so the list is reloaded instead
+    cache.message_added("a@b.c", "new", "hello", NOW)
+    assert cache.get_chats("a@b.c") is None
+
+
+def test_shared_store_invalidates_instead_of_updating(tmp_path):
+    store = SqliteStore(tmp_path / "chat-cache.sqlite3", table="chat_cache")
+    worker, other_worker = ChatCache(store), ChatCache(store)
+    worker.set_recent("a@b.c", "chat", [{"seq": 0, "message": "one"}], 1)
+    worker.set_chats("a@b.c", [{"chat_id": "chat", "count": 1, "created_at": NOW, "updated_at": NOW}])
+
+    # Another worker's message must not be appended under a locally guessed seq
+    other_worker.message_added("a@b.c", "chat", "two", NOW)
+    assert worker.get_recent("a@b.c", "chat") is None
+    assert worker.get_chats("a@b.c") is None
+
+    worker.set_chats("a@b.c", [{"chat_id": "chat", "count": 2, "created_at": NOW, "updated_at": NOW}])
+    other_worker.chat_created("a@b.c", "second", NOW)
+    assert worker.get_chats("a@b.c") is None
+
+
+def test_user_deleted_drops_every_entry():
+    cache = ChatCache(MemoryStore())
+    cache.set_chats("a@b.c", [])
+    cache.set_recent("a@b.c", "one", [], 0)
+    cache.set_recent("a@b.c", "two", [], 0)
+    cache.user_deleted("a@b.c")
+    assert cache.get_chats("a@b.c") is None
+    assert cache.get_recent("a@b.c", "one") is None
+    assert cache.get_recent("a@b.c", "two") is None
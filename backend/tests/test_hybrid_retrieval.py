@@ -0,0 +1,83 @@
+import json
+import numpy as np
+import pytest
+from gcp.hybrid_retrieval import BM25Index, HybridRetriever, RRF_K, tokenize
+from gcp.local_retrieval import HashingEmbedder
+from gcp.retrieval_config import RetrievalConfig
+
+CHUNKS = {
+    "gene_editing/for": [
+        "CRISPR editing of human embryos could prevent inherited disease.",
+        "Gene therapy has already cured some forms of blindness.",
+    ],
+    "gene_editing/neutral": [
+        "Regulators debate how the technology should be governed.",
+        "Public opinion on the subject is divided.",
+    ],
+    # Not part of the gene_editing/for corpus
+    "gene_editing/against": [
+        "Editing human embryos risks unintended mutations.",
+    ],
+}
+
+
+@pytest.fixture
+def retriever(tmp_path):
+    """A HybridRetriever over a small index in the layout IngestionPipeline writes"""
+    embedder = HashingEmbedder(256)
+    chunks, ranges = [], {}
+    for folder, texts in CHUNKS.items():
+        ranges[folder] = (len(chunks), len(chunks) + len(texts))
+        chunks.extend({"text": text, "title": folder, "source": folder} for text in texts)
+    np.save(tmp_path / "embeddings.npy", embedder.embed(chunk["text"] for chunk in chunks))
+    with open(tmp_path / "metadata.json", "w") as f:
+        json.dump({"dim": embedder.dim, "chunks": chunks, "ranges": ranges}, f)
+    config = RetrievalConfig(overrides={"default": {"similarity_top_k": 10, "candidates": 10}})
+    return HybridRetriever(tmp_path, config, rerank=False)
+
+
+def dense_ranking(retriever, query):
+    """Texts of the gene_editing/for corpus, best dense match first"""
+    rows = retriever.corpus_rows("gene_editing", "for")
+    similarities = retriever.index.embedder.embed([query]) @ retriever.index.embeddings[rows].T
+    return [retriever.index.chunks[row]["text"] for row in rows[retriever.top(similarities[0], len(rows))]]
+
+
+def test_tokenize_drops_stopwords():
+    assert tokenize("What is the case for CRISPR's use?") == ["case", "crispr's", "use"]
+
+
+def test_bm25_scores_only_chunks_sharing_a_term():
+    index = BM25Index(["crispr cures disease", "crispr crispr crispr", "taxes and spending"])
+    scores = index.scores(tokenize("crispr disease"))
+    assert scores[0] > scores[1] > 0
+    assert scores[2] == 0
+    assert not index.scores(tokenize("the of and")).any()
+
+
+def test_top_returns_best_first():
+    assert HybridRetriever.top(np.array([0.1, 0.9, 0.5]), 2).tolist() == [1, 2]
+    assert HybridRetriever.top(np.array([0.1, 0.9]), 5).tolist() == [1, 0]
+    assert len(HybridRetriever.top(np.zeros(0), 3)) == 0
+
+
+def test_chunks_without_query_terms_get_no_bm25_rank(retriever):
+    # Only stopwords, so BM25 scores every chunk 0; only the dense ranking may contribute
+    query = "what is it all about"
+    contexts = retriever.retrieve(query, "gene_editing", "for")
+    assert [c["text"] for c in contexts] == dense_ranking(retriever, query)
+    assert [c["score"] for c in contexts] == pytest.approx([1 / (RRF_K + rank + 1) for rank in range(4)])
+
+
+def test_rrf_adds_the_ranks_from_both_retrievers(retriever):
+    query = "inherited disease"
+    contexts = retriever.retrieve(query, "gene_editing", "for")
+    texts = [c["text"] for c in contexts]
+    assert texts[0] == CHUNKS["gene_editing/for"][0]
+    assert CHUNKS["gene_editing/against"][0] not in texts
+
+    dense = dense_ranking(retriever, query)
+    expected = {text: 1 / (RRF_K + rank + 1) for rank, text in enumerate(dense)}
+    # The one chunk containing the query terms is BM25's only, and so first, candidate
+    expected[CHUNKS["gene_editing/for"][0]] += 1 / (RRF_K + 1)
+    assert {c["text"]: c["score"] for c in contexts} == pytest.approx(expected)
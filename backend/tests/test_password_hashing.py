@@ -0,0 +1,61 @@
+import threading
+import pytest
+from observability import PASSWORD_HASH_REJECTED, PASSWORD_HASH_SECONDS
+from password_hashing import Argon2Hasher, BcryptHasher, HashingOverloaded, PasswordHashingPool
+from tests.metrics import sample
+
+
+@pytest.fixture
+def pool():
+    return PasswordHashingPool(hasher=BcryptHasher(rounds=4), max_workers=1, max_pending=1, timeout=0.2)
+
+
+def test_hash_and_check(pool):
+    before = sample(PASSWORD_HASH_SECONDS, "_count")
+    hashed = pool.hash_password("secret")
+    assert pool.check_password("secret", hashed)
+    assert not pool.check_password("wrong", hashed)
+    assert sample(PASSWORD_HASH_SECONDS, "_count") == before + 3
+    assert pool.stats()["completed"] == 3
+
+
+def test_full_queue_is_rejected(pool):
+    started, release = threading.Event(), threading.Event()
+
+    def hold():
+        started.set()
+        release.wait(1)
+
+    before = sample(PASSWORD_HASH_REJECTED, reason="queue_full")
+    holder = threading.Thread(target=pool.run, args=(hold,))
+    holder.start()
+    started.wait(1)
+    with pytest.raises(HashingOverloaded):
+        pool.hash_password("secret")
+    release.set()
+    holder.join()
+    assert sample(PASSWORD_HASH_REJECTED, reason="queue_full") == before + 1
+
+
+def test_slow_hash_times_out(pool):
+    release = threading.Event()
+    before = sample(PASSWORD_HASH_REJECTED, reason="timeout")
+    with pytest.raises(HashingOverloaded):
+        pool.run(release.wait, 1)
+    release.set()
+    assert sample(PASSWORD_HASH_REJECTED, reason="timeout") == before + 1
+    assert pool.stats()["rejected"] == 1
+
+
+def test_only_weaker_hashes_are_upgraded():
+    bcrypt_pool = PasswordHashingPool(hasher=BcryptHasher(rounds=5))
+    assert bcrypt_pool.needs_rehash(BcryptHasher(rounds=4).hash("secret"))
+    assert not bcrypt_pool.needs_rehash(BcryptHasher(rounds=5).hash("secret"))
+    assert not bcrypt_pool.needs_rehash(BcryptHasher(rounds=6).hash("secret"))
+    # A stronger scheme is never downgraded
+    assert not bcrypt_pool.needs_rehash(Argon2Hasher(time_cost=1, memory_cost=8).hash("secret"))
+
+    argon2_pool = PasswordHashingPool(hasher=Argon2Hasher(time_cost=2, memory_cost=16))
+    assert argon2_pool.needs_rehash(BcryptHasher(rounds=4).hash("secret"))
+    assert argon2_pool.needs_rehash(Argon2Hasher(time_cost=1, memory_cost=16).hash("secret"))
+    assert not argon2_pool.needs_rehash(Argon2Hasher(time_cost=2, memory_cost=32).hash("secret"))
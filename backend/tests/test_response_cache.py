@@ -0,0 +1,54 @@
+import time
+from gcp.response_cache import ResponseCache
+from observability import RESPONSE_CACHE_LOOKUPS
+from tests.metrics import sample
+
+CITATIONS = [{"uri": "gs://papers/a.pdf", "title": "A"}]
+
+
+def cache(**kwargs) -> ResponseCache:
+    return ResponseCache(enabled=True, mode="serve", similarity=0.9, **kwargs)
+
+
+def test_similar_opening_hits():
+    c = cache()
+    c.put("gun_laws", "for", "Guns should be banned in cities", "answer", CITATIONS)
+    assert c.lookup("gun_laws", "for", "guns should be banned in cities!").response == "answer"
+    assert c.lookup("gun_laws", "against", "Guns should be banned in cities") is None
+    assert c.lookup("gun_laws", "for", "Immigration helps the economy") is None
+
+
+def test_ungrounded_responses_are_not_stored():
+    c = cache()
+    c.put("gun_laws", "for", "Guns should be banned", "answer", [])
+    assert c.lookup("gun_laws", "for", "Guns should be banned") is None
+
+
+def test_oldest_entries_are_evicted_per_key():
+    c = cache(max_per_key=2)
+    for i, message in enumerate(["alpha beta gamma", "delta epsilon zeta", "eta theta iota"]):
+        c.put("ubi", "for", message, f"answer {i}", CITATIONS)
+    assert c.lookup("ubi", "for", "alpha beta gamma") is None
+    assert c.lookup("ubi", "for", "delta epsilon zeta").response == "answer 1"
+    assert c.lookup("ubi", "for", "eta theta iota").response == "answer 2"
+    assert c.stats()["size"] == 2
+
+
+def test_entries_expire():
+    c = cache(ttl=0.05)
+    c.put("ubi", "for", "alpha beta gamma", "answer", CITATIONS)
+    time.sleep(0.1)
+    assert c.lookup("ubi", "for", "alpha beta gamma") is None
+    assert c.stats()["size"] == 0
+
+
+def test_lookups_are_counted_per_subject():
+    c = cache()
+    hits = sample(RESPONSE_CACHE_LOOKUPS, subject="gene_editing", result="hit")
+    misses = sample(RESPONSE_CACHE_LOOKUPS, subject="gene_editing", result="miss")
+    c.lookup("gene_editing", "for", "CRISPR is unethical")
+    c.put("gene_editing", "for", "CRISPR is unethical", "answer", CITATIONS)
+    c.lookup("gene_editing", "for", "CRISPR is unethical")
+    assert sample(RESPONSE_CACHE_LOOKUPS, subject="gene_editing", result="hit") == hits + 1
+    assert sample(RESPONSE_CACHE_LOOKUPS, subject="gene_editing", result="miss") == misses + 1
+    assert c.stats()["subjects"]["gene_editing"]["hit_rate"] == 0.5
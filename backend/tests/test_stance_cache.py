@@ -0,0 +1,47 @@
+from gcp.stance_cache import FALLBACK_RESULT, StanceCache
+from observability import STANCE_CACHE_LOOKUPS
+from shared_store import SqliteStore
+from tests.metrics import sample
+
+
+def test_trivial_variants_share_an_entry():
+    cache = StanceCache()
+    cache.put("Guns should be banned!", ("against", "gun_laws"))
+    assert cache.get("  guns SHOULD be banned ") == ("against", "gun_laws")
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = StanceCache(max_entries=2)
+    cache.put("one", ("for", "ubi"))
+    cache.put("two", ("for", "ubi"))
+    assert cache.get("one") is not None
+    cache.put("three", ("for", "ubi"))
+    assert cache.get("two") is None
+    assert cache.get("one") is not None
+    assert cache.get("three") is not None
+    assert cache.stats()["size"] == 2
+
+
+def test_fallback_result_is_not_cached():
+    cache = StanceCache()
+    cache.put("unclear", FALLBACK_RESULT)
+    assert cache.get("unclear") is None
+
+
+def test_shared_store_serves_other_workers(tmp_path):
+    store = SqliteStore(tmp_path / "stance.sqlite3")
+    StanceCache(shared_store=store).put("AI needs rules", ("against", "artificial_intelligence_regulation"))
+    other = StanceCache(shared_store=store)
+    shared_hits = sample(STANCE_CACHE_LOOKUPS, result="shared_hit")
+    hits = sample(STANCE_CACHE_LOOKUPS, result="hit")
+    assert other.get("AI needs rules") == ("against", "artificial_intelligence_regulation")
+    # Now held locally as well
+    assert other.get("AI needs rules") == ("against", "artificial_intelligence_regulation")
+    assert sample(STANCE_CACHE_LOOKUPS, result="shared_hit") == shared_hits + 1
+    assert sample(STANCE_CACHE_LOOKUPS, result="hit") == hits + 1
+
+
+def test_misses_are_counted():
+    misses = sample(STANCE_CACHE_LOOKUPS, result="miss")
+    StanceCache().get("never seen")
+    assert sample(STANCE_CACHE_LOOKUPS, result="miss") == misses + 1
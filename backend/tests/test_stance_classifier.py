@@ -0,0 +1,51 @@
+import pytest
+from gcp.stance_classifier import StanceClassifier
+
+
+@pytest.fixture(scope="module")
+def classifier():
+    return StanceClassifier()
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("I support universal healthcare", ("for", "universal_healthcare")),
+    ("Abortion is a human right", ("for", "abortion")),
+    ("Guns should be banned", ("for", "gun_laws")),
+    ("Immigrants should be deported", ("against", "immigration")),
+    ("UBI is a waste of money", ("against", "universal_basic_income")),
+    ("Gene editing is unethical", ("against", "gene_editing")),
+])
+def test_clear_stances(classifier, text, expected):
+    assert classifier.classify(text) == expected
+
+
+@pytest.mark.parametrize("text", [
+    "Banning guns is wrong",
+    "Gun bans are bad",
+    "Deportation is wrong",
+    "Banning abortion harms women",
+    "Restricting immigration hurts the economy",
+    "Regulating AI stifles innovation",
+    "Medicaid cuts hurt families",
+])
+def test_judgement_of_a_restriction_is_left_to_the_model(classifier, text):
+    assert classifier.classify(text) is None
+
+
+@pytest.mark.parametrize("text", [
+    "I don't think guns should be banned",
+    "I don’t think guns should be banned",
+    "Banning guns will not reduce crime",
+    "Abortion is never a good idea",
+])
+def test_negated_cues_are_left_to_the_model(classifier, text):
+    assert classifier.classify(text) is None
+
+
+def test_mixed_cues_are_left_to_the_model(classifier):
+    assert classifier.classify("UBI helps some people but is too expensive") is None
+
+
+def test_unknown_or_tied_subject(classifier):
+    assert classifier.classify("I like turtles") is None
+    assert classifier.classify("Guns and abortion are both good") is None
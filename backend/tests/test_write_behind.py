@@ -0,0 +1,121 @@
+import time
+import threading
+import pytest
+from observability import WRITE_BEHIND_FAILURES
+from tests.metrics import sample
+from write_behind import WriteBehindBuffer
+
+
+class Store:
+    """write_fn that records batches and fails while ``failing`` is set"""
+
+    def __init__(self):
+        self.batches = []
+        self.failing = False
+        self.written = threading.Event()
+
+    def __call__(self, batch):
+        if self.failing:
+            raise ConnectionError("database unavailable")
+        self.batches.append(batch)
+        self.written.set()
+
+    def items(self, key):
+        return [item for batch in self.batches for item in batch.get(key, [])]
+
+
+def buffer(store, tmp_path, **kwargs) -> WriteBehindBuffer:
+    options = {"max_batch": 100, "flush_interval": 10, "sync": False, "retry_backoff": 0.01,
+               "spill_dir": tmp_path / "spill"}
+    options.update(kwargs)
+    return WriteBehindBuffer(store, **options)
+
+
+def test_flush_writes_per_key_in_order(tmp_path):
+    store = Store()
+    writes = buffer(store, tmp_path)
+    for i in range(3):
+        writes.add("a", i)
+    writes.add("b", "x")
+    assert store.batches == []
+    writes.flush(["a"])
+    assert store.batches == [{"a": [0, 1, 2]}]
+    writes.flush()
+    assert store.items("b") == ["x"]
+    assert writes.stats()["pending"] == 0
+
+
+def test_full_batch_is_flushed_in_the_background(tmp_path):
+    store = Store()
+    writes = buffer(store, tmp_path, max_batch=2)
+    writes.add("a", 1)
+    writes.add("a", 2)
+    assert store.written.wait(1)
+    assert store.items("a") == [1, 2]
+
+
+def test_failed_writes_are_retried_not_dropped(tmp_path):
+    store = Store()
+    writes = buffer(store, tmp_path)
+    failures = sample(WRITE_BEHIND_FAILURES)
+    store.failing = True
+    writes.add("a", 1)
+    for _ in range(10):
+        assert not writes.flush()
+    writes.add("a", 2)
+    assert writes.stats() == {"pending": 2, "flushes": 0, "written": 0, "failed": 10, "spilled": 0}
+    assert sample(WRITE_BEHIND_FAILURES) == failures + 10
+
+    store.failing = False
+    assert writes.flush()
+    # Retried items keep their place ahead of later ones
+    assert store.items("a") == [1, 2]
+
+
+def test_background_retries_back_off(tmp_path):
+    store = Store()
+    writes = buffer(store, tmp_path, max_batch=1, retry_backoff=0.2)
+    store.failing = True
+    writes.add("a", 1)
+    time.sleep(0.1)
+    # The first attempt failed and the next one waits out the backoff
+    assert writes.stats()["failed"] == 1
+    store.failing = False
+    assert store.written.wait(1)
+    assert store.items("a") == [1]
+
+
+def test_unwritten_items_are_spilled_at_exit_and_recovered(tmp_path):
+    store = Store()
+    writes = buffer(store, tmp_path, max_attempts=2)
+    store.failing = True
+    writes.add(("user", "chat"), {"message": "hello", "seq": 0})
+    writes.close()
+    assert writes.stats()["spilled"] == 1
+    assert len(list((tmp_path / "spill").glob("*.pickle"))) == 1
+
+    restarted = buffer(Store(), tmp_path)
+    restarted.add(("user", "chat"), {"message": "again", "seq": 1})
+    restarted.flush()
+    assert restarted.write_fn.items(("user", "chat")) == [{"message": "hello", "seq": 0}, {"message": "again", "seq": 1}]
+    assert list((tmp_path / "spill").iterdir()) == []
+
+
+def test_discard_drops_pending_writes(tmp_path):
+    store = Store()
+    writes = buffer(store, tmp_path)
+    writes.add("a", 1)
+    writes.add("b", 2)
+    writes.discard(writes.keys_for(lambda key: key == "a"))
+    writes.flush()
+    assert store.batches == [{"b": [2]}]
+
+
+def test_sync_mode_writes_immediately(tmp_path):
+    store = Store()
+    writes = buffer(store, tmp_path, sync=True)
+    writes.add("a", 1)
+    assert store.batches == [{"a": [1]}]
+    store.failing = True
+    with pytest.raises(ConnectionError):
+        writes.add("a", 2)
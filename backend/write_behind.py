@@ -0,0 +1,239 @@
+import logging
+import os
+import time
+import uuid
+import atexit
+import pickle
+import threading
+from pathlib import Path
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Optional
+from observability import WRITE_BEHIND_FAILURES, WRITE_BEHIND_SPILLED
+
+logger = logging.getLogger(__name__)
+
+# write_fn receives {key: [item, ...]} with each key's items in insertion order
+WriteFn = Callable[[Dict[Hashable, List[Any]]], None]
+
+# Writes still failing at exit, kept for the next process (WRITE_BEHIND_SPILL_DIR)
+DEFAULT_SPILL_DIR = Path(__file__).parent / "write_behind_spill"
+
+
+class WriteBehindBuffer:
+    """Collects writes per key and hands them to ``write_fn`` in batches.
+
+    A background thread flushes once ``max_batch`` items are pending or the
+    oldest one has waited ``flush_interval`` seconds. Flushes run one at a
+    time so per-key order is preserved. Callers have already been told their
+    writes succeeded, so a failed batch is never dropped: it is put back and
+    retried with exponential backoff for as long as the process runs. At
+    exit, pending items get ``max_attempts`` more tries; whatever still fails
+    is pickled into ``spill_dir`` and written by the next process that
+    starts a buffer there. Retries pass the same item objects, so
+    ``write_fn`` can record on an item what it assigned (e.g. a sequence
+    number) and retry idempotently. With ``sync=True`` every add is written
+    immediately, which keeps tests and scripts deterministic.
+    """
+
+    def __init__(self, write_fn: WriteFn, max_batch: int = None, flush_interval: float = None,
+                 sync: bool = None, max_attempts: int = 5, retry_backoff: float = 0.5,
+                 max_retry_backoff: float = 30.0, spill_dir: Optional[Path] = None):
+        self.write_fn = write_fn
+        self.max_batch = max_batch or int(os.getenv("WRITE_BEHIND_MAX_BATCH", "64"))
+        self.flush_interval = flush_interval if flush_interval is not None else \
+            float(os.getenv("WRITE_BEHIND_FLUSH_MS", "50")) / 1000
+        self.sync = sync if sync is not None else os.getenv("WRITE_BEHIND_SYNC", "0") == "1"
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self.max_retry_backoff = max_retry_backoff
+        self.spill_dir = Path(spill_dir or os.getenv("WRITE_BEHIND_SPILL_DIR", DEFAULT_SPILL_DIR))
+
+        self._lock = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._pending: "OrderedDict[Hashable, List[Any]]" = OrderedDict()
+        self._count = 0
+        self._oldest: Optional[float] = None
+        # Consecutive failed flushes, and when the flusher may try again
+        self._failures = 0
+        self._retry_at = 0.0
+        self._thread: Optional[threading.Thread] = None
+        self._pid: Optional[int] = None
+        self._closed = False
+        self.flushes = 0
+        self.written = 0
+        self.failed = 0
+        self.spilled = 0
+        atexit.register(self.close)
+
+    def add(self, key: Hashable, item: Any):
+        if self.sync or self._closed:
+            with self._flush_lock:
+                self.write_fn({key: [item]})
+                self.written += 1
+            return
+
+        with self._lock:
+            self._ensure_thread()
+            self._append(key, [item])
+            if self._count >= self.max_batch:
+                self._lock.notify()
+
+    def _append(self, key: Hashable, items: List[Any], front: bool = False):
+        # Failed items go in front of anything added since, to keep per-key order
+        self._pending[key] = items + self._pending.get(key, []) if front else self._pending.get(key, []) + items
+        self._count += len(items)
+        if self._oldest is None:
+            self._oldest = time.monotonic()
+
+    def _ensure_thread(self):
+        # Threads do not survive a fork, so each process starts its own flusher
+        if self._thread is None or self._pid != os.getpid():
+            self._pending.clear()
+            self._count = 0
+            self._oldest = None
+            self._failures = 0
+            self._retry_at = 0.0
+            self._pid = os.getpid()
+            self._recover()
+            self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._lock:
+                while not self._closed:
+                    if self._oldest is not None:
+                        due = max(self._retry_at, self._oldest + self.flush_interval)
+                        if self._count >= self.max_batch:
+                            due = self._retry_at
+                        remaining = due - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        self._lock.wait(remaining)
+                    else:
+                        self._lock.wait()
+                if self._closed:
+                    return
+            self.flush()
+
+    def _take(self, keys: Optional[Iterable[Hashable]]) -> Dict[Hashable, List[Any]]:
+        with self._lock:
+            if self._pid != os.getpid():
+                # Anything pending was inherited from the parent, which writes it itself
+                self._pending.clear()
+                self._count = 0
+                self._oldest = None
+                return {}
+            if keys is None:
+                batch = dict(self._pending)
+                self._pending.clear()
+            else:
+                batch = {key: self._pending.pop(key) for key in keys if key in self._pending}
+            self._count -= sum(len(items) for items in batch.values())
+            self._oldest = time.monotonic() if self._count else None
+            return batch
+
+    def flush(self, keys: Optional[Iterable[Hashable]] = None) -> bool:
+        """Write everything pending, or only the given keys; returns False if the write failed"""
+        with self._flush_lock:
+            batch = self._take(keys)
+            if not batch:
+                return True
+            try:
+                self.write_fn(batch)
+            except Exception as e:
+                self._requeue(batch, e)
+                return False
+            self.flushes += 1
+            self.written += sum(len(items) for items in batch.values())
+            with self._lock:
+                self._failures = 0
+                self._retry_at = 0.0
+            return True
+
+    def _requeue(self, batch: Dict[Hashable, List[Any]], error: Exception):
+        count = sum(len(items) for items in batch.values())
+        WRITE_BEHIND_FAILURES.inc()
+        with self._lock:
+            self.failed += 1
+            self._failures += 1
+            backoff = min(self.max_retry_backoff, self.retry_backoff * 2 ** (self._failures - 1))
+            self._retry_at = time.monotonic() + backoff
+            for key, items in batch.items():
+                self._append(key, items, front=True)
+        logger.warning("Write-behind flush of %d writes failed (%d in a row), retrying in %.1fs: %s",
+                       count, self._failures, backoff, error)
+
+    def _spill(self):
+        """Save whatever is still pending for the next process; called at exit"""
+        batch = self._take(None)
+        if not batch:
+            return
+        count = sum(len(items) for items in batch.values())
+        try:
+            self.spill_dir.mkdir(parents=True, exist_ok=True)
+            path = self.spill_dir / f"{os.getpid()}-{uuid.uuid4().hex}.pickle"
+            temp = path.with_suffix(".tmp")
+            with open(temp, "wb") as f:
+                pickle.dump(batch, f)
+            os.replace(temp, path)
+        except OSError as e:
+            logger.error("Lost %d writes: could not save them to %s: %s", count, self.spill_dir, e)
+            return
+        self.spilled += count
+        WRITE_BEHIND_SPILLED.inc(count)
+        logger.error("Saved %d unwritten writes to %s for the next start", count, path)
+
+    def _recover(self):
+        """Queue writes spilled by an earlier process; each file is claimed by exactly one process"""
+        try:
+            paths = sorted(self.spill_dir.glob("*.pickle"))
+        except OSError:
+            return
+        for path in paths:
+            claimed = path.with_suffix(f".{os.getpid()}.claimed")
+            try:
+                # Only one process can rename the file, so no write is replayed twice
+                os.rename(path, claimed)
+            except FileNotFoundError:
+                continue
+            try:
+                with open(claimed, "rb") as f:
+                    batch = pickle.load(f)
+            except (OSError, pickle.UnpicklingError, EOFError) as e:
+                logger.error("Could not recover spilled writes from %s: %s", claimed, e)
+                continue
+            for key, items in batch.items():
+                self._append(key, items)
+            os.unlink(claimed)
+            logger.info("Recovered %d spilled writes from %s", sum(len(items) for items in batch.values()), path)
+
+    def keys_for(self, predicate: Callable[[Hashable], bool]) -> List[Hashable]:
+        with self._lock:
+            return [key for key in self._pending if predicate(key)]
+
+    def discard(self, keys: Iterable[Hashable]):
+        """Drop pending writes for the given keys, e.g. when the chat is deleted"""
+        with self._flush_lock:
+            self._take(keys)
+
+    def close(self):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._lock.notify_all()
+        if self._pid == os.getpid():
+            for attempt in range(self.max_attempts):
+                if self.flush():
+                    if not self._count:
+                        return
+                elif attempt + 1 < self.max_attempts:
+                    time.sleep(self.retry_backoff)
+            self._spill()
+
+    def stats(self) -> dict:
+        with self._lock:
+            pending = self._count
+        return {"pending": pending, "flushes": self.flushes, "written": self.written,
+                "failed": self.failed, "spilled": self.spilled}
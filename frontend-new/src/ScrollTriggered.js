@@ -178,10 +178,27 @@ function SkeletonCard() {
 }
 
 export default function ScrollTriggered() {
-  const [cards, setCards] = useState([conversation[0]]);
+  const [cards, setCards] = useState(() => {
+    // Every mount starts a new conversation
+    conversation = [[""]];
+    return [conversation[0]];
+  });
   console.log("very start", conversation);
   const [index, setIndex] = useState(0);
   const [isLoading, setIsLoading] = useState(false);
+  // Assigned by the backend on the first message of a conversation
+  const [chatId, setChatId] = useState(null);
+  // Bumped for each new conversation so the cards remount with empty inputs
+  const [conversationKey, setConversationKey] = useState(0);
+
+  const startNewConversation = () => {
+    conversation = [[""]];
+    setChatId(null);
+    setCards([conversation[0]]);
+    setIndex(0);
+    setConversationKey(prev => prev + 1);
+  };
+
   const handleAddCard1 = async () => {
     // if (index + 1 >= conversation.length) return;
     
@@ -229,17 +246,29 @@ export default function ScrollTriggered() {
         <Card 
           i={i} 
           text={text}
-          key={i} 
+          key={`${conversationKey}-${i}`} 
+          chatId={chatId}
+          onChatId={setChatId}
           onSubmit={handleAddCard1}
           user={user}
         />
       ))}
       {isLoading && <SkeletonCard />}
+      {chatId && !isLoading && (
+        <motion.button
+          style={newConversationButton}
+          whileHover={{ scale: 1.05 }}
+          whileTap={{ scale: 0.95 }}
+          onClick={startNewConversation}
+        >
+          New conversation
+        </motion.button>
+      )}
     </div>
   );
 }
 
-function Card({ text, i, onSubmit }) {
+function Card({ text, i, chatId, onChatId, onSubmit }) {
   const [inputText, setInputText] = useState("");
   const [submittedText, setSubmittedText] = useState("");
 
@@ -251,6 +280,7 @@ function Card({ text, i, onSubmit }) {
       // Create the JSON object
       const data = {
         submittedText: inputText,
+        chatId: chatId,
       };
   
       // Send the JSON object to the Flask endpoint
@@ -270,6 +300,7 @@ function Card({ text, i, onSubmit }) {
         })
         .then((data) => {
           console.log("Successfully submitted:", data);
+          onChatId(data.chatId);
           // console.log(conversation);
           // Update the state to reflect the submission
           conversation[conversation.length - 1] = [inputText];
@@ -551,6 +582,18 @@ const iconWhite = {
   alignItems: "center",
 }
 
+const newConversationButton = {
+  display: "block",
+  margin: "30px auto",
+  padding: "10px 20px",
+  fontSize: "16px",
+  borderRadius: "8px",
+  border: "1px solid #ccc",
+  backgroundColor: "white",
+  boxShadow: "0px 4px 6px rgba(0, 0, 0, 0.1)",
+  cursor: "pointer",
+}
+
 let conversation = [
   [""],
 ];